@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Benchmarks DBFFile against reader() on a generated DBF shaped like a TIGER
+featnames file, measuring time and memory, and checks that both return the
+same records.
+
+    python bench_dbf.py [num_records]
+
+num_records defaults to 2,000,000. Each reader runs in its own process, and
+its memory is measured as RssAnon from /proc/self/status (Linux only) once
+it has loaded the file, so the pages of the file itself, which DBFFile maps
+into memory and the kernel can drop at any time, aren't counted.
+"""
+
+from ebdata.parsing import dbf
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+FIELDNAMES = ['TLID', 'FULLNAME', 'NAME', 'PREDIRABRV', 'PRETYPABRV', 'PREQUALABR', 'SUFDIRABRV',
+              'SUFTYPABRV', 'SUFQUALABR', 'PREDIR', 'PRETYP', 'PREQUAL', 'SUFDIR', 'SUFTYP',
+              'SUFQUAL', 'LINEARID', 'MTFCC', 'PAFLAG']
+FIELDSPECS = [('N', 10, 0), ('C', 100, 0), ('C', 100, 0), ('C', 15, 0), ('C', 50, 0), ('C', 15, 0),
+              ('C', 15, 0), ('C', 50, 0), ('C', 15, 0), ('C', 2, 0), ('C', 3, 0), ('C', 3, 0),
+              ('C', 2, 0), ('C', 3, 0), ('C', 3, 0), ('C', 22, 0), ('C', 5, 0), ('C', 1, 0)]
+# The fields TigerImporter uses.
+PROJECTION = ['LINEARID', 'TLID', 'MTFCC', 'NAME', 'PREDIRABRV', 'SUFTYPABRV', 'SUFDIRABRV']
+
+class GeneratedRecords(object):
+    # dbf.writer() needs len(records), but a list of millions of records
+    # wouldn't fit in memory.
+    def __init__(self, num_records):
+        self.num_records = num_records
+
+    def __len__(self):
+        return self.num_records
+
+    def __iter__(self):
+        for i in xrange(self.num_records):
+            name = 'STREET %s' % (i % 5000)
+            yield [i, 'N %s AVE' % name, name, 'N', '', '', '', 'AVE', '', '13', '', '', '', '2', '', str(i), 'S1400', 'P']
+
+def generate(filename, num_records):
+    f = open(filename, 'wb')
+    try:
+        dbf.writer(f, FIELDNAMES, FIELDSPECS, GeneratedRecords(num_records))
+    finally:
+        f.close()
+
+def anonymous_memory():
+    "Returns the process's resident anonymous memory, in MB."
+    for line in open('/proc/self/status'):
+        if line.startswith('RssAnon:'):
+            return int(line.split()[1]) / 1024.0 # In KB.
+    return 0.0
+
+def run_reader(filename, mode):
+    """
+    Reads the file with the given mode, keeping the records in a dictionary
+    keyed by LINEARID, as TigerImporter does (before and after it used
+    DBFFile). Prints the time, memory and a checksum of the records.
+    """
+    f = open(filename, 'rb')
+    start = time.time()
+    db = {}
+    if mode == 'reader':
+        for row in dbf.dict_reader(f, strip_values=True):
+            db[row['LINEARID']] = row
+    elif mode == 'dbffile':
+        dbf_file = dbf.DBFFile(f, strip_values=True)
+        for row in dbf_file.records(PROJECTION):
+            db[row[0]] = tuple(row[1:])
+        dbf_file.close()
+    elif mode == 'stream':
+        dbf_file = dbf.DBFFile(f, strip_values=True)
+        for row in dbf_file.records(PROJECTION):
+            db = row # Keep nothing.
+        dbf_file.close()
+    elapsed = time.time() - start
+    memory = anonymous_memory()
+    f.close()
+    checksum = 0
+    if mode != 'stream':
+        if mode == 'reader':
+            db = dict([(k, tuple([v[p] for p in PROJECTION[1:]])) for k, v in db.iteritems()])
+        checksum = hash(tuple(sorted(db.items())))
+    print '%s %s %s' % (elapsed, memory, checksum)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == '--run':
+        run_reader(argv[1], argv[2])
+        return 0
+    num_records = argv and int(argv[0]) or 2000000
+
+    fd, filename = tempfile.mkstemp(suffix='.dbf')
+    os.close(fd)
+    try:
+        start = time.time()
+        generate(filename, num_records)
+        print 'Generated %s records (%.1f MB) in %.1f seconds' % (num_records, os.path.getsize(filename) / 1048576.0, time.time() - start)
+        results = {}
+        for mode, description in (('reader', 'dict_reader(), all fields'),
+                                  ('dbffile', 'DBFFile.records(), 7 fields'),
+                                  ('stream', 'DBFFile.records(), 7 fields, not kept')):
+            output = subprocess.Popen([sys.executable, __file__, '--run', filename, mode], stdout=subprocess.PIPE).communicate()[0]
+            elapsed, memory, checksum = output.split()
+            results[mode] = checksum
+            print '%-40s %8.1f seconds %8.1f MB' % (description, float(elapsed), float(memory))
+        if results['reader'] != results['dbffile']:
+            print 'MISMATCH between reader() and DBFFile'
+            return 1
+    finally:
+        os.remove(filename)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
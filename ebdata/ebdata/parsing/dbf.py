@@ -2,7 +2,7 @@
 Functions that deal with DBF files.
 """
 
-import struct, datetime, decimal, itertools
+import struct, datetime, decimal, itertools, mmap
 
 # From http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/362715
 def reader(f, strip_values=False):
@@ -48,35 +48,148 @@ def reader(f, strip_values=False):
     fields.insert(0, ('DeletionFlag', 'C', 1, 0))
     fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in fields])
     fmtsiz = struct.calcsize(fmt)
+    converters = [converter(typ, deci, strip_values) for name, typ, size, deci in fields[1:]]
     for i in xrange(numrec):
         record = struct.unpack(fmt, f.read(fmtsiz))
         if record[0] != ' ':
             continue                        # deleted record
-        result = []
-        for (name, typ, size, deci), value in itertools.izip(fields, record):
-            if name == 'DeletionFlag':
-                continue
-            if typ == "N":
-                value = value.replace('\0', '').lstrip()
-                if value == '':
-                    value = 0
-                elif deci:
-                    value = decimal.Decimal(value)
-                else:
-                    value = int(value)
-            elif typ == 'D':
-                try:
-                    y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
-                except ValueError:
-                    value = None
-                else:
-                    value = datetime.date(y, m, d)
-            elif typ == 'L':
-                value = (value in 'YyTt' and 'T') or (value in 'NnFf' and 'F') or '?'
-            elif strip_values:
-                value = value.strip()
-            result.append(value)
-        yield result
+        yield [convert(value) for convert, value in itertools.izip(converters, record[1:])]
+
+def converter(typ, deci, strip_values=False):
+    """
+    Returns a function that converts a raw field value of the given DBF type
+    and number of decimal places to a Python value.
+    """
+    if typ == 'N':
+        def convert(value):
+            value = value.replace('\0', '').lstrip()
+            if value == '':
+                return 0
+            elif deci:
+                return decimal.Decimal(value)
+            return int(value)
+    elif typ == 'D':
+        def convert(value):
+            try:
+                y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
+            except ValueError:
+                return None
+            return datetime.date(y, m, d)
+    elif typ == 'L':
+        def convert(value):
+            return (value in 'YyTt' and 'T') or (value in 'NnFf' and 'F') or '?'
+    elif strip_values:
+        def convert(value):
+            return value.strip()
+    else:
+        def convert(value):
+            return value
+    return convert
+
+class DBFFile(object):
+    """
+    Memory-mapped, read-only access to a DBF file, for files that are too big
+    to load into memory with reader().
+
+    Records are decoded lazily, and only the requested fields are decoded, so
+    iterating over a file uses constant memory. Values are converted as in
+    reader(), and deleted records are skipped.
+
+    Example usage:
+
+        db = DBFFile(open('/path/to/somefile.dbf', 'rb'), strip_values=True)
+        for tlid, name in db.records(['TLID', 'NAME']):
+            print tlid, name
+        for tlid in db.column('TLID'):
+            print tlid
+        db.close()
+    """
+    def __init__(self, f, strip_values=False):
+        self.strip_values = strip_values
+        self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.numrec, self.lenheader, self.lenrecord = struct.unpack_from('<xxxxLHH20x', self.mmap, 0)
+        numfields = (self.lenheader - 33) // 32
+
+        self.fieldnames = []
+        self.fieldspecs = []
+        self._fields = {} # Maps field name to (offset in record, size, type, decimal places).
+        offset = 1 # The deletion flag comes first.
+        for fieldno in xrange(numfields):
+            name, typ, size, deci = struct.unpack_from('<11sc4xBB14x', self.mmap, 32 * (fieldno + 1))
+            name = name.replace('\0', '')
+            self.fieldnames.append(name)
+            self.fieldspecs.append((typ, size, deci))
+            self._fields[name] = (offset, size, typ, deci)
+            offset += size
+
+        terminator = self.mmap[32 * (numfields + 1)]
+        if terminator != '\r':
+            raise ValueError('Got unhandled terminator %r' % terminator)
+
+    def __len__(self):
+        "Returns the number of records, including deleted ones."
+        return self.numrec
+
+    def close(self):
+        self.mmap.close()
+
+    def _record_struct(self, fieldnames):
+        """
+        Returns a struct.Struct that unpacks the deletion flag and the given
+        fields (in that order) from a record, skipping the other fields.
+        """
+        fields = sorted([(self._fields[name][0], self._fields[name][1], i) for i, name in enumerate(fieldnames)])
+        fmt, pos = ['<c'], 1
+        for offset, size, i in fields:
+            if offset > pos:
+                fmt.append('%dx' % (offset - pos))
+            fmt.append('%ds' % size)
+            pos = offset + size
+        if self.lenrecord > pos:
+            fmt.append('%dx' % (self.lenrecord - pos))
+        # The fields are unpacked in file order; this maps them back to the
+        # requested order.
+        order = [None] * len(fields)
+        for unpacked_index, (offset, size, i) in enumerate(fields):
+            order[i] = unpacked_index + 1
+        return struct.Struct(''.join(fmt)), order
+
+    def records(self, fieldnames=None):
+        """
+        Returns an iterator that yields a list of values for every record,
+        containing the given fields (all of them, by default) in the given
+        order.
+        """
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        record_struct, order = self._record_struct(fieldnames)
+        converters = [converter(self._fields[name][2], self._fields[name][3], self.strip_values) for name in fieldnames]
+        unpack_from = record_struct.unpack_from
+        buf, lenrecord = self.mmap, self.lenrecord
+        is_ordered = order == range(1, len(order) + 1)
+        for pos in xrange(self.lenheader, self.lenheader + self.numrec * lenrecord, lenrecord):
+            record = unpack_from(buf, pos)
+            if record[0] != ' ':
+                continue                    # deleted record
+            if is_ordered:
+                yield [convert(value) for convert, value in itertools.izip(converters, record[1:])]
+            else:
+                yield [convert(record[i]) for convert, i in itertools.izip(converters, order)]
+
+    def dicts(self, fieldnames=None):
+        """
+        Returns an iterator that yields a dictionary for every record,
+        containing the given fields (all of them, by default).
+        """
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        for record in self.records(fieldnames):
+            yield dict(zip(fieldnames, record))
+
+    def column(self, fieldname):
+        "Returns an iterator over the values of the given field."
+        for record in self.records([fieldname]):
+            yield record[0]
 
 def dict_reader(f, strip_values=False):
     """
@@ -0,0 +1,71 @@
+from ebdata.parsing import dbf
+import datetime
+import decimal
+import os
+import tempfile
+import unittest
+
+FIELDNAMES = ['NAME', 'TLID', 'AMOUNT', 'DAY', 'FLAG']
+FIELDSPECS = [('C', 10, 0), ('N', 8, 0), ('N', 8, 2), ('D', 8, 0), ('L', 1, 0)]
+RECORDS = [
+    ['Main ', 1, decimal.Decimal('1.50'), datetime.date(2009, 1, 2), 'T'],
+    [' Elm', 22, decimal.Decimal('0.25'), None, 'F'],
+    ['', None, None, datetime.date(2008, 12, 31), '?'],
+]
+
+class DBFFileTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.dbf')
+        f = os.fdopen(fd, 'wb')
+        dbf.writer(f, FIELDNAMES, FIELDSPECS, RECORDS)
+        f.close()
+        self.f = open(self.filename, 'rb')
+        self.db = dbf.DBFFile(self.f, strip_values=True)
+
+    def tearDown(self):
+        self.db.close()
+        self.f.close()
+        os.remove(self.filename)
+
+    def old_records(self):
+        f = open(self.filename, 'rb')
+        try:
+            return list(dbf.reader(f, strip_values=True))
+        finally:
+            f.close()
+
+    def test_header(self):
+        self.assertEqual(self.db.fieldnames, FIELDNAMES)
+        self.assertEqual(self.db.fieldspecs, FIELDSPECS)
+        self.assertEqual(len(self.db), 3)
+
+    def test_same_as_reader(self):
+        self.assertEqual(list(self.db.records()), self.old_records()[2:])
+
+    def test_projection(self):
+        expected = [[r[4], r[0]] for r in self.old_records()[2:]]
+        self.assertEqual(list(self.db.records(['FLAG', 'NAME'])), expected)
+
+    def test_dicts(self):
+        self.assertEqual(list(self.db.dicts(['TLID', 'DAY'])), [
+            {'TLID': 1, 'DAY': datetime.date(2009, 1, 2)},
+            {'TLID': 22, 'DAY': None},
+            {'TLID': 0, 'DAY': datetime.date(2008, 12, 31)},
+        ])
+
+    def test_column(self):
+        self.assertEqual(list(self.db.column('NAME')), ['Main', 'Elm', ''])
+
+    def test_deleted_records(self):
+        self.db.close()
+        self.f.close()
+        f = open(self.filename, 'r+b')
+        f.seek(self.db.lenheader + self.db.lenrecord)
+        f.write('*')
+        f.close()
+        self.f = open(self.filename, 'rb')
+        self.db = dbf.DBFFile(self.f)
+        self.assertEqual(list(self.db.column('TLID')), [1, 0])
+
+if __name__ == "__main__":
+    unittest.main()
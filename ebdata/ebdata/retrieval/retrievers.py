@@ -7,9 +7,11 @@ knows nothing about *scraping*, i.e., parsing the contents of Web pages.
 
 import httplib2
 from Cookie import SimpleCookie, CookieError
+from Queue import Queue, Empty
 from urllib import urlencode
-from urlparse import urljoin
+from urlparse import urljoin, urlparse
 import logging
+import threading
 import time
 import socket
 
@@ -35,34 +37,73 @@ class Retriever(object):
         # If you don't provide cache, then it will cache in
         # settings.HTTP_CACHE, or '/tmp/eb_scraper_cache' if
         # the setting is undefined.
-        # sleep should be the number of seconds to sleep between requests.
+        # sleep should be the number of seconds to sleep between requests to
+        # the same host.
         from django.conf import settings
         if cache is Default:
             cache = getattr(settings, 'HTTP_CACHE', '/tmp/eb_scraper_cache')
-        self.h = httplib2.Http(cache, timeout=timeout)
-        self.h.force_exception_to_status_code = False
-        self.h.follow_redirects = False
+        self.cache = cache
+        self.timeout = timeout
         self.user_agent = user_agent or 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.0)'
         self._cookies = SimpleCookie()
+        self._cookie_lock = threading.Lock()
         self.logger = logging.getLogger('eb.retrieval.retriever')
         self.sleep = sleep
 
-        # Keep track of whether we've downloaded any pages yet.
-        # This makes sure we don't sleep before the very first requested page.
-        self.page_downloaded = False
+        # httplib2.Http objects aren't thread-safe, so each thread that uses
+        # this retriever (see get_many_html_and_headers()) gets its own. They
+        # all share the same disk cache.
+        self._local = threading.local()
+
+        # Maps each host to the earliest time at which the next request to it
+        # may be made. This makes sure we don't sleep before the very first
+        # request to a host, and that concurrent requests are spaced out.
+        self._next_request_times = {}
+        self._throttle_lock = threading.Lock()
+
+    def _get_http(self):
+        try:
+            return self._local.h
+        except AttributeError:
+            h = httplib2.Http(self.cache, timeout=self.timeout)
+            h.force_exception_to_status_code = False
+            h.follow_redirects = False
+            self._local.h = h
+            return h
+    h = property(_get_http)
+
+    def _throttle(self, uri):
+        """
+        Sleeps, if necessary, so that requests to the host of the given URI
+        are at least self.sleep seconds apart.
+        """
+        if not self.sleep:
+            return
+        host = urlparse(uri)[1]
+        self._throttle_lock.acquire()
+        try:
+            now = time.time()
+            request_time = max(now, self._next_request_times.get(host, now))
+            self._next_request_times[host] = request_time + self.sleep
+        finally:
+            self._throttle_lock.release()
+        if request_time > now:
+            self.logger.debug('Sleeping for %.2f seconds', request_time - now)
+            time.sleep(request_time - now)
 
     def clear_cookies(self):
-        self._cookies = SimpleCookie()
+        self._cookie_lock.acquire()
+        try:
+            self._cookies = SimpleCookie()
+        finally:
+            self._cookie_lock.release()
 
     def get_html_and_headers(self, uri, data=None, headers=None, send_cookies=True, follow_redirects=True, raise_on_error=True):
         "Retrieves the resource and returns a tuple of (content, header dictionary)."
-        # Sleep, if necessary, but only if a page has already been downloaded
-        # with this retriever. (We don't want to sleep before the very first
-        # request that a retriever makes, because that would be unnecessary.)
-        if self.sleep and self.page_downloaded:
-            self.logger.debug('Sleeping for %s seconds', self.sleep)
-            time.sleep(self.sleep)
-        self.page_downloaded = True
+        # Sleep, if necessary, but only if a page has already been requested
+        # from this host with this retriever. (We don't want to sleep before
+        # the very first request, because that would be unnecessary.)
+        self._throttle(uri)
 
         # Prepare the request.
         if not headers:
@@ -71,7 +112,11 @@ class Retriever(object):
         if send_cookies and self._cookies:
             # Some broken ASP.NET servers put "\r\n" in there, so we replace
             # that with semicolon to get proper behavior.
-            headers['Cookie'] = self._cookies.output(attrs=[], header='').strip().replace('\r\n', ';')
+            self._cookie_lock.acquire()
+            try:
+                headers['Cookie'] = self._cookies.output(attrs=[], header='').strip().replace('\r\n', ';')
+            finally:
+                self._cookie_lock.release()
         method = data and "POST" or "GET"
         body = data and urlencode(data) or None
         if method == "POST" and body:
@@ -108,11 +153,15 @@ class Retriever(object):
 
         # Set any received cookies.
         if 'set-cookie' in resp_headers:
+            self._cookie_lock.acquire()
             try:
-                self._cookies.load(resp_headers['set-cookie'])
-            except CookieError:
-                # Skip invalid cookies.
-                pass
+                try:
+                    self._cookies.load(resp_headers['set-cookie'])
+                except CookieError:
+                    # Skip invalid cookies.
+                    pass
+            finally:
+                self._cookie_lock.release()
 
         # Handle redirects that weren't caught by httplib2 for whatever reason.
         if follow_redirects and resp_headers['status'] in ('301', '302', '303'):
@@ -139,6 +188,55 @@ class Retriever(object):
         "Retrieves the resource and returns it as raw HTML."
         return self.get_html_and_headers(uri, data, headers, send_cookies, follow_redirects, raise_on_error)[0]
 
+    def get_many_html_and_headers(self, uris, num_workers=4, **kwargs):
+        """
+        Retrieves the given URIs concurrently, with a pool of num_workers
+        threads, and returns a list with one item per URI, in the same order:
+        either a (content, header dictionary) tuple or, if the URI couldn't be
+        retrieved, the RetrievalError that was raised.
+
+        Keyword arguments are passed to get_html_and_headers(). Retries, the
+        disk cache and cookies work just like for single requests, and
+        requests to the same host are still at least self.sleep seconds
+        apart, so concurrency only helps for slow servers or many hosts.
+        """
+        results = [None] * len(uris)
+        queue = Queue()
+        for item in enumerate(uris):
+            queue.put(item)
+
+        def worker():
+            while True:
+                try:
+                    i, uri = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[i] = self.get_html_and_headers(uri, **kwargs)
+                except RetrievalError, e:
+                    results[i] = e
+                except Exception, e:
+                    self.logger.debug('Error retrieving %s: %s', uri, e)
+                    results[i] = RetrievalError('Could not retrieve %r: %s' % (uri, e))
+
+        threads = [threading.Thread(target=worker) for _ in range(min(num_workers, len(uris)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def get_many_html(self, uris, num_workers=4, **kwargs):
+        """
+        Like get_many_html_and_headers(), but successful results are just the
+        content.
+        """
+        results = self.get_many_html_and_headers(uris, num_workers, **kwargs)
+        for i, result in enumerate(results):
+            if isinstance(result, tuple):
+                results[i] = result[0]
+        return results
+
     def get_to_file(self, *args, **kwargs):
         """
         Downloads the given URI and saves it to a temporary file. Returns the
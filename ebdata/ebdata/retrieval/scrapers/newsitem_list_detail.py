@@ -3,9 +3,11 @@ from django.db import transaction
 from ebdata.retrieval.scrapers.list_detail import ListDetailScraper
 from ebdata.retrieval.utils import locations_are_close
 from ebpub.db.models import Schema, NewsItem, Lookup, DataUpdate, field_mapping
+from ebpub.db.utils import invalidate_homepage
 from ebpub.geocoder import SmartGeocoder, GeocodingException, ParsingError
 from ebpub.utils.text import address_to_block
 import datetime
+import time
 
 class NewsItemListDetailScraper(ListDetailScraper):
     """
@@ -28,9 +30,23 @@ class NewsItemListDetailScraper(ListDetailScraper):
     mapping the name to the real_name. If schema_slug has more than one element,
     self.schema_field_mapping is a dictionary in the format
     {schema_slug: {name: real_name}}.
+
+    If batch_size is set, create_newsitem() doesn't save each NewsItem as it
+    goes. Instead, it collects them and saves batch_size NewsItems (and their
+    Attributes) at a time, with a few multi-row INSERTs in a single
+    transaction. The NewsItems that create_newsitem() returns don't have IDs
+    until their batch is saved. self.batch_timings is a list of
+    (number of NewsItems, seconds) for every batch saved in this scrape.
+
+    Note that existing_record() only sees the NewsItems that have been saved,
+    not the ones waiting in the current batch. create_newsitem() skips a
+    NewsItem that's identical to one in the batch, but if the same record
+    can appear twice in one scrape with different values, don't set
+    batch_size -- the second one would be created rather than updated.
     """
     schema_slugs = None
     logname = None
+    batch_size = None
 
     def __init__(self, *args, **kwargs):
         if self.logname is None:
@@ -42,6 +58,9 @@ class NewsItemListDetailScraper(ListDetailScraper):
         self._schema_fields_cache = None
         self._schema_field_mapping_cache = None
         self._geocoder = SmartGeocoder()
+        self._pending_newsitems = []
+        self._pending_keys = {}
+        self.batch_timings = []
 
     # schemas, schema, lookups and schema_field_mapping are all lazily loaded
     # so that this scraper can be run (in raw_data(), xml_data() or
@@ -105,7 +124,6 @@ class NewsItemListDetailScraper(ListDetailScraper):
             sf = self.lookups[schema_field_name]
         return Lookup.objects.get_or_create_lookup(sf, name, code, description, make_text_slug, self.logger)
 
-    @transaction.commit_on_success
     def create_newsitem(self, attributes, **kwargs):
         """
         Creates and saves a NewsItem with the given kwargs. Returns the new
@@ -125,6 +143,35 @@ class NewsItemListDetailScraper(ListDetailScraper):
 
         attributes is a dictionary to use to populate this NewsItem's Attribute
         object.
+
+        If self.batch_size is set, the NewsItem isn't saved right away; see
+        flush_newsitems().
+        """
+        if self.batch_size:
+            ni = self._build_newsitem(**kwargs)
+            key = self._pending_key(ni, attributes)
+            if key in self._pending_keys:
+                self.logger.info(u'Skipping NewsItem %r, which is already waiting to be saved', ni.title)
+                return self._pending_keys[key]
+            self._pending_keys[key] = ni
+            self._pending_newsitems.append((ni, attributes))
+            if len(self._pending_newsitems) >= self.batch_size:
+                self.flush_newsitems()
+            return ni
+        return self._create_newsitem(attributes, **kwargs)
+
+    @transaction.commit_on_success
+    def _create_newsitem(self, attributes, **kwargs):
+        ni = self._build_newsitem(**kwargs)
+        ni.save()
+        ni.attributes = attributes
+        self.num_added += 1
+        self.logger.info(u'Created NewsItem %s (total created in this scrape: %s)', ni.id, self.num_added)
+        return ni
+
+    def _build_newsitem(self, **kwargs):
+        """
+        Geocodes and returns an unsaved NewsItem for create_newsitem().
         """
         block = location = None
         if 'location' not in kwargs:
@@ -148,7 +195,7 @@ class NewsItemListDetailScraper(ListDetailScraper):
         schema = kwargs.get('schema', None)
         schema = schema or self.schema
 
-        ni = NewsItem.objects.create(
+        return NewsItem(
             schema=schema,
             title=kwargs['title'],
             description=kwargs.get('description', ''),
@@ -160,10 +207,50 @@ class NewsItemListDetailScraper(ListDetailScraper):
             location_object=kwargs.get('location_object', None),
             block=kwargs.get('block', block),
         )
-        ni.attributes = attributes
-        self.num_added += 1
-        self.logger.info(u'Created NewsItem %s (total created in this scrape: %s)', ni.id, self.num_added)
-        return ni
+
+    def _pending_key(self, ni, attributes):
+        """
+        Returns the key by which create_newsitem() recognizes a NewsItem that
+        duplicates one in the current batch.
+        """
+        return (ni.schema_id, ni.title, ni.description, ni.url, ni.item_date,
+            ni.location_name, tuple(sorted(attributes.items())))
+
+    @transaction.commit_on_success
+    def flush_newsitems(self):
+        """
+        Saves the NewsItems that create_newsitem() has collected so far, in
+        batch mode, in a single transaction. If that fails, they're kept for
+        the next call.
+        """
+        batch = self._pending_newsitems
+        if not batch:
+            return
+        start = time.time()
+        NewsItem.objects.bulk_create(batch)
+        self._pending_newsitems = []
+        self._pending_keys = {}
+        elapsed = time.time() - start
+        self.num_added += len(batch)
+        self.batch_timings.append((len(batch), elapsed))
+        self.logger.info(u'Saved batch of %s NewsItems in %.2f seconds (%.1f/second; total created in this scrape: %s)',
+            len(batch), elapsed, len(batch) / max(elapsed, 0.001), self.num_added)
+
+    def _flush_after_error(self):
+        """
+        Calls flush_newsitems() once more, for update(), logging the NewsItems
+        that are dropped if it fails again.
+        """
+        from django.db import connection
+        try:
+            self.flush_newsitems()
+        except Exception:
+            connection._rollback()
+            self.logger.exception(u'Could not save the last batch of %s NewsItems', len(self._pending_newsitems))
+            for ni, attributes in self._pending_newsitems:
+                self.logger.error(u'Dropped unsaved NewsItem %r (%s, %s)', ni.title, ni.item_date, ni.location_name)
+            self._pending_newsitems = []
+            self._pending_keys = {}
 
     @transaction.commit_on_success
     def update_existing(self, newsitem, new_values, new_attributes):
@@ -199,6 +286,9 @@ class NewsItemListDetailScraper(ListDetailScraper):
         """
         self.num_added = 0
         self.num_changed = 0
+        self._pending_newsitems = []
+        self._pending_keys = {}
+        self.batch_timings = []
         update_start = datetime.datetime.now()
 
         # We use a try/finally here so that the DataUpdate object is created
@@ -206,6 +296,7 @@ class NewsItemListDetailScraper(ListDetailScraper):
         try:
             got_error = True
             super(NewsItemListDetailScraper, self).update()
+            self.flush_newsitems()
             got_error = False
         finally:
             # Rollback, in case the database is in an aborted transaction. his
@@ -214,6 +305,11 @@ class NewsItemListDetailScraper(ListDetailScraper):
             from django.db import connection
             connection._rollback()
 
+            # If the scrape failed partway through a batch, save what it
+            # collected before the error.
+            if self._pending_newsitems:
+                self._flush_after_error()
+
             update_finish = datetime.datetime.now()
 
             # Clear the Schema cache, in case the schemas have been updated in the
@@ -236,6 +332,8 @@ class NewsItemListDetailScraper(ListDetailScraper):
                     num_skipped=self.num_skipped,
                     got_error=got_error,
                 )
+            # Make the homepage pick up the new data.
+            invalidate_homepage()
 
     def geocode(self, location_name):
         """
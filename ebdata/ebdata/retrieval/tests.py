@@ -0,0 +1,85 @@
+"""
+Tests for concurrent retrieval, against a local HTTP server that injects
+latency into every response.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from ebdata.retrieval.retrievers import Retriever, PageNotFoundError
+import threading
+import time
+import unittest
+
+LATENCY = 0.2 # seconds
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCY)
+        self.server.request_times.append(time.time())
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        if self.path == '/cookie':
+            self.send_header('Set-Cookie', 'session=abc')
+        self.end_headers()
+        self.wfile.write('%s %s' % (self.path, self.headers.get('Cookie', '')))
+
+    def log_message(self, *args):
+        pass
+
+class SlowServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ConcurrentRetrieverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = SlowServer(('127.0.0.1', 0), SlowHandler)
+        self.server.request_times = []
+        self.base_uri = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def uris(self, n):
+        return ['%s/page%s' % (self.base_uri, i) for i in range(n)]
+
+    def test_results_in_order(self):
+        retriever = Retriever(cache=None)
+        results = retriever.get_many_html(self.uris(8), num_workers=4)
+        self.assertEqual(results, ['/page%s ' % i for i in range(8)])
+
+    def test_concurrency(self):
+        retriever = Retriever(cache=None)
+        start = time.time()
+        retriever.get_many_html(self.uris(8), num_workers=8)
+        # Serially, this would take 8 * LATENCY.
+        self.assert_(time.time() - start < 4 * LATENCY)
+
+    def test_per_host_sleep(self):
+        retriever = Retriever(cache=None, sleep=0.1)
+        retriever.get_many_html(self.uris(5), num_workers=5)
+        times = sorted(self.server.request_times)
+        for a, b in zip(times, times[1:]):
+            self.assert_(b - a >= 0.09, 'requests %.3f seconds apart' % (b - a))
+
+    def test_errors(self):
+        retriever = Retriever(cache=None)
+        uris = self.uris(2) + ['%s/missing' % self.base_uri]
+        results = retriever.get_many_html(uris, num_workers=3)
+        self.assertEqual(results[:2], ['/page0 ', '/page1 '])
+        self.assert_(isinstance(results[2], PageNotFoundError))
+
+    def test_shared_cookies(self):
+        retriever = Retriever(cache=None)
+        retriever.get_html('%s/cookie' % self.base_uri)
+        results = retriever.get_many_html(self.uris(3), num_workers=3)
+        self.assertEqual(results, ['/page%s session=abc' % i for i in range(3)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Benchmarks listdiff() with the C longest_common_substring_ids() from
+listdiffc against the pure-Python fallback, on pairs of Pages crawled by
+ebdata.blobs, and verifies that both return the same diff.
+
+    python bench_listdiff.py [options] seed_id
+
+Pages are tokenized as by Template.learn(), one token per character. The
+pure-Python version is quadratic and slow, so the pages are truncated to
+--max-length characters (use 0 for no limit).
+"""
+
+from optparse import OptionParser
+from ebdata.blobs.models import Page
+from ebdata.templatemaker import listdiff as listdiff_module
+from ebdata.templatemaker.template import Template
+import sys
+import time
+
+def time_listdiff(pairs, lcs_ids_func):
+    """
+    Runs listdiff() on every pair using the given longest_common_substring_ids
+    implementation. Returns (seconds, list of diffs).
+    """
+    old_func = listdiff_module.longest_common_substring_ids
+    listdiff_module.longest_common_substring_ids = lcs_ids_func
+    try:
+        start = time.time()
+        diffs = [listdiff_module.listdiff(tokens1, tokens2) for tokens1, tokens2 in pairs]
+        return time.time() - start, diffs
+    finally:
+        listdiff_module.longest_common_substring_ids = old_func
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] seed_id')
+    p.add_option('-n', '--num-pairs', dest='num_pairs', type='int', default=10,
+                 help='number of pairs of pages to diff')
+    p.add_option('-m', '--max-length', dest='max_length', type='int', default=5000,
+                 help='truncate pages to this many characters')
+    opts, args = p.parse_args(argv)
+    if len(args) != 1:
+        p.error('required argument `seed_id`')
+    if not listdiff_module.HAS_LISTDIFFC:
+        p.error('listdiffc is not built; see setup_listdiffc.py')
+
+    pages = list(Page.objects.filter(seed__id=int(args[0])).order_by('-when_crawled')[:opts.num_pairs + 1])
+    template = Template()
+    tokens = [template.tokenize(opts.max_length and page.html[:opts.max_length] or page.html) for page in pages]
+    pairs = zip(tokens, tokens[1:])
+    if not pairs:
+        p.error('seed %s has fewer than two pages' % args[0])
+    print '%s pairs, %s tokens on average' % (len(pairs), sum([len(t) for t in tokens]) / len(tokens))
+
+    py_time, py_diffs = time_listdiff(pairs, listdiff_module.py_longest_common_substring_ids)
+    c_time, c_diffs = time_listdiff(pairs, listdiff_module.longest_common_substring_ids)
+    mismatches = len([1 for a, b in zip(py_diffs, c_diffs) if a != b])
+    print '%s mismatches' % mismatches
+    print 'pure Python: %.3f seconds per pair' % (py_time / len(pairs))
+    print 'listdiffc:   %.3f seconds per pair' % (c_time / len(pairs))
+    print 'speedup:     %.1fx' % (py_time / max(c_time, 0.000001))
+    return mismatches and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,18 @@
 #include <Python.h>
 
-int half_longest_match(PyObject* seq1, PyObject* seq2, int start1, int end1, int start2, int end2, int best_size, int* offset1, int* offset2) {
+/*
+ The longest common substring algorithm, on two arrays of token IDs. See
+ listdiff.py for the pure-Python version, which this must match exactly.
+*/
+
+int half_longest_match(const int* seq1, const int* seq2, int len1, int len2, int best_size, int* offset1, int* offset2) {
     int i, j, k, new_offset1, new_offset2;
-    unsigned int current_size;
+    int current_size;
 
-    for (i = start2, current_size = 0; i < end2; i++, current_size = 0) { // i is seq2 starting index.
-        if (best_size >= end2 - i) break; // Short-circuit. See comment above.
-        for (j = i, k = start1; k < end1 && j < end2; j++, k++) { // k is index of seq1, j is index of seq2.
-            if (PyObject_RichCompareBool(PySequence_GetItem(seq1, k), PySequence_GetItem(seq2, j), Py_EQ)) {
+    for (i = 0, current_size = 0; i < len2; i++, current_size = 0) { // i is seq2 starting index.
+        if (best_size >= len2 - i) break; // Short-circuit: no longer match is possible.
+        for (j = i, k = 0; k < len1 && j < len2; j++, k++) { // k is index of seq1, j is index of seq2.
+            if (seq1[k] == seq2[j]) {
                 if (++current_size >= best_size) {
                     new_offset1 = k - current_size + 1;
                     new_offset2 = j - current_size + 1;
@@ -30,53 +35,155 @@ int half_longest_match(PyObject* seq1, PyObject* seq2, int start1, int end1, int
     return best_size;
 }
 
-// offset1 and offset2 are relative to the *whole* string, not the substring
-// (as defined by a_start and a_end).
-// a_end and b_end are (the last index + 1).
-int longest_common_subsequence(PyObject* seq1, PyObject* seq2, int start1, int end1, int start2, int end2, int* offset1, int* offset2) {
-    unsigned int best_size;
+int longest_common_substring(const int* seq1, const int* seq2, int len1, int len2, int* offset1, int* offset2) {
+    int best_size;
     *offset1 = -1;
     *offset2 = -1;
 
     // If either sequence is empty, return 0.
-    if (start1 == end1 || start2 == end2) {
+    if (len1 == 0 || len2 == 0) {
         return 0;
     }
 
-    best_size = half_longest_match(seq1, seq2, start1, end1, start2, end2, 0, offset1, offset2);
-    best_size = half_longest_match(seq2, seq1, start2, end2, start1, end1, best_size, offset2, offset1);
+    best_size = half_longest_match(seq1, seq2, len1, len2, 0, offset1, offset2);
+    best_size = half_longest_match(seq2, seq1, len2, len1, best_size, offset2, offset1);
     return best_size;
 }
 
-/* 
+/*
  PYTHON STUFF -- These are the hooks between Python and C.
 */
 
-static PyObject * function_longest_common_subsequence(PyObject *self, PyObject *args) {
+// Sets *ids and *length to the contents of an array.array('i'). Returns 0 on
+// success, or -1 with a Python exception set.
+static int get_id_array(PyObject* obj, const int** ids, int* length) {
+    PyObject* typecode;
+    const void* buffer;
+    Py_ssize_t buffer_length;
+    int is_int_array;
+
+    typecode = PyObject_GetAttrString(obj, "typecode");
+    if (typecode == NULL) {
+        PyErr_Clear();
+        is_int_array = 0;
+    }
+    else {
+        is_int_array = PyString_Check(typecode) && strcmp(PyString_AS_STRING(typecode), "i") == 0;
+        Py_DECREF(typecode);
+    }
+    if (!is_int_array) {
+        PyErr_SetString(PyExc_TypeError, "This function's arguments must be array.array('i') objects");
+        return -1;
+    }
+    if (PyObject_AsReadBuffer(obj, &buffer, &buffer_length) == -1)
+        return -1;
+    *ids = (const int*) buffer;
+    *length = (int) (buffer_length / sizeof(int));
+    return 0;
+}
+
+static PyObject * function_longest_common_substring_ids(PyObject *self, PyObject *args) {
     PyObject* seq1;
     PyObject* seq2;
-    int offset1, offset2;
-    unsigned int best_size;
+    const int* ids1;
+    const int* ids2;
+    int len1, len2, offset1, offset2, best_size;
 
     if (!PyArg_ParseTuple(args, "OO", &seq1, &seq2))
         return NULL;
+    if (get_id_array(seq1, &ids1, &len1) == -1 || get_id_array(seq2, &ids2, &len2) == -1)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    best_size = longest_common_substring(ids1, ids2, len1, len2, &offset1, &offset2);
+    Py_END_ALLOW_THREADS
+
+    return Py_BuildValue("(iii)", best_size, offset1, offset2);
+}
 
-    if (!PySequence_Check(seq1) || !PySequence_Check(seq2)) {
-        PyErr_SetString(PyExc_TypeError, "This function's arguments must be sequences");
+// Works on any two sequences by comparing their items with ==. This is what
+// listdiffc offered before token IDs, and it's kept for callers that use it
+// directly.
+static PyObject * function_longest_common_substring(PyObject *self, PyObject *args) {
+    PyObject* seq1;
+    PyObject* seq2;
+    PyObject* fast1 = NULL;
+    PyObject* fast2 = NULL;
+    PyObject** items1;
+    PyObject** items2;
+    int* ids1 = NULL;
+    int* ids2 = NULL;
+    int len1, len2, i, j, offset1, offset2, best_size, cmp;
+    PyObject* result = NULL;
+
+    if (!PyArg_ParseTuple(args, "OO", &seq1, &seq2))
         return NULL;
+
+    fast1 = PySequence_Fast(seq1, "This function's arguments must be sequences");
+    if (fast1 == NULL)
+        goto done;
+    fast2 = PySequence_Fast(seq2, "This function's arguments must be sequences");
+    if (fast2 == NULL)
+        goto done;
+    len1 = (int) PySequence_Fast_GET_SIZE(fast1);
+    len2 = (int) PySequence_Fast_GET_SIZE(fast2);
+    items1 = PySequence_Fast_ITEMS(fast1);
+    items2 = PySequence_Fast_ITEMS(fast2);
+
+    // Give every item of seq2 the ID of the first equal item in seq1 (or -1),
+    // so that the matching itself only compares integers. Items of seq1 are
+    // numbered by position, so equal items in seq1 get the ID of the first.
+    ids1 = PyMem_New(int, len1 ? len1 : 1);
+    ids2 = PyMem_New(int, len2 ? len2 : 1);
+    if (ids1 == NULL || ids2 == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (i = 0; i < len1; i++) {
+        ids1[i] = i;
+        for (j = 0; j < i; j++) {
+            cmp = items1[j] == items1[i] ? 1 : PyObject_RichCompareBool(items1[j], items1[i], Py_EQ);
+            if (cmp == -1)
+                goto done;
+            if (cmp) {
+                ids1[i] = ids1[j];
+                break;
+            }
+        }
+    }
+    for (i = 0; i < len2; i++) {
+        ids2[i] = -1;
+        for (j = 0; j < len1; j++) {
+            if (ids1[j] != j)
+                continue; // Only compare against the first of equal items.
+            cmp = items1[j] == items2[i] ? 1 : PyObject_RichCompareBool(items1[j], items2[i], Py_EQ);
+            if (cmp == -1)
+                goto done;
+            if (cmp) {
+                ids2[i] = j;
+                break;
+            }
+        }
     }
 
-    Py_INCREF(seq1);
-    Py_INCREF(seq2);
-    best_size = longest_common_subsequence(seq1, seq2, 0, PySequence_Length(seq1), 0, PySequence_Length(seq2), &offset1, &offset2);
-    Py_DECREF(seq1);
-    Py_DECREF(seq2);
+    best_size = longest_common_substring(ids1, ids2, len1, len2, &offset1, &offset2);
+    result = Py_BuildValue("(iii)", best_size, offset1, offset2);
 
-    return Py_BuildValue("(iii)", best_size, offset1, offset2);
+done:
+    PyMem_Free(ids1);
+    PyMem_Free(ids2);
+    Py_XDECREF(fast1);
+    Py_XDECREF(fast2);
+    return result;
 }
 
 static PyMethodDef ModuleMethods[] = {
-    {"longest_common_subsequence", function_longest_common_subsequence, METH_VARARGS, ""},
+    {"longest_common_substring_ids", function_longest_common_substring_ids, METH_VARARGS,
+     "Given two array.array('i') objects of token IDs, returns a tuple of (LCS length, LCS offset in ids1, LCS offset in ids2)."},
+    {"longest_common_substring", function_longest_common_substring, METH_VARARGS,
+     "Given two sequences, returns a tuple of (LCS length, LCS offset in seq1, LCS offset in seq2)."},
+    // Old name, for backwards compatibility.
+    {"longest_common_subsequence", function_longest_common_substring, METH_VARARGS, ""},
     {NULL, NULL, 0, NULL}        // sentinel
 };
 
@@ -1,3 +1,4 @@
+from array import array
 from hole import Hole
 
 def listdiff(list1, list2):
@@ -5,13 +6,21 @@ def listdiff(list1, list2):
     Given two lists, returns a "diff" list, with Hole instances inserted
     as necessary.
     """
+    ids1, ids2 = token_ids(list1, list2)
+    return _listdiff(list1, list2, ids1, ids2)
+
+def _listdiff(list1, list2, ids1, ids2):
+    """
+    Does the work for listdiff(). ids1 and ids2 are the token IDs of list1
+    and list2, as returned by token_ids(), and are sliced along with them.
+    """
     hole = Hole()
 
     # Special case.
-    if list1 == list2 == []:
+    if not list1 and not list2:
         return []
 
-    best_size, offset1, offset2 = longest_common_substring(list1, list2)
+    best_size, offset1, offset2 = longest_common_substring_ids(ids1, ids2)
 
     result = []
 
@@ -19,7 +28,7 @@ def listdiff(list1, list2):
         result.append(hole)
     if offset1 > 0 and offset2 > 0:
         # There's leftover stuff on the left side of BOTH lists.
-        result.extend(listdiff(list1[:offset1], list2[:offset2]))
+        result.extend(_listdiff(list1[:offset1], list2[:offset2], ids1[:offset1], ids2[:offset2]))
     elif offset1 > 0 or offset2 > 0:
         # There's leftover stuff on the left side of ONLY ONE of the lists.
         result.append(hole)
@@ -27,58 +36,107 @@ def listdiff(list1, list2):
         result.extend(list1[offset1:offset1+best_size])
         if (offset1 + best_size < len(list1)) and (offset2 + best_size < len(list2)):
             # There's leftover stuff on the right side of BOTH lists.
-            result.extend(listdiff(list1[offset1+best_size:], list2[offset2+best_size:]))
+            end1, end2 = offset1 + best_size, offset2 + best_size
+            result.extend(_listdiff(list1[end1:], list2[end2:], ids1[end1:], ids2[end2:]))
         elif (offset1 + best_size < len(list1)) or (offset2 + best_size < len(list2)):
             # There's leftover stuff on the right side of ONLY ONE of the lists.
             result.append(hole)
     return result
 
+def token_ids(list1, list2):
+    """
+    Given two lists of tokens, returns a tuple of two array.array('i')
+    objects, in which equal tokens have equal integer IDs.
+
+    Tokens are looked up in a dictionary, except for Holes (and anything
+    else that isn't hashable by value), which are compared with ==.
+    """
+    ids = {}
+    others = [] # (token, id) pairs for the tokens that aren't in ids.
+    result = []
+    for seq in (list1, list2):
+        seq_ids = array('i')
+        for token in seq:
+            if isinstance(token, Hole):
+                token_id = _other_token_id(token, others, ids)
+            else:
+                try:
+                    token_id = ids.setdefault(token, len(ids) + len(others))
+                except TypeError: # Unhashable.
+                    token_id = _other_token_id(token, others, ids)
+            seq_ids.append(token_id)
+        result.append(seq_ids)
+    return tuple(result)
+
+def _other_token_id(token, others, ids):
+    for other, other_id in others:
+        if other == token:
+            return other_id
+    token_id = len(ids) + len(others)
+    others.append((token, token_id))
+    return token_id
+
 # NOTE: This is a "longest common substring" algorithm, not a
 # "longest common subsequence" algorithm. The difference is that longest common
 # subsequence does not require the bits to be contiguous.
 #
 # The longest common subsequence of "foolish" and "fools" is "fools".
 # The longest common substring of "foolish" and "fools" is "fool".
+#
+# The C version in listdiffc (built from listdiff.c; see setup_listdiffc.py)
+# is used if it's available. longest_common_substring_ids() compares integer
+# token IDs (see token_ids()) rather than Python objects, which is what makes
+# the C version fast. The pure-Python fallback returns the same results.
 try:
-    from listdiffc import longest_common_subsequence as longest_common_substring
+    from listdiffc import longest_common_substring, longest_common_substring_ids
+    HAS_LISTDIFFC = True
 except ImportError:
-    def longest_common_substring(seq1, seq2):
-        """
-        Given two sequences, calculates the longest common substring and returns
-        a tuple of:
-            (LCS length, LCS offset in seq1, LCS offset in seq2)
-        """
-        best_size, offset1, offset2 = half_longest_match(seq1, seq2)
-        best_size, offset2, offset1 = half_longest_match(seq2, seq1, best_size, offset2, offset1)
-        return best_size, offset1, offset2
+    HAS_LISTDIFFC = False
+
+def py_longest_common_substring(seq1, seq2):
+    """
+    Given two sequences, calculates the longest common substring and returns
+    a tuple of:
+        (LCS length, LCS offset in seq1, LCS offset in seq2)
+    """
+    best_size, offset1, offset2 = half_longest_match(seq1, seq2)
+    best_size, offset2, offset1 = half_longest_match(seq2, seq1, best_size, offset2, offset1)
+    return best_size, offset1, offset2
 
-    def half_longest_match(seq1, seq2, best_size=0, offset1=-1, offset2=-1):
-        """
-        Implements "one half" of the longest common substring algorithm.
-        """
-        len1 = len(seq1)
-        len2 = len(seq2)
-        i = 0 # seq2 index
+def half_longest_match(seq1, seq2, best_size=0, offset1=-1, offset2=-1):
+    """
+    Implements "one half" of the longest common substring algorithm.
+    """
+    len1 = len(seq1)
+    len2 = len(seq2)
+    i = 0 # seq2 index
+    current_size = 0
+    while i < len2:
+        if best_size >= len2 - i:
+            break # Short circuit
+        j = i
+        k = 0
+        while k < len1 and j < len2:
+            if seq1[k] == seq2[j]:
+                current_size += 1
+                if current_size >= best_size:
+                    new_offset1 = k - current_size + 1
+                    new_offset2 = j - current_size + 1
+                    if current_size > best_size or (new_offset1 <= offset1 and new_offset2 <= offset2):
+                        offset1 = new_offset1
+                        offset2 = new_offset2
+                    best_size = current_size
+            else:
+                current_size = 0
+            j += 1
+            k += 1
+        i += 1
         current_size = 0
-        while i < len2:
-            if best_size >= len2 - i:
-                break # Short circuit
-            j = i
-            k = 0
-            while k < len1 and j < len2:
-                if seq1[k] == seq2[j]:
-                    current_size += 1
-                    if current_size >= best_size:
-                        new_offset1 = k - current_size + 1
-                        new_offset2 = j - current_size + 1
-                        if current_size > best_size or (new_offset1 <= offset1 and new_offset2 <= offset2):
-                            offset1 = new_offset1
-                            offset2 = new_offset2
-                        best_size = current_size
-                else:
-                    current_size = 0
-                j += 1
-                k += 1
-            i += 1
-            current_size = 0
-        return best_size, offset1, offset2
+    return best_size, offset1, offset2
+
+# py_longest_common_substring() works just as well on arrays of token IDs.
+py_longest_common_substring_ids = py_longest_common_substring
+
+if not HAS_LISTDIFFC:
+    longest_common_substring = py_longest_common_substring
+    longest_common_substring_ids = py_longest_common_substring_ids
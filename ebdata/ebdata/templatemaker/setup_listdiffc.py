@@ -0,0 +1,16 @@
+"""
+Builds listdiffc, the C version of longest_common_substring() that
+listdiff.py uses when it's available. From this directory, run:
+
+    python setup_listdiffc.py build_ext --inplace
+
+Without it, listdiff falls back to pure Python, which returns the same
+results, much more slowly.
+"""
+
+from distutils.core import setup, Extension
+
+setup(
+    name='listdiffc',
+    ext_modules=[Extension('listdiffc', ['listdiff.c'])],
+)
@@ -1,10 +1,10 @@
-from ebdata.templatemaker.hole import Hole
-from ebdata.templatemaker.listdiff import listdiff, longest_common_substring
+from ebdata.templatemaker.hole import Hole, OrHole
+from ebdata.templatemaker.listdiff import listdiff, token_ids, py_longest_common_substring, py_longest_common_substring_ids
 import unittest
 
 class LongestCommonSubstring(unittest.TestCase):
     def LCS(self, seq1, seq2):
-        return longest_common_substring(seq1, seq2)
+        return py_longest_common_substring(seq1, seq2)
 
     def assertLCS(self, seq1, seq2, expected_length, expected_offset1, expected_offset2):
         best_size, offset1, offset2 = self.LCS(seq1, seq2)
@@ -104,6 +104,33 @@ class LongestCommonSubstring(unittest.TestCase):
         "The LCS should be the earliest index in both strings."
         self.assertLCS(['a', 'd', 'a'], ['b', 'a', 'c'], 1, 0, 1)
 
+class LongestCommonSubstringIds(LongestCommonSubstring):
+    def LCS(self, seq1, seq2):
+        return py_longest_common_substring_ids(*token_ids(seq1, seq2))
+
+class TokenIdsTestCase(unittest.TestCase):
+    def assertTokenIds(self, l1, l2, expected1, expected2):
+        ids1, ids2 = token_ids(l1, l2)
+        self.assertEqual((list(ids1), list(ids2)), (expected1, expected2))
+
+    def test_empty(self):
+        self.assertTokenIds([], [], [], [])
+
+    def test_strings(self):
+        self.assertTokenIds(['a', 'b', 'a'], ['b', 'c'], [0, 1, 0], [1, 2])
+
+    def test_unicode(self):
+        self.assertTokenIds(['a'], [u'a'], [0], [0])
+
+    def test_holes(self):
+        self.assertTokenIds(['a', Hole()], [Hole(), 'a'], [0, 1], [1, 0])
+
+    def test_hole_subclasses(self):
+        self.assertTokenIds([Hole(), OrHole('a', 'b')], [OrHole('a', 'b'), OrHole('a'), Hole()], [0, 1], [1, 2, 0])
+
+    def test_unhashable(self):
+        self.assertTokenIds([['a'], 'a'], ['a', ['a']], [0, 1], [1, 0])
+
 class ListdiffTestCase(unittest.TestCase):
     def assertListdiff(self, l1, l2, expected):
         self.assertEqual(listdiff(l1, l2), expected)
@@ -3,7 +3,8 @@ These tests are identical to the ones in listdiff.py but use the C version of
 longest_common_substring instead of the pure Python version.
 """
 
-from ebdata.templatemaker.listdiffc import longest_common_subsequence as longest_common_substring
+from ebdata.templatemaker.listdiff import token_ids
+from ebdata.templatemaker.listdiffc import longest_common_substring, longest_common_substring_ids
 from listdiff import LongestCommonSubstring
 import unittest
 
@@ -11,6 +12,13 @@ class LongestCommonSubstringC(LongestCommonSubstring):
     def LCS(self, seq1, seq2):
         return longest_common_substring(seq1, seq2)
 
+class LongestCommonSubstringIdsC(LongestCommonSubstring):
+    def LCS(self, seq1, seq2):
+        return longest_common_substring_ids(*token_ids(seq1, seq2))
+
+    def test_not_id_arrays(self):
+        self.assertRaises(TypeError, longest_common_substring_ids, [1, 2], [1, 2])
+
 del LongestCommonSubstring
 
 if __name__ == "__main__":
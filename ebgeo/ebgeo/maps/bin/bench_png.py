@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Compares the PNG optimizers of EBCache on a sample of rendered tiles: bytes
+saved and milliseconds per tile for optipng(1), for lossless recompression in
+process, and for palette quantization in process.
+
+    python bench_png.py [options] directory [directory ...]
+
+The tiles are a random sample of the .png files under the given directories,
+e.g. a TileCache disk cache that was filled without optimization.
+"""
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+from ebgeo.maps.tilecache_service import optimize_png, recompress_png, quantize_png
+
+OPTIMIZERS = (
+    ('optipng', optimize_png),
+    ('recompress', recompress_png),
+    ('quantize', quantize_png),
+)
+
+def find_pngs(directories):
+    filenames = []
+    for directory in directories:
+        for dirpath, dirnames, names in os.walk(directory):
+            filenames.extend([os.path.join(dirpath, n) for n in names if n.endswith('.png')])
+    return filenames
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] directory [directory ...]')
+    p.add_option('-n', '--sample', dest='sample', type='int', default=200,
+                 help='number of tiles to sample')
+    opts, args = p.parse_args(argv)
+    if not args:
+        p.error('at least one directory is required')
+    filenames = find_pngs(args)
+    if not filenames:
+        p.error('no .png files found')
+    filenames = random.Random(0).sample(filenames, min(opts.sample, len(filenames)))
+    tiles = [open(f, 'rb').read() for f in filenames]
+    original = sum([len(t) for t in tiles])
+    print '%s tiles, %s bytes' % (len(tiles), original)
+    print '%-12s %12s %8s %10s' % ('', 'bytes', 'saved', 'ms/tile')
+    for name, optimize in OPTIMIZERS:
+        start = time.time()
+        optimized = sum([len(optimize(t)) for t in tiles])
+        elapsed = time.time() - start
+        print '%-12s %12d %7.1f%% %10.2f' % (name, optimized, (original - optimized) * 100.0 / original, elapsed * 1000 / len(tiles))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
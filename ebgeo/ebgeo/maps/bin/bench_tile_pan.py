@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Load-tests tile serving by simulating a map being panned across an area
+whose tiles aren't in the tile cache.
+
+At each step of the pan, every tile in the viewport is requested by a number
+of concurrent clients (like a browser's parallel connections), then the
+viewport moves one tile east. This is run three ways, each starting with an
+empty temporary tile cache:
+
+    * tilecache: Service.renderTile()'s path -- each request that misses the
+      cache calls MetaLayer.render(), which relies on TileCache's cache lock.
+    * coalesced: TileRenderer, rendering in the requesting threads.
+    * queued: TileRenderer with a pool of render threads.
+
+For each, it prints the tile latencies, the number of metatiles rendered
+and the total time.
+"""
+import Queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+from TileCache.Caches.Disk import Disk
+from TileCache.Layer import Tile
+from ebgeo.maps.extent import transform_extent
+from ebgeo.maps.mapserver import map_pool
+from ebgeo.maps.shortcuts import get_eb_layer
+from ebgeo.maps.tilerender import TileRenderer
+from ebpub.metros.allmetros import get_metro
+
+def get_uncoalesced(tile):
+    data = tile.layer.cache.get(tile)
+    if not data:
+        data = tile.layer.render(tile)
+    return data
+
+def pan(layer, get, start, viewport, steps, num_clients):
+    """
+    Requests the viewport's tiles at each step of the pan with get(tile).
+    Returns a list of the latencies of every request.
+    """
+    latencies = []
+    x0, y0, z = start
+    width, height = viewport
+    for step in xrange(steps):
+        requests = Queue.Queue()
+        for x in xrange(x0 + step, x0 + step + width):
+            for y in xrange(y0, y0 + height):
+                requests.put(Tile(layer, x, y, z))
+        def client():
+            while True:
+                try:
+                    tile = requests.get_nowait()
+                except Queue.Empty:
+                    return
+                t = time.time()
+                get(tile)
+                latencies.append(time.time() - t)
+        clients = [threading.Thread(target=client) for i in xrange(num_clients)]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+    return latencies
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] layername city_slug')
+    p.add_option('-z', '--zoom', dest='zoom', type='int', default=6,
+                 help='zoom level')
+    p.add_option('-s', '--steps', dest='steps', type='int', default=10,
+                 help='number of one-tile steps to pan')
+    p.add_option('--viewport', dest='viewport', default='4,3',
+                 help='viewport width and height in tiles, comma-separated')
+    p.add_option('-c', '--clients', dest='num_clients', type='int', default=6,
+                 help='number of concurrent requests')
+    p.add_option('-w', '--workers', dest='num_workers', type='int', default=2,
+                 help='number of render threads for the queued run')
+    opts, args = p.parse_args(argv)
+    if len(args) != 2:
+        p.error('required arguments `layername`, `city_slug`')
+    viewport = tuple([int(n) for n in opts.viewport.split(',')])
+
+    layer = get_eb_layer(args[0])
+    minx, miny, maxx, maxy = transform_extent(get_metro(args[1])['extent'], layer.dest_srs)
+    x, y, z = layer.getClosestCell(opts.zoom, ((minx + maxx) / 2, (miny + maxy) / 2))
+    start = (x - viewport[0] / 2, y - viewport[1] / 2, opts.zoom)
+    print 'Panning %s steps east from tile %s,%s at zoom %s, %sx%s viewport, %s clients' % (
+        opts.steps, start[0], start[1], opts.zoom, viewport[0], viewport[1], opts.num_clients)
+    print '%-10s %8s %10s %10s %10s %10s %9s' % ('', 'tiles', 'p50 (s)', 'p95 (s)', 'max (s)', 'total (s)', 'renders')
+
+    old_cache = layer.cache
+    runs = (
+        ('tilecache', get_uncoalesced),
+        ('coalesced', TileRenderer().get),
+        ('queued', TileRenderer(opts.num_workers, 100).get),
+    )
+    try:
+        for name, get in runs:
+            cache_dir = tempfile.mkdtemp(prefix='bench_tile_pan')
+            layer.cache = Disk(cache_dir)
+            map_pool.clear()
+            renders = map_pool.hits + map_pool.misses
+            try:
+                t = time.time()
+                latencies = pan(layer, get, start, viewport, opts.steps, opts.num_clients)
+                total = time.time() - t
+            finally:
+                shutil.rmtree(cache_dir)
+            renders = map_pool.hits + map_pool.misses - renders
+            latencies.sort()
+            print '%-10s %8d %10.3f %10.3f %10.3f %10.2f %9d' % (name, len(latencies),
+                percentile(latencies, 0.5), percentile(latencies, 0.95), latencies[-1], total, renders)
+    finally:
+        layer.cache = old_cache
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
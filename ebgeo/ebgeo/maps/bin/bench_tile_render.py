@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Measures tile rendering throughput with a cold and a warm map pool.
+
+Renders the metatiles covering a city at the given zoom levels twice: once
+building a new map for every metatile, as the tile layer used to, and once
+through ebgeo.maps.mapserver.map_pool.
+
+The maps read whatever datasources the Mapnik XML stylesheets point at, so
+point MAPS_POSTGIS_* at a local PostGIS database (or use stylesheets with
+shapefile datasources) to keep network latency out of the numbers.
+"""
+import sys
+import time
+from optparse import OptionParser
+from TileCache.Layer import Tile
+from ebgeo.maps.mapserver import get_mapserver, map_pool
+from ebgeo.maps.shortcuts import get_eb_layer, get_all_tile_coords
+
+def render_unpooled(layer, tile):
+    width, height = tile.size()
+    mapserver = get_mapserver(layer.name)(layer.dest_srs, width=width, height=height)
+    mapserver.zoom_to_bbox(*tile.bounds())
+    return mapserver('image/%s' % layer.extension)
+
+def render_pooled(layer, tile):
+    return layer.renderTile(tile)
+
+def benchmark(layer, coords, render):
+    start = time.time()
+    for x, y, z in coords:
+        render(layer, Tile(layer, x, y, z))
+    return len(coords) / (time.time() - start)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] layername city_slug')
+    p.add_option('-z', '--levels', dest='levels', default='0,3',
+                 help='start and stop zoom levels, comma-separated')
+    p.add_option('-n', '--max-tiles', dest='max_tiles', type='int', default=200,
+                 help='maximum number of metatiles to render per run')
+    opts, args = p.parse_args(argv)
+    if len(args) != 2:
+        p.error('required arguments `layername`, `city_slug`')
+    levels = tuple([int(l) for l in opts.levels.split(',')])
+
+    layer = get_eb_layer(args[0])
+    layer.extension = 'png'
+    coords = list(get_all_tile_coords(layer, cities=args[1], levels=levels))[:opts.max_tiles]
+    print '%s metatiles' % len(coords)
+
+    print 'no pool:   %.2f tiles/second' % benchmark(layer, coords, render_unpooled)
+    map_pool.clear()
+    print 'cold pool: %.2f tiles/second' % benchmark(layer, coords, render_pooled)
+    print 'warm pool: %.2f tiles/second' % benchmark(layer, coords, render_pooled)
+    print 'pool hits: %s, misses: %s' % (map_pool.hits, map_pool.misses)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import sys
 import os.path
+import threading
 from cStringIO import StringIO
 from mapnik import *
 from django.conf import settings
@@ -87,11 +88,79 @@ class MapServer(Map):
     def draw_map(self):
         raise NotImplementedError('subclasses must implement draw_map() method')
 
+    def prepare(self):
+        """
+        Adds the map's layers, the first time it's called, so that the map
+        can be rendered more than once (e.g., after zooming elsewhere).
+        """
+        if not getattr(self, '_prepared', False):
+            self.draw_map()
+            self._prepared = True
+
     def __call__(self, mimetype='image/png'):
-        self.draw_map()
+        self.prepare()
         img = self.render_image()
         return self.get_graphic(img, mimetype)
 
+class MapPool(object):
+    """
+    A per-process pool of prepared MapServer instances, so that rendering a
+    tile doesn't have to re-parse the Mapnik XML stylesheet and re-create the
+    map's layers and datasources every time.
+
+    Maps are keyed by map type (i.e., stylesheet) and size. A map that is
+    checked out is used by only one thread until it's checked back in.
+    """
+    def __init__(self, max_idle=4):
+        # max_idle is the number of idle maps kept per key.
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def checkout(self, maptype, proj4, width=None, height=None):
+        """
+        Returns a prepared MapServer of the given type and size, reusing an
+        idle one if possible.
+        """
+        key = (maptype, width or TILE_SIZE, height or TILE_SIZE)
+        self.lock.acquire()
+        try:
+            try:
+                mapserver = self.idle.get(key, []).pop()
+            except IndexError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                return mapserver
+        finally:
+            self.lock.release()
+        mapserver = get_mapserver(maptype)(proj4, width=key[1], height=key[2])
+        mapserver.prepare()
+        mapserver._pool_key = key
+        return mapserver
+
+    def checkin(self, mapserver):
+        """
+        Returns a map obtained from checkout() to the pool.
+        """
+        self.lock.acquire()
+        try:
+            maps = self.idle.setdefault(mapserver._pool_key, [])
+            if len(maps) < self.max_idle:
+                maps.append(mapserver)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+map_pool = MapPool()
+
 class MainMap(MapServer):
     maptype = 'main'
 
@@ -3,14 +3,38 @@ from TileCache.Service import Service
 from TileCache.Layer import Tile
 from ebgeo.maps.extent import transform_extent, buffer_extent
 from ebgeo.maps.tile import get_tile_coords
-from ebgeo.maps.mapserver import get_mapserver
+from ebgeo.maps.mapserver import get_mapserver, map_pool
 from ebgeo.maps.utils import extent_scale
 from ebpub.metros.allmetros import get_metro, METRO_DICT
+from ebgeo.maps.tilerender import get_tile_renderer
 from django.contrib.gis.gdal import SpatialReference
+import copy
+import threading
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    """
+    Returns the TileCache Service configured by settings.TILECACHE_CONFIG.
+    The configuration is only loaded once per process.
+    """
+    global _service
+    if _service is None:
+        _service_lock.acquire()
+        try:
+            if _service is None:
+                _service = Service.load(settings.TILECACHE_CONFIG)
+        finally:
+            _service_lock.release()
+    return _service
 
 def get_eb_layer(name):
-    svc = Service.load(settings.TILECACHE_CONFIG)
-    return svc.layers[name]
+    """
+    Returns the named layer. It's shared by everything in this process, so
+    copy it before changing it.
+    """
+    return get_service().layers[name]
 
 def render_tile(name, z, x, y, source_srs=None, dest_srs=None, bbox=None,
                 scales=None, units=None, extension='png'):
@@ -20,7 +44,7 @@ def render_tile(name, z, x, y, source_srs=None, dest_srs=None, bbox=None,
     Useful for views and for rendering scripts. Main config options can be
     overriden.
     """
-    layer = get_eb_layer(name)
+    layer = copy.copy(get_eb_layer(name))
     if source_srs is not None:
         layer.source_srs = source_srs
     if dest_srs is not None:
@@ -33,6 +57,17 @@ def render_tile(name, z, x, y, source_srs=None, dest_srs=None, bbox=None,
     tile = Tile(layer, x, y, z)
     return layer.renderTile(tile)
 
+def get_cached_tile(name, z, x, y, extension='png'):
+    """
+    Returns the bytes of a map tile from the tile cache. If it isn't cached,
+    its metatile is rendered and cached first (see ebgeo.maps.tilerender).
+    """
+    layer = get_eb_layer(name)
+    if layer.extension != extension:
+        layer = copy.copy(layer)
+        layer.extension = extension
+    return get_tile_renderer().get(Tile(layer, x, y, z))
+
 def get_citywide_mapserver(maptype, size=(75,75), extension=None):
     map_srs = SpatialReference(settings.SPATIAL_REF_SYS)
     mapserver = get_mapserver(maptype)(map_srs.proj4, width=size[0], height=size[1])
@@ -41,9 +76,11 @@ def get_citywide_mapserver(maptype, size=(75,75), extension=None):
 def render_locator_map(city_slug, size=(75,75), extension='png'):
     map_srs = SpatialReference(settings.SPATIAL_REF_SYS)
     bbox = city_extent_in_map_srs(city_slug)
-    mapserver = get_mapserver('locator')(map_srs.proj4, width=size[0], height=size[1])
+    mapserver = map_pool.checkout('locator', map_srs.proj4, width=size[0], height=size[1])
     mapserver.zoom_to_bbox(*bbox)
-    return mapserver(extension)
+    data = mapserver(extension)
+    map_pool.checkin(mapserver)
+    return data
 
 def get_locator_scale(city_slug, size=(75,75)):
     bbox = transform_extent(get_metro(city_slug)['extent'], settings.SPATIAL_REF_SYS)
@@ -1,7 +1,16 @@
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from cStringIO import StringIO
+from PIL import Image
+from TileCache.Caches.Disk import Disk
 from extent import transform_extent, city_from_extent
 from tess import tessellate, cover_region, cover_city
 from shortcuts import get_all_tile_coords, extent_in_map_srs, city_extent_in_map_srs, get_locator_scale
+from tilecache_service import EBCache, quantize_png
+from tilerender import TileRenderer
 
 class ExtentTestCase(unittest.TestCase):
     def test_transform_extent(self):
@@ -116,5 +125,129 @@ class ShortcutsTestCase(unittest.TestCase):
                                get_locator_scale('chicago'),
                                places=0)
 
+class FakeTile(object):
+    def __init__(self, layer, x, y, z):
+        self.layer, self.x, self.y, self.z = layer, x, y, z
+
+class FakeLayer(object):
+    "A layer with 2x2 metatiles whose render takes a while."
+    name = 'fake'
+    extension = 'png'
+    metaTile = True
+
+    def __init__(self):
+        self.cache = self
+        self.data = {}
+        self.renders = 0
+
+    def get(self, tile):
+        return self.data.get((tile.x, tile.y, tile.z))
+
+    def getMetaTile(self, tile):
+        return FakeTile(self, tile.x // 2, tile.y // 2, tile.z)
+
+    def render(self, tile):
+        self.renders += 1
+        time.sleep(0.1)
+        metatile = self.getMetaTile(tile)
+        for x in (metatile.x * 2, metatile.x * 2 + 1):
+            for y in (metatile.y * 2, metatile.y * 2 + 1):
+                self.data[(x, y, tile.z)] = '%s,%s' % (x, y)
+        return self.data[(tile.x, tile.y, tile.z)]
+
+class TileRendererTestCase(unittest.TestCase):
+    def _get_concurrently(self, renderer, layer, coords):
+        results = {}
+        def get(x, y):
+            results[(x, y)] = renderer.get(FakeTile(layer, x, y, 0))
+        threads = [threading.Thread(target=get, args=c) for c in coords]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesced(self):
+        layer = FakeLayer()
+        coords = [(0, 0), (0, 1), (1, 0), (1, 1), (1, 1), (2, 0)]
+        results = self._get_concurrently(TileRenderer(), layer, coords)
+        self.assertEqual(layer.renders, 2)
+        for x, y in coords:
+            self.assertEqual(results[(x, y)], '%s,%s' % (x, y))
+
+    def test_queued(self):
+        layer = FakeLayer()
+        coords = [(0, 0), (1, 1), (2, 2), (3, 3)]
+        results = self._get_concurrently(TileRenderer(num_workers=1, max_queued=1), layer, coords)
+        self.assertEqual(layer.renders, 2)
+        for x, y in coords:
+            self.assertEqual(results[(x, y)], '%s,%s' % (x, y))
+
+    def test_cached(self):
+        layer = FakeLayer()
+        renderer = TileRenderer()
+        self.assertEqual(renderer.get(FakeTile(layer, 0, 0, 0)), '0,0')
+        self.assertEqual(renderer.get(FakeTile(layer, 1, 0, 0)), '1,0')
+        self.assertEqual(layer.renders, 1)
+
+class QuantizePngTestCase(unittest.TestCase):
+    def _png(self, image):
+        out = StringIO()
+        image.save(out, 'PNG')
+        return out.getvalue()
+
+    def _tile(self, alpha):
+        image = Image.new('RGBA', (256, 256), (255, 255, 255, 255))
+        for i in xrange(256):
+            image.putpixel((i, i), (i, 255 - i, 128, 255))
+        image.paste((0, 0, 0, alpha), (0, 0, 64, 64))
+        return image
+
+    def test_opaque(self):
+        image = Image.open(StringIO(quantize_png(self._png(self._tile(255)))))
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(image.convert('RGB').getpixel((10, 10)), (0, 0, 0))
+
+    def test_transparent(self):
+        image = Image.open(StringIO(quantize_png(self._png(self._tile(0)))))
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(image.getpixel((10, 10)), image.info['transparency'])
+        self.assertNotEqual(image.getpixel((100, 200)), image.info['transparency'])
+
+    def test_partially_transparent(self):
+        image = Image.open(StringIO(quantize_png(self._png(self._tile(128)))))
+        self.assertEqual(image.mode, 'RGBA')
+        self.assertEqual(image.getpixel((10, 10)), (0, 0, 0, 128))
+
+class EBCacheReplaceTestCase(unittest.TestCase):
+    "EBCache.replace() mustn't overwrite a tile that has changed since."
+    def setUp(self):
+        self.base = tempfile.mkdtemp(prefix='ebcache')
+        self.cache = EBCache(self.base)
+        self.tile = FakeTile(FakeLayer(), 1, 2, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_unchanged(self):
+        Disk.set(self.cache, self.tile, 'rendered')
+        version = self.cache.stored_version(self.tile)
+        self.assert_(self.cache.replace(self.tile, version, 'optimized'))
+        self.assertEqual(self.cache.get(self.tile), 'optimized')
+
+    def test_expired(self):
+        Disk.set(self.cache, self.tile, 'rendered')
+        version = self.cache.stored_version(self.tile)
+        self.cache.delete(self.tile)
+        self.failIf(self.cache.replace(self.tile, version, 'optimized'))
+        self.assertEqual(self.cache.get(self.tile), None)
+
+    def test_rerendered(self):
+        Disk.set(self.cache, self.tile, 'rendered')
+        version = self.cache.stored_version(self.tile)
+        Disk.set(self.cache, self.tile, 'rendered again')
+        self.failIf(self.cache.replace(self.tile, version, 'optimized'))
+        self.assertEqual(self.cache.get(self.tile), 'rendered again')
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,5 @@
 from TileCache.Layer import MetaLayer
-from ebgeo.maps.mapserver import get_mapserver
+from ebgeo.maps.mapserver import map_pool
 from ebgeo.maps.utils import get_resolution
 from ebgeo.maps.extent import transform_extent, city_from_extent
 
@@ -40,12 +40,14 @@ class EBLayer(MetaLayer):
         tile_bbox = tile.bounds()
 
         width, height = tile.size()
-        mapserver = get_mapserver(self.name)(self.dest_srs, width=width, height=height)
+        mapserver = map_pool.checkout(self.name, self.dest_srs, width=width, height=height)
         mapserver.zoom_to_bbox(*tile_bbox)
         mimetype = 'image/%s' % self.extension
         # Calling the mapserver instance gives the raw bytestream
         # of the tile image
         tile.data = mapserver(mimetype)
+        # The map is only returned to the pool if rendering succeeded.
+        map_pool.checkin(mapserver)
         return tile.data
 
 def get_tile_coords(layer, levels=(0, 5), bboxes=None):
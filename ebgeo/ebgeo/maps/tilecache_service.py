@@ -1,6 +1,12 @@
+import logging
+import os
+import Queue
 import re
 import subprocess
 import tempfile
+import threading
+from cStringIO import StringIO
+from PIL import Image
 from TileCache.Service import Service, Request, TileCacheException
 from TileCache.Caches.Disk import Disk
 import TileCache.Layer as Layer
@@ -40,9 +46,111 @@ class EBService(Service):
             return (tile.format, tile.data)
 
 class EBCache(Disk):
+    """
+    A disk cache that optimizes the PNG tiles it stores.
+
+    Besides Disk's options, it takes these from the TileCache config file:
+
+        optimizer
+            'optipng' (the default) to run optipng(1) on each tile, or
+            'quantize' to reduce each tile to a palette in process (see
+            quantize_png()).
+
+        background
+            'yes' to store each tile as rendered and replace it with the
+            optimized version from a background thread, so that optimizing
+            isn't on the request path. Defaults to 'no'. The optimized
+            version isn't stored if the tile has been expired or stored
+            again in the meantime.
+    """
+    def __init__(self, base=None, optimizer='optipng', background='no', **kwargs):
+        Disk.__init__(self, base, **kwargs)
+        if optimizer not in OPTIMIZERS:
+            raise TileCacheException('unknown PNG optimizer %r: should be one of %s' % (optimizer, ', '.join(OPTIMIZERS)))
+        self.optimize = OPTIMIZERS[optimizer]
+        self.background = background in (True, 'yes', 'true', '1')
+
     def set(self, tile, data):
-        data = optimize_png(data)
-        Disk.set(self, tile, data)
+        if self.background:
+            Disk.set(self, tile, data)
+            if background_optimizer.put(self, tile, data, self.stored_version(tile)):
+                return data
+        return Disk.set(self, tile, self.optimize(data))
+
+    def stored_version(self, tile):
+        """
+        Returns a value that changes whenever the tile's file is replaced or
+        deleted, or None if there's no file.
+        """
+        try:
+            st = os.stat(self.getKey(tile))
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+    def replace(self, tile, version, data):
+        """
+        Stores data as the given tile if its file is still the given
+        stored_version(). Returns True if it was stored.
+        """
+        filename = self.getKey(tile)
+        tmpfile = '%s.%d.optimized.tmp' % (filename, os.getpid())
+        output = open(tmpfile, 'wb')
+        try:
+            output.write(data)
+        finally:
+            output.close()
+        try:
+            st = os.stat(filename)
+        except OSError:
+            st = None
+        if st is None or (st.st_ino, st.st_size, st.st_mtime, st.st_ctime) != version:
+            os.unlink(tmpfile)
+            return False
+        os.chmod(tmpfile, st.st_mode & 07777)
+        os.rename(tmpfile, filename)
+        return True
+
+class BackgroundOptimizer(object):
+    """
+    A thread that optimizes tiles after they've been stored, and stores the
+    optimized versions in their place (see EBCache.replace()).
+    """
+    def __init__(self, max_queued=1000):
+        self.queue = Queue.Queue(max_queued)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, cache, tile, data, version):
+        """
+        Queues the tile, whose file has the given EBCache.stored_version(),
+        for optimizing. Returns False if the queue is full, in which case the
+        caller should optimize the tile itself.
+        """
+        if self.thread is None:
+            self.lock.acquire()
+            try:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._work)
+                    self.thread.setDaemon(True)
+                    self.thread.start()
+            finally:
+                self.lock.release()
+        try:
+            self.queue.put_nowait((cache, tile, data, version))
+        except Queue.Full:
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            cache, tile, data, version = self.queue.get()
+            try:
+                cache.replace(tile, version, cache.optimize(data))
+            except Exception:
+                logging.exception('Optimizing tile %s,%s,%s of %s failed' % (tile.x, tile.y, tile.z, tile.layer.name))
+
+background_optimizer = BackgroundOptimizer()
 
 def optimize_png(data):
     """
@@ -67,3 +175,56 @@ def optimize_png(data):
     finally:
         opt_f.close()
         temp_f.close()
+
+def recompress_png(data):
+    """
+    Recompresses a PNG in process, losslessly, with zlib's highest
+    compression level. Returns whichever of the two PNGs is smaller.
+    """
+    image = Image.open(StringIO(data))
+    out = StringIO()
+    if 'transparency' in image.info:
+        image.save(out, 'PNG', optimize=True, transparency=image.info['transparency'])
+    else:
+        image.save(out, 'PNG', optimize=True)
+    result = out.getvalue()
+    return len(result) < len(data) and result or data
+
+def quantize_png(data, colors=256):
+    """
+    Reduces a PNG to a palette of at most the given number of colors, in
+    process, and compresses it with zlib's highest compression level (PIL
+    doesn't filter palette images' rows, which suits them best). Returns
+    whichever of the two PNGs is smaller.
+
+    Fully transparent pixels get a palette entry of their own. Tiles with
+    partially transparent pixels can't be represented that way, so they're
+    only recompressed losslessly (see recompress_png()).
+    """
+    image = Image.open(StringIO(data))
+    image.load()
+    if image.mode == 'P':
+        return recompress_png(data)
+    transparent = None
+    if image.mode in ('RGBA', 'LA'):
+        alpha = image.split()[-1]
+        histogram = alpha.histogram()
+        if sum(histogram[1:255]):
+            return recompress_png(data)
+        if histogram[0]:
+            transparent = alpha.point(lambda a: a == 0 and 255 or 0)
+            colors -= 1
+    image = image.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=colors)
+    out = StringIO()
+    if transparent is not None:
+        image.paste(colors, None, transparent)
+        image.save(out, 'PNG', optimize=True, transparency=colors)
+    else:
+        image.save(out, 'PNG', optimize=True)
+    result = out.getvalue()
+    return len(result) < len(data) and result or data
+
+OPTIMIZERS = {
+    'optipng': optimize_png,
+    'quantize': quantize_png,
+}
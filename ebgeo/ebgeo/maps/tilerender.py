@@ -0,0 +1,129 @@
+"""
+Renders map tiles on demand, a metatile at a time.
+
+When a tile isn't in the TileCache cache, MetaLayer.render() renders its
+whole metatile and caches all of the metatile's tiles. TileRenderer makes
+concurrent requests in this process for tiles of the same metatile wait for
+a single render, rather than each rendering it; across processes, TileCache's
+cache lock does the same.
+
+If settings.TILE_RENDER_WORKERS is set, renders are handed to that many
+worker threads through a queue of at most settings.TILE_RENDER_QUEUE_SIZE
+metatiles, and each request waits only until its own metatile is done. When
+the queue is full, the request renders its metatile itself.
+"""
+
+from django.conf import settings
+import Queue
+import threading
+
+class PendingRender(object):
+    "A render that one or more requests are waiting for."
+    def __init__(self, tile):
+        self.tile = tile
+        self.data = None
+        self.error = None
+        self.done = threading.Event()
+
+class TileRenderer(object):
+    def __init__(self, num_workers=0, max_queued=100):
+        # self.pending maps render keys (see render_key()) to PendingRenders.
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.renders = 0
+        self.queue = None
+        if num_workers:
+            self.queue = Queue.Queue(max_queued)
+            for i in xrange(num_workers):
+                worker = threading.Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+
+    def render_key(self, tile):
+        """
+        Returns a key that's the same for all the tiles that are rendered
+        together, i.e., the tiles of a metatile.
+        """
+        layer = tile.layer
+        if layer.metaTile:
+            metatile = layer.getMetaTile(tile)
+            x, y = metatile.x, metatile.y
+        else:
+            x, y = tile.x, tile.y
+        return (layer.name, layer.extension, tile.z, x, y)
+
+    def get(self, tile):
+        """
+        Returns the bytes of the given tile, from the cache if it's there.
+        Otherwise renders and caches its metatile first, or waits for the
+        render that's already under way.
+        """
+        cache = tile.layer.cache
+        data = cache.get(tile)
+        if data:
+            return data
+        key = self.render_key(tile)
+        self.lock.acquire()
+        try:
+            pending = self.pending.get(key)
+            first = pending is None
+            if first:
+                pending = self.pending[key] = PendingRender(tile)
+        finally:
+            self.lock.release()
+        if first:
+            queued = False
+            if self.queue is not None:
+                try:
+                    self.queue.put_nowait((key, pending))
+                    queued = True
+                except Queue.Full:
+                    pass
+            if not queued:
+                self._render(key, pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        if (tile.x, tile.y) == (pending.tile.x, pending.tile.y):
+            return pending.data
+        # The render cached all the tiles of the metatile.
+        return cache.get(tile)
+
+    def _render(self, key, pending):
+        try:
+            try:
+                pending.data = pending.tile.layer.render(pending.tile)
+            except Exception, e:
+                pending.error = e
+        finally:
+            self.lock.acquire()
+            try:
+                del self.pending[key]
+                self.renders += 1
+            finally:
+                self.lock.release()
+            pending.done.set()
+
+    def _work(self):
+        while True:
+            key, pending = self.queue.get()
+            self._render(key, pending)
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def get_tile_renderer():
+    """
+    Returns the TileRenderer for this process, configured by
+    settings.TILE_RENDER_WORKERS and settings.TILE_RENDER_QUEUE_SIZE.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer_lock.acquire()
+        try:
+            if _renderer is None:
+                _renderer = TileRenderer(getattr(settings, 'TILE_RENDER_WORKERS', 0),
+                                         getattr(settings, 'TILE_RENDER_QUEUE_SIZE', 100))
+        finally:
+            _renderer_lock.release()
+    return _renderer
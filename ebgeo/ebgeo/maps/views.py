@@ -4,7 +4,7 @@ from django.http import HttpResponse, Http404
 from django.shortcuts import render_to_response
 import mapnik
 from ebgeo.maps.mapserver import get_mapserver
-from ebgeo.maps.shortcuts import render_tile, render_locator_map
+from ebgeo.maps.shortcuts import get_cached_tile, render_locator_map
 from ebgeo.maps.markers import make_marker
 from ebgeo.maps.cached_image import CachedImageResponse
 
@@ -21,7 +21,7 @@ class TileResponse(object):
 def get_tile(request, version, layername, z, x, y, extension='png'):
     'Returns a map tile in the requested format'
     z, x, y = int(z), int(x), int(y)
-    response = TileResponse(render_tile(layername, z, x, y, extension=extension))
+    response = TileResponse(get_cached_tile(layername, z, x, y, extension=extension))
     return response(extension)
 
 def locator_map(request, version, city, extension='png'):
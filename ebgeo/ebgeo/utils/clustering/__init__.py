@@ -3,7 +3,7 @@ from ebgeo.utils.clustering import cluster
 from django.conf import settings
 
 def cluster_by_scale(objs, radius, scale, extent=(-180, -90, 180, 90),
-                     cluster_fn=cluster.buffer_cluster):
+                     cluster_fn=cluster.grid_cluster):
     """
     Required parameters:
 
@@ -25,5 +25,5 @@ def cluster_by_scale(objs, radius, scale, extent=(-180, -90, 180, 90),
     return bunches
 
 def cluster_scales(objs, radius, scales=settings.MAP_SCALES, extent=(-180, -90, 180, 90),
-                   cluster_fn=cluster.buffer_cluster):
+                   cluster_fn=cluster.grid_cluster):
     return dict([(scale, cluster_by_scale(objs, radius, scale, extent, cluster_fn)) for scale in scales])
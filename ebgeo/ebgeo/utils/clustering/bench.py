@@ -0,0 +1,60 @@
+"""
+Benchmarks grid_cluster() against buffer_cluster() at every scale in
+settings.MAP_SCALES, and checks that both return the same bunches.
+
+    python bench.py [max_old_points]
+
+buffer_cluster() is quadratic, so it's only run for point counts up to
+max_old_points (10,000 by default).
+"""
+
+import random
+import sys
+import time
+from django.conf import settings
+from ebgeo.utils.clustering import cluster, cluster_by_scale
+from ebgeo.utils.clustering.sample import extent
+
+POINT_COUNTS = (1000, 10000, 100000)
+RADIUS = 26 # The default in cluster_newsitems().
+
+def gen_objs(n, extent=extent, rand_seed=None):
+    """
+    Returns a dict of n random lng/lat points within extent, keyed by
+    integer IDs.
+    """
+    rand = random.Random(rand_seed)
+    return dict([(i, (rand.uniform(extent[0], extent[2]), rand.uniform(extent[1], extent[3])))
+                 for i in xrange(n)])
+
+def time_clustering(objs, scale, cluster_fn):
+    start = time.time()
+    bunches = cluster_by_scale(objs, RADIUS, scale, cluster_fn=cluster_fn)
+    return time.time() - start, bunches
+
+def same_bunches(a, b):
+    return [(x.objects, x.center) for x in a] == [(x.objects, x.center) for x in b]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    max_old_points = argv and int(argv[0]) or 10000
+    mismatches = 0
+    print '%7s %7s %8s %12s %12s' % ('points', 'scale', 'bunches', 'buffer (s)', 'grid (s)')
+    for n in POINT_COUNTS:
+        objs = gen_objs(n, rand_seed=n)
+        for scale in settings.MAP_SCALES:
+            grid_time, grid_bunches = time_clustering(objs, scale, cluster.grid_cluster)
+            if n <= max_old_points:
+                buffer_time, buffer_bunches = time_clustering(objs, scale, cluster.buffer_cluster)
+                if not same_bunches(buffer_bunches, grid_bunches):
+                    print 'MISMATCH at %s points, scale %s' % (n, scale)
+                    mismatches += 1
+                buffer_time = '%12.4f' % buffer_time
+            else:
+                buffer_time = '%12s' % '-'
+            print '%7d %7d %8d %s %12.4f' % (n, scale, len(grid_bunches), buffer_time, grid_time)
+    return mismatches and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
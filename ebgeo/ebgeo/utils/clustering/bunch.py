@@ -3,13 +3,17 @@ class Bunch(object):
     A bunch is a list of objects which knows its center point,
     determined as the average of its objects' points. It's a useful
     data structure for clustering.
+
+    The center is kept up to date from running sums of the points'
+    coordinates, so adding an object takes constant time.
     """
-    __slots__ = ["objects", "center", "points"]
+    __slots__ = ["objects", "center", "points", "sum_x", "sum_y"]
 
     def __init__(self, obj, point):
         self.objects = []
         self.points = []
         self.center = (0, 0)
+        self.sum_x = self.sum_y = 0
         self.add_obj(obj, point)
 
     def add_obj(self, obj, point):
@@ -18,9 +22,11 @@ class Bunch(object):
         self.update_center(point)
 
     def update_center(self, point):
-        xs = [p[0] for p in self.points]
-        ys = [p[1] for p in self.points]
-        self.center = (sum(xs) * 1.0 / len(self.objects), sum(ys) * 1.0 / len(self.objects))
+        # The sums are accumulated in the same order as sum() over
+        # self.points would, so the center is exactly the same.
+        self.sum_x += point[0]
+        self.sum_y += point[1]
+        self.center = (self.sum_x * 1.0 / len(self.objects), self.sum_y * 1.0 / len(self.objects))
 
     def x(self):
         return self.center[0]
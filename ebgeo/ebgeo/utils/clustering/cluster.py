@@ -57,3 +57,52 @@ def buffer_cluster(objects, radius, dist_fn=euclidean_distance):
         if not bunched:
             bunches.append(Bunch(key, point))
     return bunches
+
+# Grid cells are made a tiny bit bigger than the radius, so that floating
+# point error in computing a point's cell can never put a bunch center that's
+# within the radius more than one cell away from the point.
+GRID_CELL_MARGIN = 1.000001
+
+def grid_cluster(objects, radius):
+    """
+    Clusters objects exactly like buffer_cluster() does (with the default
+    Euclidean distance) and returns the same bunches in the same order, but
+    uses a grid index instead of comparing each point with every bunch.
+
+    Bunches are bucketed by the grid cell of their center, with cells the
+    size of the radius, so only the bunches in the 3x3 cells around a point
+    can be within the radius of it. Of those, the point joins the oldest one
+    within the radius, which is the one buffer_cluster() would have found
+    first.
+    """
+    if radius <= 0:
+        return buffer_cluster(objects, radius)
+    cell_size = radius * GRID_CELL_MARGIN
+    def cell(point):
+        return (int(math.floor(point[0] / cell_size)), int(math.floor(point[1] / cell_size)))
+
+    bunches = []
+    bunch_cells = [] # The cell of each bunch's center, by bunch index.
+    grid = {}        # Maps cells to lists of bunch indexes.
+    for key, point in objects.iteritems():
+        x, y = cell(point)
+        found = None
+        for i in (x - 1, x, x + 1):
+            for j in (y - 1, y, y + 1):
+                for index in grid.get((i, j), ()):
+                    if (found is None or index < found) and euclidean_distance(point, bunches[index].center) <= radius:
+                        found = index
+        if found is None:
+            bunches.append(Bunch(key, point))
+            bunch_cells.append((x, y))
+            grid.setdefault((x, y), []).append(len(bunches) - 1)
+        else:
+            bunch = bunches[found]
+            bunch.add_obj(key, point)
+            # Adding the point moved the bunch's center, maybe into another cell.
+            new_cell = cell(bunch.center)
+            if new_cell != bunch_cells[found]:
+                grid[bunch_cells[found]].remove(found)
+                grid.setdefault(new_cell, []).append(found)
+                bunch_cells[found] = new_cell
+    return bunches
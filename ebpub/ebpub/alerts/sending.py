@@ -4,9 +4,13 @@ from django.template.loader import render_to_string
 from ebpub.alerts.models import EmailAlert
 from ebpub.db.models import NewsItem
 from ebpub.db.utils import populate_attributes_if_needed
-from ebpub.db.views import make_search_buffer
+from ebpub.db.views import filter_by_block
 from ebpub.streets.models import Block
 import datetime
+import Queue
+import sys
+import threading
+import time
 
 class NoNews(Exception):
     pass
@@ -32,54 +36,206 @@ def email_text_for_place(alert, place, place_name, place_url, newsitem_list, dat
     }
     return render_to_string('alerts/email.txt', context), render_to_string('alerts/email.html', context)
 
-def email_for_subscription(alert, start_date, frequency):
+def newsitems_for_place(alert, start_date):
     """
-    Returns a (place_name, text, html) tuple for the given EmailAlert
-    object and date.
+    Returns a (place, place_name, place_url, newsitem_list) tuple for the
+    given EmailAlert's block/radius or location. newsitem_list contains the
+    public NewsItems published between start_date and the end of yesterday,
+    regardless of the alert's schemas (see filter_schemas()), so it can be
+    shared by every alert for the same place.
     """
     start_datetime = datetime.datetime(start_date.year, start_date.month, start_date.day)
     yesterday = datetime.date.today() - datetime.timedelta(days=1)
     end_datetime = datetime.datetime.combine(yesterday, datetime.time(23, 59, 59, 9999)) # the end of yesterday
     # Order by schema__id to group schemas together.
     qs = NewsItem.objects.select_related().filter(schema__is_public=True, pub_date__range=(start_datetime, end_datetime)).order_by('-schema__importance', 'schema__id')
-    if alert.include_new_schemas:
-        if alert.schemas:
-            qs = qs.exclude(schema__id__in=alert.schemas.split(','))
-    else:
-        if alert.schemas:
-            qs = qs.filter(schema__id__in=alert.schemas.split(','))
     if alert.block:
         place_name, place_url = alert.block.pretty_name, alert.block.url()
         place = alert.block
-        search_buffer = make_search_buffer(alert.block.location.centroid, alert.radius)
-        qs = qs.filter(location__bboverlaps=search_buffer)
+        qs = filter_by_block(qs, alert.block, alert.radius)
     elif alert.location:
         place_name, place_url = alert.location.name, alert.location.url()
         place = alert.location
         qs = qs.filter(newsitemlocation__location__id=alert.location.id)
-    ni_list = list(qs)
+    return place, place_name, place_url, list(qs)
+
+def filter_schemas(alert, newsitem_list):
+    """
+    Returns the NewsItems in newsitem_list that the given EmailAlert's
+    schemas and include_new_schemas select, keeping their order.
+    """
+    if not alert.schemas:
+        return newsitem_list
+    schema_ids = set([int(s) for s in alert.schemas.split(',')])
+    if alert.include_new_schemas:
+        return [ni for ni in newsitem_list if ni.schema_id not in schema_ids]
+    return [ni for ni in newsitem_list if ni.schema_id in schema_ids]
+
+def place_key(alert):
+    "Returns a key that's the same for EmailAlerts with the same place."
+    if alert.block_id:
+        return ('block', alert.block_id, alert.radius)
+    return ('location', alert.location_id)
+
+def populate_attributes(newsitem_list):
+    schemas_used = dict([(ni.schema_id, ni.schema) for ni in newsitem_list]).values()
+    populate_attributes_if_needed(newsitem_list, schemas_used)
+
+def email_for_subscription(alert, start_date, frequency):
+    """
+    Returns a (place_name, text, html) tuple for the given EmailAlert
+    object and date.
+    """
+    place, place_name, place_url, ni_list = newsitems_for_place(alert, start_date)
+    ni_list = filter_schemas(alert, ni_list)
     if not ni_list:
         raise NoNews
-    schemas_used = set([ni.schema for ni in ni_list])
-    populate_attributes_if_needed(ni_list, list(schemas_used))
+    populate_attributes(ni_list)
     text, html = email_text_for_place(alert, place, place_name, place_url, ni_list, start_date, frequency)
     return place_name, text, html
 
-def send_all(frequency):
+def prefetch_users(alerts, chunk_size=1000):
+    """
+    Loads the User of every given EmailAlert, chunk_size at a time, and caches
+    it on the alert, so that alert.user doesn't cause a query per alert.
+    """
+    from ebpub.accounts.models import User
+    user_ids = list(set([alert.user_id for alert in alerts]))
+    users = {}
+    for i in xrange(0, len(user_ids), chunk_size):
+        for user in User.objects.filter(id__in=user_ids[i:i+chunk_size]):
+            users[user.id] = user
+    for alert in alerts:
+        alert._user_cache = users.get(alert.user_id)
+
+class MessageSender(object):
+    """
+    Sends e-mail messages from a queue with num_workers threads, each of which
+    keeps its own SMTP connection open for all of the messages it sends.
+    """
+    def __init__(self, num_workers=4):
+        self.queue = Queue.Queue(num_workers * 10)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failures = [] # (recipients, exception) tuples.
+        self.threads = [threading.Thread(target=self._work) for i in range(num_workers)]
+        for t in self.threads:
+            t.setDaemon(True)
+            t.start()
+
+    def send(self, message):
+        self.queue.put(message)
+
+    def finish(self):
+        "Waits for every queued message to be sent."
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+    def _work(self):
+        conn = SMTPConnection() # Use default settings.
+        try:
+            while True:
+                message = self.queue.get()
+                if message is None:
+                    break
+                try:
+                    # The connection stays open between messages, because
+                    # send_messages() only closes connections it opened.
+                    conn.open()
+                    message.connection = conn
+                    message.send()
+                except Exception, e:
+                    self.lock.acquire()
+                    self.failures.append((message.to, e))
+                    self.lock.release()
+                    try:
+                        conn.close()
+                    except Exception:
+                        conn.connection = None
+                else:
+                    self.lock.acquire()
+                    self.sent += 1
+                    self.lock.release()
+        finally:
+            if conn.connection is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+def send_all(frequency, num_workers=4, verbose=False):
     """
     Sends an e-mail to all subscribers in the system with data with the given frequency.
+
+    Alerts for the same block/radius or location share a single NewsItem
+    query, and the e-mails are sent by num_workers threads with persistent
+    SMTP connections. Returns a dictionary summarizing the run.
     """
-    conn = SMTPConnection() # Use default settings.
-    count = 0
+    start_time = time.time()
     start_date = datetime.date.today() - datetime.timedelta(days=frequency)
-    for alert in EmailAlert.active_objects.filter(frequency=frequency):
-        try:
-            place_name, text_content, html_content = email_for_subscription(alert, start_date, frequency)
-        except NoNews:
-            continue
-        subject = 'Update: %s' % place_name
-        message = EmailMultiAlternatives(subject, text_content, settings.GENERIC_EMAIL_SENDER,
-            [alert.user.email], connection=conn)
-        message.attach_alternative(html_content, 'text/html')
-        message.send()
-        count += 1
+    alerts = list(EmailAlert.active_objects.select_related('block', 'location').filter(frequency=frequency))
+    prefetch_users(alerts)
+    places = {}
+    for alert in alerts:
+        places.setdefault(place_key(alert), []).append(alert)
+
+    sender = MessageSender(num_workers)
+    no_news = no_user = 0
+    try:
+        for place_alerts in places.values():
+            place, place_name, place_url, place_ni_list = newsitems_for_place(place_alerts[0], start_date)
+            if place_ni_list:
+                populate_attributes(place_ni_list)
+            for alert in place_alerts:
+                ni_list = filter_schemas(alert, place_ni_list)
+                if not ni_list:
+                    no_news += 1
+                    continue
+                if alert.user is None:
+                    no_user += 1
+                    continue
+                text_content, html_content = email_text_for_place(alert, place, place_name, place_url, ni_list, start_date, frequency)
+                subject = 'Update: %s' % place_name
+                message = EmailMultiAlternatives(subject, text_content, settings.GENERIC_EMAIL_SENDER,
+                    [alert.user.email])
+                message.attach_alternative(html_content, 'text/html')
+                sender.send(message)
+    finally:
+        sender.finish()
+
+    elapsed = time.time() - start_time
+    summary = {
+        'alerts': len(alerts),
+        'places': len(places),
+        'sent': sender.sent,
+        'failed': len(sender.failures),
+        'no_news': no_news,
+        'no_user': no_user,
+        'seconds': elapsed,
+        'per_second': sender.sent / max(elapsed, 0.001),
+    }
+    if verbose:
+        for recipients, e in sender.failures:
+            print 'Failed to send to %s: %s' % (', '.join(recipients), e)
+        print '%(sent)s e-mails sent (%(per_second).1f/second) in %(seconds).1f seconds for %(alerts)s alerts and %(places)s places. ' \
+              '%(failed)s failed, %(no_news)s had no news, %(no_user)s had no user.' % summary
+    return summary
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    parser = OptionParser(usage='usage: %prog [options] frequency')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=4,
+                      help='number of threads sending e-mail')
+    parser.add_option('-q', '--quiet', action='store_false', dest='verbose', default=True)
+    opts, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('required argument `frequency` (1 for daily, 7 for weekly)')
+    summary = send_all(int(args[0]), opts.workers, opts.verbose)
+    return summary['failed'] and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
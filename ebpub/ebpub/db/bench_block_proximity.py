@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Compares finding the NewsItems near a block through the db_blocknewsitem
+table (settings.BLOCK_PROXIMITY_ENABLED) against the spatial query on a
+search buffer, and measures what maintaining the table costs when NewsItems
+are created.
+
+    python bench_block_proximity.py [options]
+
+Reads: for the blocks with the most NewsItems, at every radius in
+BLOCK_RADIUS_CHOICES, it times counting the NewsItems and fetching the latest
+50, both ways, and checks that both ways find the same NewsItems.
+
+Writes: it inserts NewsItems at random points in the metro, with and without
+the block_newsitem_updater trigger, and rolls them back.
+
+sql/blocknewsitem_functions.sql must be installed, and db_blocknewsitem
+populated with bin/update_block_newsitems.py.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from ebpub.db.models import NewsItem, Schema
+from ebpub.db.views import filter_by_block, BLOCK_RADIUS_CHOICES
+from ebpub.metros.allmetros import get_metro
+from ebpub.streets.models import Block
+from optparse import OptionParser
+import random
+import sys
+import time
+
+def time_reads(block, block_radius, use_table):
+    """
+    Returns (seconds, set of NewsItem IDs) for counting the NewsItems near the
+    block and fetching the latest 50.
+    """
+    old_setting = getattr(settings, 'BLOCK_PROXIMITY_ENABLED', False)
+    settings.BLOCK_PROXIMITY_ENABLED = use_table
+    try:
+        start = time.time()
+        qs = filter_by_block(NewsItem.objects.all(), block, block_radius)
+        qs.count()
+        list(qs.order_by('-item_date', '-id')[:50])
+        elapsed = time.time() - start
+        return elapsed, set(qs.values_list('id', flat=True))
+    finally:
+        settings.BLOCK_PROXIMITY_ENABLED = old_setting
+
+def time_inserts(cursor, num_items, with_trigger, rand_seed=0):
+    "Returns the seconds it took to insert num_items NewsItems."
+    rand = random.Random(rand_seed)
+    schema = Schema.objects.all()[0]
+    x1, y1, x2, y2 = get_metro()['extent']
+    if not with_trigger:
+        cursor.execute("ALTER TABLE db_newsitem DISABLE TRIGGER block_newsitem_updater")
+    try:
+        start = time.time()
+        for i in xrange(num_items):
+            cursor.execute("""
+                INSERT INTO db_newsitem (schema_id, title, description, url, pub_date, item_date, location, location_name)
+                VALUES (%s, 'Benchmark', '', '', NOW(), CURRENT_DATE, SetSRID(MakePoint(%s, %s), 4326), '')""",
+                (schema.id, rand.uniform(x1, x2), rand.uniform(y1, y2)))
+        return time.time() - start
+    finally:
+        transaction.rollback()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options]')
+    p.add_option('-b', '--blocks', dest='num_blocks', type='int', default=10,
+                 help='number of blocks to read')
+    p.add_option('-n', '--inserts', dest='num_inserts', type='int', default=1000,
+                 help='number of NewsItems to insert')
+    opts, args = p.parse_args(argv)
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT block_id
+        FROM db_newsitem
+        WHERE block_id IS NOT NULL
+        GROUP BY 1
+        ORDER BY COUNT(*) DESC
+        LIMIT %s""", (opts.num_blocks,))
+    blocks = [Block.objects.get(id=row[0]) for row in cursor.fetchall()]
+    if not blocks:
+        p.error('no NewsItems have a block')
+
+    print 'Reads (%s blocks)' % len(blocks)
+    print '%8s %14s %14s %10s' % ('radius', 'spatial (s)', 'table (s)', 'mismatches')
+    for block_radius in sorted(BLOCK_RADIUS_CHOICES, key=int):
+        spatial_total = table_total = 0
+        mismatches = 0
+        for block in blocks:
+            spatial_time, spatial_ids = time_reads(block, block_radius, False)
+            table_time, table_ids = time_reads(block, block_radius, True)
+            spatial_total += spatial_time
+            table_total += table_time
+            if spatial_ids != table_ids:
+                mismatches += 1
+        print '%8s %14.4f %14.4f %10s' % (block_radius, spatial_total / len(blocks), table_total / len(blocks), mismatches)
+
+    without_trigger = time_inserts(cursor, opts.num_inserts, False)
+    with_trigger = time_inserts(cursor, opts.num_inserts, True)
+    print
+    print 'Writes (%s NewsItems)' % opts.num_inserts
+    print '    without the trigger: %.2f ms per NewsItem' % (without_trigger * 1000 / opts.num_inserts)
+    print '    with the trigger:    %.2f ms per NewsItem' % (with_trigger * 1000 / opts.num_inserts)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
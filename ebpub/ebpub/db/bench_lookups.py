@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmarks matching many-to-many lookup values with the lookup_id_array()
+GIN indexes (see sql/attribute_functions.sql) against the word-boundary regular
+expressions that were used before, and checks that both return the same rows.
+
+    python bench_lookups.py [schema_slug ...]
+
+For every many-to-many lookup SchemaField (of the given schemas, or of all
+schemas), it times two queries: filtering NewsItems by one Lookup, as
+NewsItemQuerySet.by_attribute() does, and counting NewsItems per Lookup, as
+update_aggregates does.
+"""
+
+from django.db import connection
+from ebpub.db.models import Schema, SchemaField, Lookup
+import sys
+import time
+
+FILTER_SQL = {
+    'regex': "SELECT news_item_id FROM db_attribute WHERE schema_id = %%s AND %s ~ ('[[:<:]]' || %%s || '[[:>:]]') ORDER BY news_item_id",
+    'array': "SELECT news_item_id FROM db_attribute WHERE schema_id = %%s AND lookup_id_array(%s) @> ARRAY[%%s] ORDER BY news_item_id",
+}
+
+COUNT_SQL = {
+    'regex': """
+        SELECT db_lookup.id, (
+            SELECT COUNT(*) FROM db_attribute a
+            WHERE a.schema_id = %%s AND a.%s ~ ('[[:<:]]' || db_lookup.id || '[[:>:]]'))
+        FROM db_lookup
+        WHERE db_lookup.schema_field_id = %%s
+        ORDER BY db_lookup.id""",
+    'array': """
+        SELECT db_lookup.id, (
+            SELECT COUNT(*) FROM db_attribute a
+            WHERE a.schema_id = %%s AND lookup_id_array(a.%s) @> ARRAY[db_lookup.id])
+        FROM db_lookup
+        WHERE db_lookup.schema_field_id = %%s
+        ORDER BY db_lookup.id""",
+}
+
+def time_query(cursor, sql, params):
+    start = time.time()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    return time.time() - start, rows
+
+def bench_field(cursor, sf):
+    """
+    Times both versions of both queries for the given SchemaField. Returns a
+    list of (description, regex seconds, array seconds, whether the results
+    match).
+    """
+    results = []
+    # Filter by the newest Lookup.
+    lookup = Lookup.objects.filter(schema_field=sf).order_by('-id')[:1]
+    if lookup:
+        params = (sf.schema_id, lookup[0].id)
+        regex_time, regex_rows = time_query(cursor, FILTER_SQL['regex'] % sf.real_name, params)
+        array_time, array_rows = time_query(cursor, FILTER_SQL['array'] % sf.real_name, params)
+        results.append(('filter by lookup %s' % lookup[0].id, regex_time, array_time, regex_rows == array_rows))
+    params = (sf.schema_id, sf.id)
+    regex_time, regex_rows = time_query(cursor, COUNT_SQL['regex'] % sf.real_name, params)
+    array_time, array_rows = time_query(cursor, COUNT_SQL['array'] % sf.real_name, params)
+    results.append(('count per lookup', regex_time, array_time, regex_rows == array_rows))
+    return results
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    schemas = Schema.objects.all()
+    if argv:
+        schemas = schemas.filter(slug__in=argv)
+    fields = [sf for sf in SchemaField.objects.filter(schema__in=schemas, is_lookup=True).select_related()
+              if sf.is_many_to_many_lookup()]
+    if not fields:
+        print 'No many-to-many lookup fields found'
+        return 1
+    cursor = connection.cursor()
+    mismatches = 0
+    print '%-40s %-30s %10s %10s' % ('field', 'query', 'regex (s)', 'array (s)')
+    for sf in fields:
+        for description, regex_time, array_time, same in bench_field(cursor, sf):
+            print '%-40s %-30s %10.4f %10.4f%s' % ('%s.%s' % (sf.schema.slug, sf.name), description, regex_time, array_time, not same and ' MISMATCH' or '')
+            if not same:
+                mismatches += 1
+    return mismatches and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
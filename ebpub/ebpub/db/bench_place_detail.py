@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Benchmarks the NewsItem queries of place_detail for a block, comparing the
+windowed queries of latest_newsitems_by_schema() and latest_newsitems_by_day()
+against the previous approach, and prints EXPLAIN ANALYZE output for the
+windowed queries.
+
+    python bench_place_detail.py [options] [block_id]
+
+Without a block_id, it uses the block with the most NewsItems -- typically a
+dense downtown block.
+
+The previous approach was:
+
+    * Overview: the latest 300 NewsItems of any schema, then one query per
+      schema that didn't have number_in_overview NewsItems among them.
+    * Detail: the latest NUM_NEWS_ITEMS_PLACE_DETAIL NewsItems, passed to
+      smart_bunches(), which drops the oldest day because it may be
+      incomplete -- so a day with more NewsItems than that is never shown.
+"""
+
+from django.conf import settings
+from django.db import connection
+from ebpub.db import constants
+from ebpub.db.models import NewsItem, Schema
+from ebpub.db.utils import smart_bunches, today
+from ebpub.db.views import latest_newsitems_by_schema, latest_newsitems_by_day, make_search_buffer, BLOCK_RADIUS_DEFAULT
+from ebpub.streets.models import Block
+from optparse import OptionParser
+import datetime
+import sys
+import time
+
+def timed(func, *args):
+    """
+    Calls func(*args). Returns its result, the number of seconds it took and
+    the number of queries it ran.
+    """
+    settings.DEBUG = True
+    connection.queries = []
+    try:
+        start = time.time()
+        result = func(*args)
+        return result, time.time() - start, len(connection.queries)
+    finally:
+        connection.queries = []
+        settings.DEBUG = False
+
+def old_overview(newsitem_qs, schemas):
+    result = dict([(s.id, []) for s in schemas])
+    needed = dict([(s.id, s.number_in_overview) for s in schemas])
+    for ni in newsitem_qs.order_by('-item_date', '-id')[:300]:
+        if ni.schema_id in needed:
+            result[ni.schema_id].append(ni)
+            if len(result[ni.schema_id]) == needed[ni.schema_id]:
+                del needed[ni.schema_id]
+    for s in schemas:
+        if s.id in needed:
+            result[s.id] = list(newsitem_qs.filter(schema__id=s.id).order_by('-item_date', '-id')[:s.number_in_overview])
+    return result
+
+def new_overview(newsitem_qs, schemas):
+    result = dict([(s.id, []) for s in schemas])
+    for ni in latest_newsitems_by_schema(newsitem_qs, schemas):
+        result[ni.schema_id].append(ni)
+    return result
+
+def old_detail(newsitem_qs):
+    ni_list = newsitem_qs.select_related().extra(
+        select={'pub_date_date': 'date(db_newsitem.pub_date)'},
+        order_by=('-pub_date_date', '-schema__importance', 'schema')
+    )[:constants.NUM_NEWS_ITEMS_PLACE_DETAIL]
+    return smart_bunches(list(ni_list), max_days=5, max_items_per_day=100)
+
+def new_detail(newsitem_qs):
+    return list(latest_newsitems_by_day(newsitem_qs, max_days=5, max_items_per_day=100))
+
+def explain(qs):
+    sql, params = qs.query.as_sql()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+    return '\n'.join([row[0] for row in cursor.fetchall()])
+
+def day_counts(ni_list):
+    counts = {}
+    for ni in ni_list:
+        counts[ni.pub_date_date] = counts.get(ni.pub_date_date, 0) + 1
+    return ', '.join(['%s: %s' % (d, counts[d]) for d in sorted(counts, reverse=True)]) or 'none'
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] [block_id]')
+    p.add_option('-r', '--radius', dest='radius', default=BLOCK_RADIUS_DEFAULT,
+                 help='block radius, as on the block pages')
+    p.add_option('-q', '--quiet', action='store_true', dest='quiet', default=False,
+                 help="don't print the query plans")
+    opts, args = p.parse_args(argv)
+    if args:
+        block = Block.objects.get(id=int(args[0]))
+    else:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT block_id
+            FROM db_newsitem
+            WHERE block_id IS NOT NULL
+            GROUP BY 1
+            ORDER BY COUNT(*) DESC
+            LIMIT 1""")
+        row = cursor.fetchone()
+        if row is None:
+            p.error('no NewsItems have a block')
+        block = Block.objects.get(id=row[0])
+    search_buf = make_search_buffer(block.location.centroid, opts.radius)
+    newsitem_qs = NewsItem.objects.filter(location__bboverlaps=search_buf)
+    print '%s (block %s), radius %s: %s NewsItems' % (block, block.id, opts.radius, newsitem_qs.count())
+
+    schemas = list(Schema.public_objects.filter(is_special_report=False))
+    old, old_time, old_queries = timed(old_overview, newsitem_qs, schemas)
+    new, new_time, new_queries = timed(new_overview, newsitem_qs, schemas)
+    same = [[ni.id for ni in old[s.id]] for s in schemas] == [[ni.id for ni in new[s.id]] for s in schemas]
+    print
+    print 'Overview (%s schemas)' % len(schemas)
+    print '    before: %.4f seconds, %s queries' % (old_time, old_queries)
+    print '    after:  %.4f seconds, %s queries' % (new_time, new_queries)
+    print '    %s' % (same and 'same NewsItems' or 'MISMATCH')
+    if not opts.quiet:
+        print
+        print explain(latest_newsitems_by_schema(newsitem_qs, schemas))
+
+    end_date = today()
+    start_date = end_date - datetime.timedelta(days=constants.LOCATION_DAY_OPTIMIZATION)
+    detail_qs = newsitem_qs.filter(pub_date__gt=start_date-datetime.timedelta(days=1), pub_date__lt=end_date+datetime.timedelta(days=1), schema__is_public=True)
+    old, old_time, old_queries = timed(old_detail, detail_qs)
+    new, new_time, new_queries = timed(new_detail, detail_qs)
+    print
+    print 'Detail (%s to %s)' % (start_date, end_date)
+    print '    before: %.4f seconds, %s queries, %s NewsItems by day: %s' % (old_time, old_queries, len(old), day_counts(old))
+    print '    after:  %.4f seconds, %s queries, %s NewsItems by day: %s' % (new_time, new_queries, len(new), day_counts(new))
+    if not opts.quiet:
+        print
+        print explain(latest_newsitems_by_day(detail_qs, max_days=5, max_items_per_day=100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Measures the latency of full-text search through search_vector and its GIN
+index (see sql/newsitem.sql) against ILIKE substring matching on title and
+description, on a temporary table of synthetic NewsItems.
+
+    python bench_search.py [num_rows]
+
+num_rows defaults to 2,000,000. The table is a temporary copy of the search
+columns of db_newsitem, so db_newsitem itself isn't touched, but the
+newsitem_search_vector() function in sql/newsitem_functions.sql must be
+installed. Words are drawn from a synthetic vocabulary with a long-tailed
+distribution, so the queries below range from very common to rare terms.
+
+Note that the two versions don't have the same semantics -- ILIKE matches
+substrings, full-text search matches stemmed words -- so their result counts
+differ.
+"""
+
+from cStringIO import StringIO
+from django.db import connection, transaction
+import datetime
+import random
+import sys
+import time
+
+NUM_SCHEMAS = 10
+NUM_DAYS = 365 * 3
+VOCABULARY_SIZE = 50000
+CHUNK_SIZE = 50000
+REPEAT = 3
+
+def word(rank):
+    "Returns the synthetic word with the given frequency rank."
+    letters = []
+    rank += 26 * 26 # At least three letters.
+    while rank:
+        rank, i = divmod(rank, 26)
+        letters.append(chr(ord('a') + i))
+    return ''.join(letters)
+
+def random_text(rand, num_words):
+    return ' '.join([word(int(rand.paretovariate(0.7)) % VOCABULARY_SIZE) for _ in xrange(num_words)])
+
+def create_table(cursor, num_rows, rand_seed=0):
+    rand = random.Random(rand_seed)
+    cursor.execute("""
+        CREATE TEMPORARY TABLE bench_newsitem (
+            id integer NOT NULL,
+            schema_id integer NOT NULL,
+            item_date date NOT NULL,
+            title varchar(255) NOT NULL,
+            description text NOT NULL,
+            search_vector tsvector
+        )""")
+    first_date = datetime.date.today() - datetime.timedelta(days=NUM_DAYS)
+    for first_id in xrange(0, num_rows, CHUNK_SIZE):
+        rows = StringIO()
+        for i in xrange(first_id, min(first_id + CHUNK_SIZE, num_rows)):
+            rows.write('%s\t%s\t%s\t%s\t%s\n' % (i, i % NUM_SCHEMAS,
+                first_date + datetime.timedelta(days=rand.randrange(NUM_DAYS)),
+                random_text(rand, 8), random_text(rand, 40)))
+        rows.seek(0)
+        cursor.copy_from(rows, 'bench_newsitem', columns=('id', 'schema_id', 'item_date', 'title', 'description'))
+    cursor.execute("UPDATE bench_newsitem SET search_vector = newsitem_search_vector(title, description)")
+    cursor.execute("CREATE INDEX bench_newsitem_search_vector ON bench_newsitem USING GIN (search_vector)")
+    cursor.execute("CREATE INDEX bench_newsitem_item_date ON bench_newsitem (item_date)")
+    cursor.execute("ANALYZE bench_newsitem")
+
+def time_query(cursor, sql, params):
+    "Returns (best time in seconds, number of rows) for the query."
+    times = []
+    for _ in range(REPEAT):
+        start = time.time()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        times.append(time.time() - start)
+    return min(times), len(rows)
+
+def queries():
+    """
+    Yields (description, ILIKE SQL, full-text SQL, ILIKE params, full-text
+    params) for each query. Like the views, each query fetches a page of 50
+    results.
+    """
+    ilike = """
+        SELECT id FROM bench_newsitem
+        WHERE (title ILIKE '%%%%' || %%s || '%%%%' OR description ILIKE '%%%%' || %%s || '%%%%')%s
+        ORDER BY item_date DESC LIMIT 50"""
+    fts = """
+        SELECT id FROM bench_newsitem
+        WHERE search_vector @@ plainto_tsquery('pg_catalog.english', %%s)%s
+        ORDER BY ts_rank_cd(search_vector, plainto_tsquery('pg_catalog.english', %%s)) DESC, item_date DESC LIMIT 50"""
+    restrict = " AND schema_id = %s AND item_date >= %s"
+    since = datetime.date.today() - datetime.timedelta(days=90)
+    for rank in (1, 100, 5000):
+        term = word(rank)
+        yield ('word of rank %s' % rank, ilike % '', fts % '', (term, term), (term, term))
+        yield ('word of rank %s, 1 schema, 90 days' % rank, ilike % restrict, fts % restrict,
+            (term, term, 1, since), (term, 1, since, term))
+    terms = '%s %s' % (word(10), word(1000))
+    yield ('two words', ilike % '', fts % '', (terms, terms), (terms, terms))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    num_rows = argv and int(argv[0]) or 2000000
+    cursor = connection.cursor()
+    start = time.time()
+    create_table(cursor, num_rows)
+    print 'Created %s synthetic NewsItems in %.1f seconds' % (num_rows, time.time() - start)
+    print '%-40s %16s %16s' % ('query', 'ILIKE (s/rows)', 'tsvector (s/rows)')
+    for description, ilike_sql, fts_sql, ilike_params, fts_params in queries():
+        ilike_time, ilike_rows = time_query(cursor, ilike_sql, ilike_params)
+        fts_time, fts_rows = time_query(cursor, fts_sql, fts_params)
+        print '%-40s %10.4f / %3d %10.4f / %3d' % (description, ilike_time, ilike_rows, fts_time, fts_rows)
+    transaction.rollback()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,10 @@
 
 import sys
 from optparse import OptionParser
-from django.db import connection
 from django.contrib.gis.geos import fromstr
 from ebpub.db.bin.alphabetize_locations import alphabetize_locations
-from ebpub.db.models import Location, LocationType, NewsItem
+from ebpub.db.bin.populate_newsitemlocations import populate_ni_loc
+from ebpub.db.models import Location, LocationType
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.text import slugify
 from ebpub.metros.allmetros import get_metro
@@ -28,23 +28,7 @@ def swallow_out(f, start_msg=None, end_msg=None):
             sys.stdout.flush()
     return wrapped
 
-def populate_ni_loc(location):
-    ni_count = NewsItem.objects.count()
-    cursor = connection.cursor()
-    i = 0
-    while i < ni_count:
-        print i
-        cursor.execute("""
-            INSERT INTO db_newsitemlocation (news_item_id, location_id)
-            SELECT ni.id, loc.id FROM db_newsitem ni, db_location loc
-            WHERE intersects(loc.location, ni.location)
-                AND ni.id >= %s AND ni.id < %s
-                AND loc.id = %s """, (i, i+200, location.id))
-        connection._commit()
-        i += 200
-
 alphabetize_locations = swallow_out(alphabetize_locations, 'Re-alphabetizing locations ...', ' done.\n')
-populate_ni_loc = swallow_out(populate_ni_loc, 'Populating newsitemlocations ...', ' done.\n')
 
 def add_location(name, wkt, loc_type, source='UNKNOWN'):
     geom = fromstr(wkt, srid=4326)
@@ -86,7 +70,10 @@ def main(argv=None):
     location = add_location(args[0], args[1], loc_type, opts.source)
 
     alphabetize_locations(opts.loc_type_slug)
-    populate_ni_loc(location)
+    sys.stdout.write('Populating newsitemlocations ...')
+    sys.stdout.flush()
+    total, seconds = populate_ni_loc(location)
+    print ' done: %s rows in %.1f seconds (%.0f rows/second).' % (total, seconds, total / max(seconds, 0.001))
 
 if __name__ == '__main__':
     sys.exit(main())
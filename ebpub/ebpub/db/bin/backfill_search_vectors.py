@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Fills in db_newsitem.search_vector, the full-text search column used by
+NewsItemQuerySet.search(), for existing NewsItems.
+
+New and edited NewsItems get their search_vector from the trigger in
+sql/newsitem_functions.sql, so this only needs to be run once, after
+installing that trigger -- or with --all, after changing
+newsitem_search_vector().
+
+NewsItems are updated in batches of consecutive IDs, each in its own
+transaction, so that the table isn't locked for the whole run and an
+interrupted run can simply be restarted.
+"""
+
+from django.db import connection, transaction
+from optparse import OptionParser
+import sys
+import time
+
+def backfill_search_vectors(batch_size=10000, recompute_all=False, verbose=False):
+    """
+    Sets search_vector for every NewsItem that doesn't have one (or for every
+    NewsItem, if recompute_all is True). Returns the number of NewsItems
+    updated.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id) FROM db_newsitem")
+    min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return 0
+    sql = """
+        UPDATE db_newsitem
+        SET search_vector = newsitem_search_vector(title, description)
+        WHERE id BETWEEN %s AND %s"""
+    if not recompute_all:
+        sql += " AND search_vector IS NULL"
+    total = 0
+    start = time.time()
+    for first_id in xrange(min_id, max_id + 1, batch_size):
+        cursor.execute(sql, (first_id, first_id + batch_size - 1))
+        total += cursor.rowcount
+        transaction.commit_unless_managed()
+        if verbose:
+            print 'Updated %s NewsItems up to ID %s (%.1f seconds)' % (total, min(first_id + batch_size - 1, max_id), time.time() - start)
+    return total
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options]')
+    p.add_option('-b', '--batch-size', dest='batch_size', type='int', default=10000,
+                 help='number of NewsItem IDs to update per transaction')
+    p.add_option('-a', '--all', action='store_true', dest='recompute_all', default=False,
+                 help='recompute search_vector for all NewsItems, not just those without one')
+    p.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False)
+    opts, args = p.parse_args(argv)
+    total = backfill_search_vectors(opts.batch_size, opts.recompute_all, opts.verbose)
+    print 'Updated %s NewsItems' % total
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
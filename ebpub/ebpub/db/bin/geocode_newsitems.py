@@ -1,65 +1,178 @@
+#!/usr/bin/env python
+"""
+Geocodes the NewsItems that don't have a location.
+
+    geocode_newsitems.py [options] [schema_slug]
+
+NewsItems with the same (normalized) location_name are geocoded once. The
+names are split into chunks, which a pool of worker processes geocodes with
+Geocoder.geocode_many() -- looking each chunk up in the geocoder cache in
+bulk and adding the new results to it -- and the locations are written back
+with bulk UPDATEs.
+
+The summary reports how many names were found in the geocoder cache, how
+many had to be geocoded and how many couldn't be, and why.
+"""
+
+from django.db import connection, transaction
 from ebpub.db.models import NewsItem
 from ebpub.geocoder import SmartGeocoder, GeocodingException, AmbiguousResult, InvalidBlockButValidStreet
-from ebpub.geocoder.parser.parsing import ParsingError
+from ebpub.geocoder.parser.parsing import normalize, ParsingError
+from optparse import OptionParser
+import multiprocessing
+import sys
+import time
+
+CHUNK_SIZE = 1000
+
+# The number of location names that a worker geocodes at a time.
+GEOCODE_CHUNK_SIZE = 100
+
+# Outcomes of geocoding a location name, in the order they're reported.
+# 'cache_hit' and 'geocoded' names both get a location; only 'geocoded' ones
+# missed the geocoder cache.
+STATUSES = (
+    ('cache_hit', 'Cache hits'),
+    ('geocoded', 'Geocoded'),
+    ('not_found', 'Not found'),
+    ('ambiguous', 'Ambiguous'),
+    ('parse_error', 'Parse errors'),
+    ('invalid_block', 'Invalid blocks'),
+)
+
+def chunks(seq, size=CHUNK_SIZE):
+    for i in xrange(0, len(seq), size):
+        yield seq[i:i+size]
+
+_geocoder = None
+
+def geocode_names(names):
+    """
+    Geocodes a list of normalized location names. Returns a list of (name,
+    status, WKT point, block ID) tuples, where the point and block ID are
+    None unless status is 'cache_hit' or 'geocoded'. This runs in the worker
+    processes.
+    """
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = SmartGeocoder()
+    result = []
+    for name, add in zip(names, _geocoder.geocode_many(names)):
+        if isinstance(add, InvalidBlockButValidStreet):
+            result.append((name, 'invalid_block', None, None))
+        elif isinstance(add, AmbiguousResult):
+            result.append((name, 'ambiguous', None, None))
+        elif isinstance(add, ParsingError):
+            result.append((name, 'parse_error', None, None))
+        elif isinstance(add, GeocodingException):
+            result.append((name, 'not_found', None, None))
+        else:
+            block_id = None
+            if add['block'] is not None:
+                block_id = add['block'].id
+            if getattr(add, '_cache_hit', False):
+                status = 'cache_hit'
+            else:
+                status = 'geocoded'
+            result.append((name, status, add['point'].wkt, block_id))
+    return result
+
+def update_locations(rows):
+    """
+    Sets the location and block of NewsItems, given a list of
+    (NewsItem ID, WKT point, block ID) tuples.
+    """
+    cursor = connection.cursor()
+    for chunk in chunks(rows):
+        cursor.execute("""
+            UPDATE db_newsitem
+            SET location = GeomFromText(v.wkt, 4326), block_id = v.block_id::integer
+            FROM (VALUES %s) AS v(id, wkt, block_id)
+            WHERE db_newsitem.id = v.id""" % ','.join(['(%s, %s, %s)' for _ in chunk]),
+            [value for row in chunk for value in row])
+        transaction.commit_unless_managed()
 
-def geocode(schema=None):
+def geocode(schema=None, num_workers=4, verbose=False):
     """
-    Geocode NewsItems with null locations.
+    Geocodes NewsItems with null locations.
 
     If ``schema`` is provided, only geocode NewsItems with that particular
-    schema slug.
+    schema slug. Returns a dictionary of counts of location names by status
+    (see STATUSES), plus 'names', 'newsitems', 'updated' and 'seconds'.
     """
-    geocoder = SmartGeocoder()
-    qs = NewsItem.objects.filter(location__isnull=True).order_by('-id')
+    start = time.time()
+    qs = NewsItem.objects.filter(location__isnull=True)
     if schema is not None:
-        print "Geocoding %s..." % schema
         qs = qs.filter(schema__slug=schema)
-    else:
-        print "Geocoding all ungeocoded newsitems..."
 
-    geocoded_count = 0
-    not_found_count = 0
-    ambiguous_count = 0
-    parsing_error_count = 0
-    invalid_block_count = 0
+    # Map each normalized location name to the IDs of its NewsItems.
+    ids_by_name = {}
+    num_newsitems = 0
+    for ni_id, location_name in qs.values_list('id', 'location_name').iterator():
+        ids_by_name.setdefault(normalize(location_name), []).append(ni_id)
+        num_newsitems += 1
+    summary = dict([(status, 0) for status, label in STATUSES])
 
-    for ni in qs.iterator():
-        loc_name = ni.location_name
+    # Geocode the names in worker processes. Each worker opens its own
+    # database connection, so this process's connection mustn't be shared
+    # with them.
+    located = {}
+    if ids_by_name:
+        connection.close()
+        pool = multiprocessing.Pool(num_workers)
         try:
-            add = geocoder.geocode(loc_name)
-        except InvalidBlockButValidStreet:
-            print '      invalid block but valid street: %s' % loc_name
-            invalid_block_count += 1
-        except AmbiguousResult, e:
-            print '      ambiguous: %s' % loc_name
-            ambiguous_count += 1
-        except GeocodingException, e:
-            print '      not found: %s' % loc_name
-            not_found_count += 1
-        except ParsingError:
-            print '      parse error: %s' % loc_name
-            parsing_error_count += 1
-        except:
-            raise
-        else:
-            ni.location = add['point']
-            ni.block = add['block']
-            ni.save()
-            print '%s (%s)' % (loc_name, ni.item_url())
-            geocoded_count += 1
+            for results in pool.imap_unordered(geocode_names, list(chunks(ids_by_name.keys(), GEOCODE_CHUNK_SIZE))):
+                for name, status, wkt, block_id in results:
+                    summary[status] += 1
+                    if wkt is not None:
+                        located[name] = (wkt, block_id)
+                    elif verbose:
+                        print '      %s: %s' % (status.replace('_', ' '), name)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows = []
+    for name, (wkt, block_id) in located.items():
+        rows.extend([(ni_id, wkt, block_id) for ni_id in ids_by_name[name]])
+    update_locations(rows)
 
+    summary.update({
+        'names': len(ids_by_name),
+        'newsitems': num_newsitems,
+        'updated': len(rows),
+        'seconds': time.time() - start,
+    })
+    return summary
+
+def print_summary(summary):
+    names = summary['names'] or 1
     print "------------------------------------------------------------------"
-    print "Geocoded:       %s" % geocoded_count
-    print "Not found:      %s" % not_found_count
-    print "Ambiguous:      %s" % ambiguous_count
-    print "Parse errors:   %s" % parsing_error_count
-    print "Invalid blocks: %s" % invalid_block_count
+    print "Location names: %s (for %s NewsItems)" % (summary['names'], summary['newsitems'])
+    for status, label in STATUSES:
+        print "%-16s%s (%.1f%%)" % (label + ':', summary[status], summary[status] * 100.0 / names)
+    print "Updated:        %s NewsItems" % summary['updated']
+    seconds = max(summary['seconds'], 0.001)
+    print "Time:           %.1f seconds (%.1f names/second, %.1f NewsItems/second)" % (seconds, summary['names'] / seconds, summary['newsitems'] / seconds)
 
-if __name__ == "__main__":
-    import sys
-    try:
-        schema_slug = sys.argv[1]
-    except IndexError:
-        geocode()
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] [schema_slug]')
+    p.add_option('-w', '--workers', dest='num_workers', type='int', default=4,
+                 help='number of geocoding processes')
+    p.add_option('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                 help='print the location names that could not be geocoded')
+    opts, args = p.parse_args(argv)
+    if len(args) > 1:
+        p.error('at most one schema may be given')
+    schema = args and args[0] or None
+    if schema is not None:
+        print "Geocoding %s..." % schema
     else:
-        geocode(schema_slug)
+        print "Geocoding all ungeocoded newsitems..."
+    print_summary(geocode(schema, opts.num_workers, opts.verbose))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
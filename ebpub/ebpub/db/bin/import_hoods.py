@@ -3,27 +3,12 @@ import sys
 import datetime
 from optparse import OptionParser
 from django.contrib.gis.gdal import DataSource
-from django.db import connection
-from ebpub.db.models import Location, LocationType, NewsItem
+from ebpub.db.bin.populate_newsitemlocations import populate_ni_loc
+from ebpub.db.models import Location, LocationType
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.text import slugify
 from ebpub.metros.allmetros import get_metro
 
-def populate_ni_loc(location):
-    ni_count = NewsItem.objects.count()
-    cursor = connection.cursor()
-    i = 0
-    while i < ni_count:
-        cursor.execute("""
-            INSERT INTO db_newsitemlocation (news_item_id, location_id)
-            SELECT ni.id, loc.id FROM db_newsitem ni, db_location loc
-            WHERE st_intersects(loc.location, ni.location)
-                AND ni.id >= %s AND ni.id < %s
-                AND loc.id = %s
-        """, (i, i+200, location.id))
-        connection._commit()
-        i += 200
-
 class NeighborhoodImporter(object):
     def __init__(self, layer):
         self.layer = layer
@@ -88,9 +73,9 @@ class NeighborhoodImporter(object):
                 print >> sys.stderr, '%s neighborhood %s' % (created and 'Created' or 'Already had', hood)
             if verbose:
                 sys.stderr.write('Populating newsitem locations ... ')
-            populate_ni_loc(hood)
+            total, seconds = populate_ni_loc(hood)
             if verbose:
-                sys.stderr.write('done.\n')
+                sys.stderr.write('done: %s rows in %.1f seconds (%.0f rows/second).\n' % (total, seconds, total / max(seconds, 0.001)))
         return num_created
 
 usage = 'usage: %prog [options] /path/to/shapefile'
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Populates db_newsitemlocation for a Location -- that is, finds the existing
+NewsItems within a new (or changed) Location. NewsItems created later are
+handled by the location_updater trigger in sql/newsitemlocation_functions.sql.
+
+    populate_newsitemlocations.py [options] location_type_slug location_slug
+
+Each run is a spatial join between the Location and db_newsitem that uses
+the GiST index on db_newsitem.location, optionally split into one statement
+(and one transaction) per schema or per month of item_date. NewsItems that
+are already linked to the Location are skipped, so it's safe to run again.
+
+When a run over all of the NewsItems -- not restricted to schemas or dates --
+finishes, the highest NewsItem id at its start is saved as the Location's
+NewsItemLocationWatermark. An incremental run only considers NewsItems above
+the watermark, or all of them if there isn't one. Don't use it after changing
+a Location's geometry, since the older NewsItems have to be checked again.
+"""
+
+from django.db import connection, transaction
+from ebpub.db.models import Location, NewsItemLocationWatermark
+from optparse import OptionParser
+import sys
+import time
+
+PARTITIONS = ('schema', 'month')
+
+def populate_ni_loc(location, partition=None, schema_ids=None, start_date=None, end_date=None, incremental=False, verbose=False):
+    """
+    Links the given Location to every NewsItem whose location intersects it.
+
+    partition is None (a single statement), 'schema' or 'month'. schema_ids,
+    start_date and end_date restrict the NewsItems to those schemas and
+    item_dates. If incremental is True, only NewsItems above the Location's
+    NewsItemLocationWatermark are considered. The watermark is saved at the
+    end of every run that isn't restricted to schemas or dates.
+
+    Returns (number of rows inserted, seconds taken).
+    """
+    if partition is not None and partition not in PARTITIONS:
+        raise ValueError('partition must be None or one of %r' % (PARTITIONS,))
+    cursor = connection.cursor()
+    # NewsItems created after this are linked by the location_updater trigger.
+    cursor.execute("SELECT MAX(id) FROM db_newsitem")
+    max_id = cursor.fetchone()[0]
+    where, params = [], []
+    if incremental:
+        try:
+            watermark = NewsItemLocationWatermark.objects.get(location__id=location.id)
+        except NewsItemLocationWatermark.DoesNotExist:
+            pass
+        else:
+            where.append('ni.id > %s')
+            params.append(watermark.last_news_item_id)
+    if schema_ids:
+        where.append('ni.schema_id IN (%s)' % ','.join(['%s' for _ in schema_ids]))
+        params.extend(schema_ids)
+    if start_date is not None:
+        where.append('ni.item_date >= %s')
+        params.append(start_date)
+    if end_date is not None:
+        where.append('ni.item_date <= %s')
+        params.append(end_date)
+
+    if partition is None:
+        partitions = [([], [])]
+    else:
+        if partition == 'schema':
+            column = 'ni.schema_id'
+        else:
+            column = "date_trunc('month', ni.item_date)"
+        cursor.execute("""
+            SELECT DISTINCT %s
+            FROM db_newsitem ni, db_location loc
+            WHERE loc.id = %%s
+                AND ni.location && loc.location
+                %s""" % (column, ''.join([' AND %s' % w for w in where])), [location.id] + params)
+        partitions = [(['%s = %%s' % column], [row[0]]) for row in cursor.fetchall()]
+
+    total = 0
+    start = time.time()
+    for partition_where, partition_params in partitions:
+        cursor.execute("""
+            INSERT INTO db_newsitemlocation (news_item_id, location_id)
+            SELECT ni.id, loc.id
+            FROM db_newsitem ni, db_location loc
+            WHERE loc.id = %%s
+                AND ni.location && loc.location
+                AND ST_Intersects(loc.location, ni.location)
+                AND NOT EXISTS (
+                    SELECT 1 FROM db_newsitemlocation nl
+                    WHERE nl.news_item_id = ni.id AND nl.location_id = loc.id
+                )
+                %s""" % ''.join([' AND %s' % w for w in where + partition_where]),
+            [location.id] + params + partition_params)
+        total += cursor.rowcount
+        transaction.commit_unless_managed()
+        if verbose and partition is not None:
+            print '%s %s: %s rows' % (partition, partition_params[0], cursor.rowcount)
+    if max_id is not None and not (schema_ids or start_date or end_date):
+        save_watermark(location, max_id)
+        transaction.commit_unless_managed()
+    return total, time.time() - start
+
+def save_watermark(location, last_news_item_id):
+    try:
+        watermark = NewsItemLocationWatermark.objects.get(location__id=location.id)
+    except NewsItemLocationWatermark.DoesNotExist:
+        watermark = NewsItemLocationWatermark(location_id=location.id)
+    watermark.last_news_item_id = last_news_item_id
+    watermark.save()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] location_type_slug location_slug')
+    p.add_option('-p', '--partition', dest='partition', choices=PARTITIONS, default=None,
+                 help='run one statement per schema or per month (%s)' % ', '.join(PARTITIONS))
+    p.add_option('-s', '--schema', dest='schema_ids', action='append', type='int', default=[],
+                 help='only NewsItems of this schema ID (may be given more than once)')
+    p.add_option('--start-date', dest='start_date', default=None,
+                 help='only NewsItems with this item_date (YYYY-MM-DD) or later')
+    p.add_option('--end-date', dest='end_date', default=None,
+                 help='only NewsItems with this item_date (YYYY-MM-DD) or earlier')
+    p.add_option('-i', '--incremental', dest='incremental', action='store_true', default=False,
+                 help='only NewsItems newer than the last complete run for the location')
+    p.add_option('-v', '--verbose', dest='verbose', action='store_true', default=False)
+    opts, args = p.parse_args(argv)
+    if len(args) != 2:
+        p.error('required arguments `location_type_slug`, `location_slug`')
+    try:
+        location = Location.objects.get(location_type__slug=args[0], slug=args[1])
+    except Location.DoesNotExist:
+        p.error('unknown location')
+    total, seconds = populate_ni_loc(location, opts.partition, opts.schema_ids, opts.start_date,
+                                     opts.end_date, opts.incremental, opts.verbose)
+    print 'Inserted %s rows in %.1f seconds (%.0f rows/second)' % (total, seconds, total / max(seconds, 0.001))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Recomputes the cached homepage fragments (see homepage() in ebpub/db/views.py)
+so that requests don't have to.
+
+Run it from cron shortly after the scrapers and update_aggregates, which start
+a new version of the fragments when they finish, and at the start of each day.
+
+This only helps if CACHE_BACKEND is shared between processes, such as
+memcached. With Django's default, per-process locmem:// backend, the fragments
+aren't cached at all, and this exits with an error.
+"""
+
+from ebpub.db.views import refresh_homepage
+from ebpub.utils.cache import cache_is_shared
+import sys
+import time
+
+def main(argv=None):
+    if not cache_is_shared():
+        print >> sys.stderr, 'CACHE_BACKEND is not shared between processes, so the homepage is not cached'
+        return 1
+    start = time.time()
+    refresh_homepage()
+    print 'Refreshed the homepage in %.2f seconds' % (time.time() - start)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 from django.db import connection, transaction
 from ebpub.db import constants
-from ebpub.db.models import Schema, SchemaField, NewsItem, AggregateAll, AggregateDay, AggregateLocationDay, AggregateLocation, AggregateFieldLookup
-from ebpub.db.utils import today
+from ebpub.db.models import Schema, SchemaField, NewsItem, NewsItemChange, AggregateWatermark
+from ebpub.db.models import AggregateAll, AggregateDay, AggregateLocationDay, AggregateLocation, AggregateFieldLookup
+from ebpub.db.utils import today, invalidate_homepage
+from optparse import OptionParser
 import datetime
+import sys
 
 def smart_update(cursor, new_values, table_name, field_names, comparable_fields, where, pk_name='id', dry_run=False):
     # new_values is a list of dictionaries, each with a value for each field in field_names.
@@ -41,6 +44,130 @@ def smart_update(cursor, new_values, table_name, field_names, comparable_fields,
         if not dry_run:
             cursor.execute("DELETE FROM %s WHERE %s = %%s" % (table_name, pk_name), (old_value[pk_name],))
 
+def execute(cursor, sql, params, dry_run=False):
+    # Like smart_update(), prints every statement that changes data.
+    print sql.strip() % tuple([repr(p) for p in params])
+    if not dry_run:
+        cursor.execute(sql, params)
+
+def get_schema_id(schema_id_or_slug):
+    if not str(schema_id_or_slug).isdigit():
+        return Schema.objects.get(slug=schema_id_or_slug).id
+    return schema_id_or_slug
+
+def take_changes(cursor, schema_id, dry_run=False):
+    """
+    Removes the logged NewsItemChanges for the given schema and returns a
+    tuple of (set of changed item_dates, id of the last change). The id is
+    None if there were no changes.
+
+    A single DELETE ... RETURNING is used, so that changes committed by other
+    transactions while this runs are either returned or left for the next
+    run -- never lost. If dry_run is True, the changes aren't removed.
+    """
+    if dry_run:
+        sql = "SELECT id, item_date FROM %s WHERE schema_id = %%s"
+    else:
+        sql = "DELETE FROM %s WHERE schema_id = %%s RETURNING id, item_date"
+    cursor.execute(sql % NewsItemChange._meta.db_table, (schema_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return set(), None
+    return set([row[1] for row in rows]), max([row[0] for row in rows])
+
+# The triggers in sql/newsitemchange_functions.sql that log NewsItemChanges.
+CHANGE_TRIGGERS = (
+    ('db_newsitem', 'newsitem_change_logger'),
+    ('db_newsitemlocation', 'newsitemlocation_change_logger'),
+)
+
+def change_triggers_installed(cursor):
+    """
+    Returns True if all of CHANGE_TRIGGERS are installed. Without them, no
+    NewsItemChanges are logged, and incremental updates would silently
+    leave the aggregates stale.
+    """
+    for table_name, trigger_name in CHANGE_TRIGGERS:
+        cursor.execute("""
+            SELECT 1
+            FROM pg_trigger t, pg_class c
+            WHERE t.tgrelid = c.oid
+                AND c.relname = %s
+                AND t.tgname = %s""", (table_name, trigger_name))
+        if cursor.fetchone() is None:
+            return False
+    return True
+
+def save_watermark(schema_id, last_change_id, dry_run=False):
+    if dry_run:
+        return
+    try:
+        watermark = AggregateWatermark.objects.get(schema__id=schema_id)
+    except AggregateWatermark.DoesNotExist:
+        watermark = AggregateWatermark(schema_id=schema_id, last_change_id=0)
+    if last_change_id is not None:
+        watermark.last_change_id = last_change_id
+    watermark.save()
+
+def aggregate_location_range(cursor, schema_id):
+    """
+    Returns the (start_date, end_date) over which AggregateLocation totals
+    are summed, or None if the schema has no AggregateLocationDay records.
+
+    Note that we calculate the total for the last 30 days that had at least
+    one news item -- *NOT* the last 30 days, period.
+    We add date_part <= current_date here to keep sparse items in the future
+    from throwing off counts for the previous 30 days.
+    """
+    cursor.execute("SELECT date_part FROM %s WHERE schema_id = %%s AND date_part <= current_date ORDER BY date_part DESC LIMIT 1" % \
+        AggregateLocationDay._meta.db_table, (schema_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    end_date = row[0]
+    return end_date - datetime.timedelta(days=30), end_date
+
+def aggregate_field_lookup_range(schema_id):
+    """
+    Returns the (start_date, end_date) over which AggregateFieldLookup totals
+    are counted, or None if the schema has no NewsItems up to today.
+    """
+    try:
+        end_date = NewsItem.objects.filter(schema__id=schema_id, item_date__lte=today()).values_list('item_date', flat=True).order_by('-item_date')[0]
+    except IndexError:
+        return None
+    return end_date - datetime.timedelta(days=constants.NUM_DAYS_AGGREGATE), end_date
+
+def field_lookup_query(sf, start_date, end_date):
+    """
+    Returns a tuple of (sql, params) for the query that selects
+    (lookup_id, total) for the given lookup SchemaField.
+    """
+    if sf.is_many_to_many_lookup():
+        sql = """
+            SELECT id, (
+                SELECT COUNT(*) FROM db_attribute a, db_newsitem ni
+                WHERE a.news_item_id = ni.id
+                    AND a.schema_id = %%s
+                    AND ni.schema_id = %%s
+                    AND lookup_id_array(a.%s) @> ARRAY[db_lookup.id]
+                    AND ni.item_date BETWEEN %%s AND %%s
+            )
+            FROM db_lookup
+            WHERE schema_field_id = %%s""" % sf.real_name
+        return sql, (sf.schema_id, sf.schema_id, start_date, end_date, sf.id)
+    else:
+        sql = """
+            SELECT a.%s, COUNT(*)
+            FROM db_attribute a, db_newsitem ni
+            WHERE a.news_item_id = ni.id
+                AND a.schema_id = %%s
+                AND ni.schema_id = %%s
+                AND %s IS NOT NULL
+                AND ni.item_date BETWEEN %%s AND %%s
+            GROUP BY 1""" % (sf.real_name, sf.real_name)
+        return sql, (sf.schema_id, sf.schema_id, start_date, end_date)
+
 def update_aggregates(schema_id_or_slug, dry_run=False):
     """
     Updates all Aggregate* tables for the given schema_id/slug,
@@ -49,12 +176,12 @@ def update_aggregates(schema_id_or_slug, dry_run=False):
     If dry_run is True, then the records won't be updated -- only the SQL
     will be output.
     """
-    if not str(schema_id_or_slug).isdigit():
-        schema_id = Schema.objects.get(slug=schema_id_or_slug).id
-    else:
-        schema_id = schema_id_or_slug
+    schema_id = get_schema_id(schema_id_or_slug)
     cursor = connection.cursor()
 
+    # Everything logged so far is covered by this full update.
+    last_change_id = take_changes(cursor, schema_id, dry_run=dry_run)[1]
+
     # AggregateAll
     cursor.execute("SELECT COUNT(*) FROM db_newsitem WHERE schema_id = %s", (schema_id,))
     new_values = [{'total': row[0]} for row in cursor.fetchall()]
@@ -84,75 +211,155 @@ def update_aggregates(schema_id_or_slug, dry_run=False):
     # This query is a bit clever -- we just sum up the totals created in a
     # previous aggregate. It's a helpful optimization, because otherwise
     # the location query is way too slow.
-    # Note that we calculate the total for the last 30 days that had at least
-    # one news item -- *NOT* the last 30 days, period.
-    # We add date_part <= current_date here to keep sparse items in the future
-    # from throwing off counts for the previous 30 days.
-    cursor.execute("SELECT date_part FROM %s WHERE schema_id = %%s AND date_part <= current_date ORDER BY date_part DESC LIMIT 1" % \
-        AggregateLocationDay._meta.db_table, (schema_id,))
-    try:
-        end_date = cursor.fetchone()[0]
-    except TypeError: # if cursor.fetchone() is None, there are no records.
-        pass
-    else:
-        start_date = end_date - datetime.timedelta(days=30)
+    date_range = aggregate_location_range(cursor, schema_id)
+    if date_range is not None:
         cursor.execute("""
             SELECT location_id, location_type_id, SUM(total)
             FROM %s
             WHERE schema_id = %%s
                 AND date_part BETWEEN %%s AND %%s
             GROUP BY 1, 2""" % AggregateLocationDay._meta.db_table,
-                (schema_id, start_date, end_date))
+                (schema_id,) + date_range)
         new_values = [{'location_id': row[0], 'location_type_id': row[1], 'total': row[2]} for row in cursor.fetchall()]
         smart_update(cursor, new_values, AggregateLocation._meta.db_table, ('location_id', 'location_type_id', 'total'), ('location_id', 'location_type_id'), {'schema_id': schema_id}, dry_run=dry_run)
 
     for sf in SchemaField.objects.filter(schema__id=schema_id, is_filter=True, is_lookup=True):
-        try:
-            end_date = NewsItem.objects.filter(schema__id=schema_id, item_date__lte=today()).values_list('item_date', flat=True).order_by('-item_date')[0]
-        except IndexError:
+        date_range = aggregate_field_lookup_range(schema_id)
+        if date_range is None:
             continue # There have been no NewsItems in the given date range.
-        start_date = end_date - datetime.timedelta(days=constants.NUM_DAYS_AGGREGATE)
-
-        if sf.is_many_to_many_lookup():
-            # AggregateFieldLookup
-            cursor.execute("""
-                SELECT id, (
-                    SELECT COUNT(*) FROM db_attribute a, db_newsitem ni
-                    WHERE a.news_item_id = ni.id
-                        AND a.schema_id = %%s
-                        AND ni.schema_id = %%s
-                        AND a.%s ~ ('[[:<:]]' || db_lookup.id || '[[:>:]]')
-                        AND ni.item_date BETWEEN %%s AND %%s
-                )
-                FROM db_lookup
-                WHERE schema_field_id = %%s""" % sf.real_name, (schema_id, schema_id, start_date, end_date, sf.id))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
-            smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table, ('lookup_id', 'total'), ('lookup_id',), {'schema_id': schema_id, 'schema_field_id': sf.id}, dry_run=dry_run)
-        else:
-            # AggregateFieldLookup
-            cursor.execute("""
-                SELECT a.%s, COUNT(*)
-                FROM db_attribute a, db_newsitem ni
-                WHERE a.news_item_id = ni.id
-                    AND a.schema_id = %%s
-                    AND ni.schema_id = %%s
-                    AND %s IS NOT NULL
-                    AND ni.item_date BETWEEN %%s AND %%s
-                GROUP BY 1""" % (sf.real_name, sf.real_name), (schema_id, schema_id, start_date, end_date))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
-            smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table, ('lookup_id', 'total'), ('lookup_id',), {'schema_id': schema_id, 'schema_field_id': sf.id}, dry_run=dry_run)
 
+        # AggregateFieldLookup
+        cursor.execute(*field_lookup_query(sf, *date_range))
+        new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
+        smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table, ('lookup_id', 'total'), ('lookup_id',), {'schema_id': schema_id, 'schema_field_id': sf.id}, dry_run=dry_run)
+
+    save_watermark(schema_id, last_change_id, dry_run=dry_run)
+    transaction.commit_unless_managed()
+
+def update_aggregates_incrementally(schema_id_or_slug, dry_run=False):
+    """
+    Updates all Aggregate* tables for the given schema_id/slug, recomputing
+    only what has been affected by the NewsItemChanges logged since the last
+    update. The changes are applied with set-based DELETE and INSERT ...
+    SELECT statements rather than row by row.
+
+    AggregateDay and AggregateLocationDay, which span the schema's whole
+    history, are recomputed only for the changed dates. AggregateAll is
+    summed from AggregateDay, and AggregateLocation and AggregateFieldLookup,
+    which only cover a recent window of dates (relative to today), are
+    recomputed in full.
+
+    If the schema has no AggregateWatermark yet, or the triggers that log
+    NewsItemChanges aren't installed, this does a full update_aggregates()
+    instead.
+
+    If dry_run is True, then the records won't be updated -- only the SQL
+    will be output.
+    """
+    schema_id = get_schema_id(schema_id_or_slug)
+    if not AggregateWatermark.objects.filter(schema__id=schema_id).count():
+        return update_aggregates(schema_id, dry_run=dry_run)
+    cursor = connection.cursor()
+    if not change_triggers_installed(cursor):
+        print >> sys.stderr, 'The triggers in sql/newsitemchange_functions.sql are not installed; doing a full update.'
+        return update_aggregates(schema_id, dry_run=dry_run)
+
+    changed_dates, last_change_id = take_changes(cursor, schema_id, dry_run=dry_run)
+
+    if changed_dates:
+        changed_dates = list(changed_dates)
+
+        # AggregateDay
+        execute(cursor, "DELETE FROM %s WHERE schema_id = %%s AND date_part = ANY(%%s)" % AggregateDay._meta.db_table,
+            (schema_id, changed_dates), dry_run=dry_run)
+        execute(cursor, """
+            INSERT INTO %s (schema_id, date_part, total)
+            SELECT schema_id, item_date, COUNT(*)
+            FROM db_newsitem
+            WHERE schema_id = %%s
+                AND item_date = ANY(%%s)
+            GROUP BY 1, 2""" % AggregateDay._meta.db_table, (schema_id, changed_dates), dry_run=dry_run)
+
+        # AggregateLocationDay
+        execute(cursor, "DELETE FROM %s WHERE schema_id = %%s AND date_part = ANY(%%s)" % AggregateLocationDay._meta.db_table,
+            (schema_id, changed_dates), dry_run=dry_run)
+        execute(cursor, """
+            INSERT INTO %s (schema_id, location_id, date_part, location_type_id, total)
+            SELECT ni.schema_id, nl.location_id, ni.item_date, loc.location_type_id, COUNT(*)
+            FROM db_newsitemlocation nl, db_newsitem ni, db_location loc
+            WHERE nl.news_item_id = ni.id
+                AND ni.schema_id = %%s
+                AND ni.item_date = ANY(%%s)
+                AND nl.location_id = loc.id
+            GROUP BY 1, 2, 3, 4""" % AggregateLocationDay._meta.db_table, (schema_id, changed_dates), dry_run=dry_run)
+
+        # AggregateAll
+        execute(cursor, "DELETE FROM %s WHERE schema_id = %%s" % AggregateAll._meta.db_table, (schema_id,), dry_run=dry_run)
+        execute(cursor, """
+            INSERT INTO %s (schema_id, total)
+            SELECT %%s, COALESCE(SUM(total), 0)
+            FROM %s
+            WHERE schema_id = %%s""" % (AggregateAll._meta.db_table, AggregateDay._meta.db_table), (schema_id, schema_id), dry_run=dry_run)
+
+    # AggregateLocation
+    execute(cursor, "DELETE FROM %s WHERE schema_id = %%s" % AggregateLocation._meta.db_table, (schema_id,), dry_run=dry_run)
+    date_range = aggregate_location_range(cursor, schema_id)
+    if date_range is not None:
+        execute(cursor, """
+            INSERT INTO %s (schema_id, location_id, location_type_id, total)
+            SELECT schema_id, location_id, location_type_id, SUM(total)
+            FROM %s
+            WHERE schema_id = %%s
+                AND date_part BETWEEN %%s AND %%s
+            GROUP BY 1, 2, 3""" % (AggregateLocation._meta.db_table, AggregateLocationDay._meta.db_table),
+            (schema_id,) + date_range, dry_run=dry_run)
+
+    # AggregateFieldLookup
+    date_range = aggregate_field_lookup_range(schema_id)
+    if date_range is not None:
+        for sf in SchemaField.objects.filter(schema__id=schema_id, is_filter=True, is_lookup=True):
+            execute(cursor, "DELETE FROM %s WHERE schema_id = %%s AND schema_field_id = %%s" % AggregateFieldLookup._meta.db_table,
+                (schema_id, sf.id), dry_run=dry_run)
+            sql, params = field_lookup_query(sf, *date_range)
+            execute(cursor, """
+                INSERT INTO %s (schema_id, schema_field_id, lookup_id, total)
+                SELECT %%s, %%s, lookups.*
+                FROM (%s) AS lookups""" % (AggregateFieldLookup._meta.db_table, sql),
+                (schema_id, sf.id) + params, dry_run=dry_run)
+
+    save_watermark(schema_id, last_change_id, dry_run=dry_run)
     transaction.commit_unless_managed()
 
-def update_all_aggregates(verbose=False):
+def update_all_aggregates(verbose=False, incremental=False, dry_run=False):
     for s in Schema.objects.all():
         if verbose:
             print '... %s' % s.plural_name
-        update_aggregates(s.id)
+        if incremental:
+            update_aggregates_incrementally(s.id, dry_run=dry_run)
+        else:
+            update_aggregates(s.id, dry_run=dry_run)
 
-if __name__ == "__main__":
-    import sys
-    if len(sys.argv) == 2:
-        update_aggregates(sys.argv[1])
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options] [schema_id_or_slug]')
+    p.add_option('-i', '--incremental', dest='incremental', action='store_true', default=False,
+                 help='only recompute the aggregates affected by NewsItems changed since the last run')
+    p.add_option('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+                 help="print the SQL, but don't change anything")
+    opts, args = p.parse_args(argv)
+    if len(args) > 1:
+        p.error('at most one schema may be given')
+    if args:
+        if opts.incremental:
+            update_aggregates_incrementally(args[0], dry_run=opts.dry_run)
+        else:
+            update_aggregates(args[0], dry_run=opts.dry_run)
     else:
-        update_all_aggregates(verbose=True)
+        update_all_aggregates(verbose=True, incremental=opts.incremental, dry_run=opts.dry_run)
+    if not opts.dry_run:
+        # The homepage's cached date charts come from the aggregates.
+        invalidate_homepage()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Populates db_blocknewsitem, the table of the NewsItems within each block
+radius of each Block (see BlockNewsItem in ebpub/db/models.py).
+
+Run it once after installing sql/blocknewsitem_functions.sql, whose trigger
+keeps the table up to date as NewsItems are created, moved and deleted, and
+again whenever the blocks change.
+
+NewsItems are processed in batches of consecutive IDs, each in its own
+transaction, so an interrupted run can be resumed with --start-id.
+"""
+
+from django.db import connection, transaction
+from ebpub.db.views import BLOCK_RADIUS_CHOICES
+from optparse import OptionParser
+import sys
+import time
+
+def check_radii(cursor):
+    """
+    Returns True if the block_radii view matches BLOCK_RADIUS_CHOICES.
+    """
+    cursor.execute("SELECT radius, degrees FROM block_radii")
+    radii = dict([(str(radius), degrees) for radius, degrees in cursor.fetchall()])
+    return radii == BLOCK_RADIUS_CHOICES
+
+def update_block_newsitems(start_id=None, batch_size=10000, verbose=False):
+    """
+    Recomputes the db_blocknewsitem rows of every NewsItem (with an ID of at
+    least start_id, if given). Returns the number of rows inserted.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id) FROM db_newsitem")
+    min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return 0
+    if start_id is not None:
+        min_id = max(min_id, start_id)
+    total = 0
+    start = time.time()
+    for first_id in xrange(min_id, max_id + 1, batch_size):
+        last_id = first_id + batch_size - 1
+        cursor.execute("DELETE FROM db_blocknewsitem WHERE news_item_id BETWEEN %s AND %s", (first_id, last_id))
+        cursor.execute("""
+            INSERT INTO db_blocknewsitem (block_id, news_item_id, radius)
+            SELECT blocks.id, ni.id, block_radii.radius
+            FROM db_newsitem ni, block_radii, blocks
+            WHERE ni.id BETWEEN %s AND %s
+                AND ni.location IS NOT NULL
+                AND ST_Centroid(blocks.geom) && ST_Expand(ni.location, block_radii.degrees)""", (first_id, last_id))
+        total += cursor.rowcount
+        transaction.commit_unless_managed()
+        if verbose:
+            print 'Inserted %s rows for NewsItems up to ID %s (%.1f seconds)' % (total, min(last_id, max_id), time.time() - start)
+    return total
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options]')
+    p.add_option('-s', '--start-id', dest='start_id', type='int', default=None,
+                 help='only update NewsItems with at least this ID')
+    p.add_option('-b', '--batch-size', dest='batch_size', type='int', default=10000,
+                 help='number of NewsItem IDs to update per transaction')
+    p.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False)
+    opts, args = p.parse_args(argv)
+    if not check_radii(connection.cursor()):
+        p.error('the block_radii view in sql/blocknewsitem_functions.sql does not match BLOCK_RADIUS_CHOICES')
+    total = update_block_newsitems(opts.start_id, opts.batch_size, opts.verbose)
+    print 'Inserted %s rows' % total
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,10 +4,8 @@ NUM_DAYS_AGGREGATE = 30
 # Number of results per page in the schema_filter view.
 FILTER_PER_PAGE = 30
 
-# Number of NewsItems to fetch for place_detail.
-# Gotcha/caveat: If there are more than this number of items in a given day,
-# then place_detail will ignore the day because of the smart_bunches()
-# logic.
+# Maximum number of NewsItems per day to fetch for place_detail. If a day has
+# more, only the ones of the most important schemas are shown.
 NUM_NEWS_ITEMS_PLACE_DETAIL = 1000
 
 # Number of days to which we limit the NewsItems on place_detail.
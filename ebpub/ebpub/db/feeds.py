@@ -6,7 +6,7 @@ from django.utils.feedgenerator import Rss201rev2Feed
 from ebpub.db.constants import BLOCK_URL_REGEX
 from ebpub.db.models import NewsItem, Location
 from ebpub.db.utils import populate_attributes_if_needed, today
-from ebpub.db.views import make_search_buffer, url_to_block, BLOCK_RADIUS_CHOICES, BLOCK_RADIUS_DEFAULT
+from ebpub.db.views import filter_by_block, url_to_block, BLOCK_RADIUS_CHOICES, BLOCK_RADIUS_DEFAULT
 from ebpub.metros.allmetros import get_metro
 from ebpub.streets.models import Block
 import datetime
@@ -148,8 +148,7 @@ class BlockFeed(AbstractLocationFeed):
         return u"EBPUB %s" % obj.pretty_name
 
     def newsitems_for_obj(self, obj, qs, block_radius):
-        search_buffer = make_search_buffer(obj.location.centroid, block_radius)
-        return qs.filter(location__bboverlaps=search_buffer)
+        return filter_by_block(qs, obj, block_radius)
 
 class LocationFeed(AbstractLocationFeed):
     def get_object(self, bits):
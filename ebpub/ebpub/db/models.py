@@ -1,9 +1,101 @@
+from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Count
+from django.core import signals as core_signals
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.db import connection, transaction
+from django.db.models import signals
 from ebpub.streets.models import Block
+from ebpub.utils.cache import cache_is_shared
 from ebpub.utils.text import slugify
 import datetime
+import time
+
+# field_mapping() results are cached in this process, in _field_mapping_cache
+# ({schema_id: (version, loaded_at, {name: real_name})}), for
+# FIELD_MAPPING_LOCAL_TIMEOUT seconds.
+#
+# If settings.FIELD_MAPPING_SHARED_CACHE is True, they're also cached in the
+# Django cache, where other processes can find them, and kept until they
+# change: each schema has a version number in the Django cache, which changes
+# whenever one of its SchemaFields is saved or deleted, so that every process
+# stops using its old mapping. That requires a CACHE_BACKEND that is shared
+# between processes.
+FIELD_MAPPING_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+FIELD_MAPPING_LOCAL_TIMEOUT = 60
+_field_mapping_cache = {}
+
+# IDs of schemas whose SchemaFields were changed in a transaction that hadn't
+# been committed yet. Their mappings are invalidated again once it has been;
+# see invalidate_field_mapping_after_commit().
+_pending_invalidations = set()
+
+# Counters of how field_mapping() found each schema's mapping: in this
+# process, in the Django cache or in the database. See field_mapping_hit_rate().
+field_mapping_stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+
+def _field_mapping_version_key(schema_id):
+    return 'ebpub_db_field_mapping_version_%s' % schema_id
+
+def _field_mapping_key(schema_id, version):
+    return 'ebpub_db_field_mapping_%s_%s' % (schema_id, version)
+
+def _field_mapping_is_shared():
+    if not getattr(settings, 'FIELD_MAPPING_SHARED_CACHE', False):
+        return False
+    if not cache_is_shared():
+        raise ImproperlyConfigured('FIELD_MAPPING_SHARED_CACHE requires a CACHE_BACKEND that is shared between processes, such as memcached')
+    return True
+
+def invalidate_field_mapping(schema_id):
+    """
+    Throws away the cached field_mapping() for the given schema, in this
+    process and, if settings.FIELD_MAPPING_SHARED_CACHE is True, in every
+    other process.
+    """
+    _field_mapping_cache.pop(schema_id, None)
+    if _field_mapping_is_shared():
+        cache.set(_field_mapping_version_key(schema_id), time.time(), FIELD_MAPPING_CACHE_TIMEOUT)
+
+def invalidate_field_mapping_after_commit(schema_id):
+    """
+    Like invalidate_field_mapping(), for a change to the given schema's
+    SchemaFields that may not have been committed yet.
+
+    The mapping is invalidated right away, but if a transaction is under way,
+    another process could reload the old SchemaFields before it's committed
+    and cache them under the new version. So it's invalidated again by
+    flush_field_mapping_invalidations(), which runs at the end of each request
+    and whenever field_mapping() is called outside a transaction. Code that
+    changes SchemaFields in a managed transaction outside a request should
+    call flush_field_mapping_invalidations() after committing.
+    """
+    invalidate_field_mapping(schema_id)
+    if transaction.is_managed():
+        _pending_invalidations.add(schema_id)
+
+def flush_field_mapping_invalidations(**kwargs):
+    """
+    Invalidates the mappings of the schemas whose SchemaFields were changed
+    in transactions that have since been committed. Does nothing while a
+    transaction is under way.
+    """
+    if transaction.is_managed():
+        return
+    while _pending_invalidations:
+        invalidate_field_mapping(_pending_invalidations.pop())
+core_signals.request_finished.connect(flush_field_mapping_invalidations)
+
+def field_mapping_hit_rate():
+    """
+    Returns the fraction of schema mappings that field_mapping() found
+    without querying the database, or None if it hasn't been called.
+    """
+    total = sum(field_mapping_stats.values())
+    if not total:
+        return None
+    return float(field_mapping_stats['hits'] + field_mapping_stats['shared_hits']) / total
 
 def field_mapping(schema_id_list):
     """
@@ -13,13 +105,67 @@ def field_mapping(schema_id_list):
         {1: {u'crime_type': 'varchar01', u'crime_date', 'date01'},
          2: {u'permit_number': 'varchar01', 'to_date': 'date01'},
         }
+
+    The mappings are cached (see the comment above), so this usually doesn't
+    query the database.
     """
-    # schema_fields = [{'schema_id': 1, 'name': u'crime_type', 'real_name': u'varchar01'},
-    #                  {'schema_id': 1, 'name': u'crime_date', 'real_name': u'date01'}]
-    result = {}
-    for sf in SchemaField.objects.filter(schema__id__in=(schema_id_list)).values('schema', 'name', 'real_name'):
-        result.setdefault(sf['schema'], {})[sf['name']] = sf['real_name']
-    return result
+    if _pending_invalidations:
+        flush_field_mapping_invalidations()
+    shared = _field_mapping_is_shared()
+    now = time.time()
+    schema_ids = set([int(i) for i in schema_id_list])
+    if shared:
+        versions = cache.get_many([_field_mapping_version_key(i) for i in schema_ids])
+    mappings = {}
+    stale = {} # Maps schema IDs whose mappings aren't in this process to their current versions.
+    for schema_id in schema_ids:
+        version = None
+        if shared:
+            version = versions.get(_field_mapping_version_key(schema_id))
+            if version is None:
+                # The version was never set, or the cache lost it. Either way,
+                # we can't trust any mapping cached under an old version.
+                version = now
+                cache.set(_field_mapping_version_key(schema_id), version, FIELD_MAPPING_CACHE_TIMEOUT)
+        try:
+            cached_version, loaded_at, mapping = _field_mapping_cache[schema_id]
+        except KeyError:
+            fresh = False
+        else:
+            if shared:
+                fresh = cached_version == version
+            else:
+                fresh = now - loaded_at < FIELD_MAPPING_LOCAL_TIMEOUT
+        if fresh:
+            mappings[schema_id] = mapping
+            field_mapping_stats['hits'] += 1
+        else:
+            stale[schema_id] = version
+
+    if stale and shared:
+        keys = dict([(_field_mapping_key(schema_id, version), schema_id) for schema_id, version in stale.items()])
+        for key, mapping in cache.get_many(keys.keys()).items():
+            schema_id = keys[key]
+            _field_mapping_cache[schema_id] = (stale.pop(schema_id), now, mapping)
+            mappings[schema_id] = mapping
+            field_mapping_stats['shared_hits'] += 1
+
+    if stale:
+        # schema_fields = [{'schema_id': 1, 'name': u'crime_type', 'real_name': u'varchar01'},
+        #                  {'schema_id': 1, 'name': u'crime_date', 'real_name': u'date01'}]
+        loaded = dict([(schema_id, {}) for schema_id in stale])
+        for sf in SchemaField.objects.filter(schema__id__in=stale.keys()).values('schema', 'name', 'real_name'):
+            loaded[sf['schema']][sf['name']] = sf['real_name']
+        for schema_id, mapping in loaded.items():
+            if shared:
+                cache.set(_field_mapping_key(schema_id, stale[schema_id]), mapping, FIELD_MAPPING_CACHE_TIMEOUT)
+            _field_mapping_cache[schema_id] = (stale[schema_id], now, mapping)
+            mappings[schema_id] = mapping
+            field_mapping_stats['misses'] += 1
+
+    # Schemas without any SchemaFields aren't included, and the cached
+    # dictionaries are copied, so callers can't change them.
+    return dict([(schema_id, dict(mapping)) for schema_id, mapping in mappings.items() if mapping])
 
 class SchemaManager(models.Manager):
     def get_query_set(self):
@@ -97,6 +243,11 @@ class SchemaField(models.Model):
     def __unicode__(self):
         return u'%s - %s' % (self.schema, self.name)
 
+    def delete(self):
+        super(SchemaField, self).delete()
+        # The post_delete signal is sent before the deletion is committed.
+        flush_field_mapping_invalidations()
+
     def _get_slug(self):
         return self.name.replace('_', '-')
     slug = property(_get_slug)
@@ -142,6 +293,11 @@ class SchemaField(models.Model):
             return self.pretty_name_plural
         return self.pretty_name
 
+def invalidate_schema_field_mapping(sender, instance, **kwargs):
+    invalidate_field_mapping_after_commit(instance.schema_id)
+signals.post_save.connect(invalidate_schema_field_mapping, sender=SchemaField)
+signals.post_delete.connect(invalidate_schema_field_mapping, sender=SchemaField)
+
 class SchemaFieldInfo(models.Model):
     schema = models.ForeignKey(Schema)
     schema_field = models.ForeignKey(SchemaField)
@@ -251,13 +407,27 @@ class AttributeDict(dict):
     """
     A dictionary-like object that serves as a wrapper around attributes for a
     given NewsItem.
+
+    If values (a name -> value dictionary) is given, the attributes aren't
+    retrieved from the database.
     """
-    def __init__(self, news_item_id, schema_id, mapping):
+    def __init__(self, news_item_id, schema_id, mapping, values=None):
         dict.__init__(self)
         self.news_item_id = news_item_id
         self.schema_id = schema_id
         self.mapping = mapping # name -> real_name dictionary
         self.cached = False
+        if values is not None:
+            self.update(values)
+            self.cached = True
+
+    def __reduce__(self):
+        # Pickling a dict subclass would otherwise restore its items with
+        # __setitem__(), which writes them to the database.
+        values = None
+        if self.cached:
+            values = dict(self)
+        return (AttributeDict, (self.news_item_id, self.schema_id, self.mapping, values))
 
     def __do_query(self):
         if not self.cached:
@@ -292,6 +462,33 @@ class AttributeDict(dict):
         dict.__setitem__(self, name, value)
 
 class NewsItemQuerySet(models.query.GeoQuerySet):
+    _prefetch_attributes = False
+
+    def _clone(self, *args, **kwargs):
+        clone = super(NewsItemQuerySet, self)._clone(*args, **kwargs)
+        clone._prefetch_attributes = self._prefetch_attributes
+        return clone
+
+    def iterator(self):
+        if not self._prefetch_attributes:
+            return super(NewsItemQuerySet, self).iterator()
+        from ebpub.db.utils import populate_attributes
+        ni_list = list(super(NewsItemQuerySet, self).iterator())
+        populate_attributes(ni_list)
+        return iter(ni_list)
+
+    def prefetch_attributes(self):
+        """
+        Returns a QuerySet whose NewsItems come with their attributes and
+        Lookups already loaded, so that ni.attributes, ni.attribute_values and
+        ni.attributes_for_template() don't query the database for each item.
+        The whole result set is loaded with a constant number of queries; see
+        ebpub.db.utils.populate_attributes().
+        """
+        clone = self._clone()
+        clone._prefetch_attributes = True
+        return clone
+
     def prepare_attribute_qs(self):
         clone = self._clone()
         if 'db_attribute' not in clone.query.extra_tables:
@@ -327,13 +524,14 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
                 return clone
             att_value = [val.id for val in att_value]
         if schema_field.is_many_to_many_lookup():
-            # We have to use a regular expression search to look for all rows
-            # with the given att_value *somewhere* in the column. The [[:<:]]
-            # thing is a word boundary.
+            # Look for all rows with any of the given att_values *somewhere*
+            # in the column, using the lookup_id_array() GIN index on the
+            # column (see sql/attribute_functions.sql).
             for value in att_value:
                 if not str(value).isdigit():
                     raise ValueError('Only integer strings allowed for att_value in many-to-many SchemaFields')
-            clone.query.extra_where += ("db_attribute.%s ~ '[[:<:]]%s[[:>:]]'" % (real_name, '|'.join([str(val) for val in att_value])),)
+            clone.query.extra_where += ("lookup_id_array(db_attribute.%s) && ARRAY[%s]" % (real_name, ','.join(['%s' for val in att_value])),)
+            clone.query.extra_params += tuple([int(val) for val in att_value])
         elif None in att_value:
             if att_value != [None]:
                 raise ValueError('by_attribute() att_value list cannot have more than one element if it includes None')
@@ -362,7 +560,7 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
         real_name = "db_attribute." + str(schema_field.real_name)
         if schema_field.is_many_to_many_lookup():
             clone = self.prepare_attribute_qs().filter(schema__id=schema_field.schema_id)
-            clone = clone.extra(where=[real_name + " ~ ('[[:<:]]' || db_lookup.id || '[[:>:]]')"])
+            clone = clone.extra(where=["lookup_id_array(" + real_name + ") @> ARRAY[db_lookup.id]"])
             # We want to count the current queryset and get a single
             # row for injecting into the subsequent Lookup query, but
             # we don't want Django's aggregation support to
@@ -393,6 +591,39 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
         clone.query.extra_params += ("%%%s%%" % query,)
         return clone
 
+    def search(self, query, schemas=None, start_date=None, end_date=None):
+        """
+        Returns a QuerySet of NewsItems whose title or description matches a
+        full-text search query, most relevant first. Each NewsItem gets a
+        search_rank attribute.
+
+        The search uses the db_newsitem.search_vector column and its GIN
+        index (see sql/newsitem.sql). Optionally restricts the results to the
+        given Schemas (or Schema IDs) and to item_dates between start_date
+        and end_date, inclusive.
+        """
+        query = query.strip()
+        clone = self.all()
+        if not query:
+            # Not self.none(), which would return a normal QuerySet rather
+            # than a NewsItemQuerySet (see by_attribute()).
+            clone.query.extra_where += ('1=0',)
+            return clone
+        if schemas is not None:
+            clone = clone.filter(schema__id__in=[getattr(s, 'id', s) for s in schemas])
+        if start_date is not None:
+            clone = clone.filter(item_date__gte=start_date)
+        if end_date is not None:
+            clone = clone.filter(item_date__lte=end_date)
+        tsquery = "plainto_tsquery('pg_catalog.english', %s)"
+        return clone.extra(
+            select={'search_rank': 'ts_rank_cd(db_newsitem.search_vector, %s)' % tsquery},
+            select_params=(query,),
+            where=['db_newsitem.search_vector @@ %s' % tsquery],
+            params=[query],
+            order_by=['-search_rank', '-item_date'],
+        )
+
 class NewsItemManager(models.GeoManager):
     def get_query_set(self):
         return NewsItemQuerySet(self.model)
@@ -403,12 +634,62 @@ class NewsItemManager(models.GeoManager):
     def text_search(self, *args, **kwargs):
         return self.get_query_set().text_search(*args, **kwargs)
 
+    def search(self, *args, **kwargs):
+        return self.get_query_set().search(*args, **kwargs)
+
     def date_counts(self, *args, **kwargs):
         return self.get_query_set().date_counts(*args, **kwargs)
 
     def top_lookups(self, *args, **kwargs):
         return self.get_query_set().top_lookups(*args, **kwargs)
 
+    def prefetch_attributes(self, *args, **kwargs):
+        return self.get_query_set().prefetch_attributes(*args, **kwargs)
+
+    def bulk_create(self, newsitems):
+        """
+        Saves a list of (unsaved NewsItem, attributes dictionary) pairs in a
+        constant number of queries: one to allocate the NewsItem IDs, one
+        multi-row INSERT for the NewsItems, one for field_mapping() and one
+        multi-row INSERT per schema for the Attribute rows. Sets the id of
+        each NewsItem.
+
+        This doesn't manage transactions; the caller should.
+        """
+        if not newsitems:
+            return
+        cursor = connection.cursor()
+        cursor.execute("SELECT nextval('%s_id_seq') FROM generate_series(1, %%s)" % NewsItem._meta.db_table, [len(newsitems)])
+        for (ni, attributes), row in zip(newsitems, cursor.fetchall()):
+            ni.id = row[0]
+
+        rows, params = [], []
+        for ni, attributes in newsitems:
+            row_params = [ni.id, ni.schema_id, ni.title, ni.description, ni.url, ni.pub_date, ni.item_date]
+            if ni.location is None:
+                location_sql = 'NULL'
+            else:
+                location_sql = 'GeomFromText(%s, %s)'
+                row_params.extend([ni.location.wkt, ni.location.srid or 4326])
+            rows.append('(%%s, %%s, %%s, %%s, %%s, %%s, %%s, %s, %%s, %%s, %%s)' % location_sql)
+            params.extend(row_params + [ni.location_name, ni.location_object_id, ni.block_id])
+        cursor.execute("""
+            INSERT INTO %s (id, schema_id, title, description, url, pub_date, item_date, location, location_name, location_object_id, block_id)
+            VALUES %s""" % (NewsItem._meta.db_table, ','.join(rows)), params)
+
+        mapping = field_mapping(list(set([ni.schema_id for ni, attributes in newsitems])))
+        for schema_id, schema_mapping in mapping.items():
+            schema_mapping = schema_mapping.items()
+            rows, params = [], []
+            for ni, attributes in newsitems:
+                if ni.schema_id == schema_id:
+                    rows.append('(%s)' % ','.join(['%s'] * (len(schema_mapping) + 2)))
+                    params.extend([ni.id, schema_id] + [attributes.get(k, None) for k, v in schema_mapping])
+            if rows:
+                cursor.execute("""
+                    INSERT INTO %s (news_item_id, schema_id, %s)
+                    VALUES %s""" % (Attribute._meta.db_table, ','.join([v for k, v in schema_mapping]), ','.join(rows)), params)
+
 class NewsItem(models.Model):
     schema = models.ForeignKey(Schema)
     title = models.CharField(max_length=255)
@@ -430,7 +711,6 @@ class NewsItem(models.Model):
         return '/%s/by-date/%s/%s/%s/%s/' % (self.schema.slug, self.item_date.year, self.item_date.month, self.item_date.day, self.id)
 
     def item_url_with_domain(self):
-        from django.conf import settings
         return 'http://%s.%s%s' % (settings.SHORT_NAME, settings.EB_DOMAIN, self.item_url())
 
     def item_date_url(self):
@@ -445,7 +725,15 @@ class NewsItem(models.Model):
         """
         Return a list of AttributeForTemplate objects for this NewsItem. The
         objects are ordered by SchemaField.display_order.
+
+        This doesn't query the database if the NewsItem was loaded with
+        NewsItemQuerySet.prefetch_attributes() or populate_attributes().
         """
+        if hasattr(self, '_attributes_for_template_cache'):
+            fields, attribute_row, field_infos, lookups = self._attributes_for_template_cache
+            if attribute_row is None:
+                return []
+            return [AttributeForTemplate(f, attribute_row, field_infos.get(f.id, None), lookups) for f in fields]
         fields = SchemaField.objects.filter(schema__id=self.schema_id).select_related().order_by('display_order')
         field_infos = dict([(obj.schema_field_id, obj.help_text) for obj in SchemaFieldInfo.objects.filter(schema__id=self.schema_id)])
         try:
@@ -455,7 +743,12 @@ class NewsItem(models.Model):
         return [AttributeForTemplate(f, attribute_row, field_infos.get(f.id, None)) for f in fields]
 
 class AttributeForTemplate(object):
-    def __init__(self, schema_field, attribute_row, help_text):
+    def __init__(self, schema_field, attribute_row, help_text, lookups=None):
+        """
+        lookups, if given, is a dictionary of Lookups by ID that contains
+        every Lookup this attribute refers to, so that they don't have to be
+        retrieved from the database.
+        """
         self.sf = schema_field
         self.raw_value = attribute_row[schema_field.real_name]
         self.schema_slug = schema_field.schema.slug
@@ -471,8 +764,11 @@ class AttributeForTemplate(object):
                 except ValueError:
                     self.values = []
                 else:
-                    lookups = Lookup.objects.in_bulk(id_values)
+                    if lookups is None:
+                        lookups = Lookup.objects.in_bulk(id_values)
                     self.values = [lookups[i] for i in id_values]
+            elif lookups is not None:
+                self.values = [lookups.get(self.raw_value)]
             else:
                 self.values = [Lookup.objects.get(id=self.raw_value)]
         else:
@@ -629,6 +925,31 @@ class NewsItemLocation(models.Model):
     def __unicode__(self):
         return u'%s - %s' % (self.news_item, self.location)
 
+class NewsItemLocationWatermark(models.Model):
+    # The highest NewsItem id that populate_ni_loc() in
+    # ebpub/db/bin/populate_newsitemlocations.py had checked against the
+    # Location in a complete, unrestricted run. Its incremental mode only
+    # considers newer NewsItems.
+    location = models.ForeignKey(Location, unique=True)
+    last_news_item_id = models.IntegerField()
+
+class BlockNewsItem(models.Model):
+    # The NewsItems within each block radius (a key of BLOCK_RADIUS_CHOICES in
+    # ebpub/db/views.py) of each Block, so that block pages, feeds and alerts
+    # can look them up instead of running a spatial query. Rows are written by
+    # the trigger in sql/blocknewsitem_functions.sql and by
+    # ebpub/db/bin/update_block_newsitems.py, and used by filter_by_block()
+    # in ebpub/db/views.py if settings.BLOCK_PROXIMITY_ENABLED is True.
+    block = models.ForeignKey(Block)
+    news_item = models.ForeignKey(NewsItem)
+    radius = models.SmallIntegerField()
+
+    class Meta:
+        unique_together = (('block', 'radius', 'news_item'),)
+
+    def __unicode__(self):
+        return u'%s - %s blocks - %s' % (self.block, self.radius, self.news_item)
+
 class AggregateBaseClass(models.Model):
     schema = models.ForeignKey(Schema)
     total = models.IntegerField()
@@ -660,6 +981,22 @@ class AggregateFieldLookup(AggregateBaseClass):
     schema_field = models.ForeignKey(SchemaField)
     lookup = models.ForeignKey(Lookup)
 
+class NewsItemChange(models.Model):
+    # Log of the (schema, item_date) cells touched by each insert, update and
+    # delete of a NewsItem (or of its NewsItemLocations). Rows are written by
+    # the triggers in sql/newsitemchange_functions.sql and consumed by
+    # update_aggregates_incrementally() in ebpub/db/bin/update_aggregates.py.
+    # schema_id isn't a ForeignKey because rows are logged while a Schema's
+    # NewsItems are being deleted.
+    schema_id = models.IntegerField(db_index=True)
+    item_date = models.DateField()
+
+class AggregateWatermark(models.Model):
+    # The id of the last NewsItemChange that has been folded into the
+    # Aggregate* tables for the schema.
+    schema = models.ForeignKey(Schema, unique=True)
+    last_change_id = models.IntegerField()
+
 class SearchSpecialCase(models.Model):
     query = models.CharField(max_length=64, unique=True)
     redirect_to = models.CharField(max_length=255, blank=True)
@@ -0,0 +1,31 @@
+-- Many-to-many lookup values are stored in the varchar columns as
+-- comma-separated Lookup IDs, e.g. '12,345'. lookup_id_array() converts such
+-- a value to an integer array (and anything else, such as the value of a
+-- regular varchar field, to NULL). With the GIN indexes below, queries can
+-- match many-to-many values with the array operators -- "@>" (contains) and
+-- "&&" (overlaps) -- instead of regular expressions that can't use an index.
+--
+-- NewsItemQuerySet.by_attribute() and top_lookups() and update_aggregates
+-- use lookup_id_array() for many-to-many lookups, so run this file by hand
+-- after creating db_attribute. Creating the indexes converts the existing
+-- values.
+CREATE OR REPLACE FUNCTION lookup_id_array(value varchar) RETURNS integer[] AS $$
+    SELECT CASE
+        WHEN $1 ~ '^,*[0-9]{1,9}(,+[0-9]{1,9})*,*$' THEN regexp_split_to_array(trim(both ',' from $1), ',+')::integer[]
+        ELSE NULL
+    END;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE INDEX db_attribute_varchar01_lookups ON db_attribute USING GIN (lookup_id_array(varchar01));
+CREATE INDEX db_attribute_varchar02_lookups ON db_attribute USING GIN (lookup_id_array(varchar02));
+CREATE INDEX db_attribute_varchar03_lookups ON db_attribute USING GIN (lookup_id_array(varchar03));
+CREATE INDEX db_attribute_varchar04_lookups ON db_attribute USING GIN (lookup_id_array(varchar04));
+CREATE INDEX db_attribute_varchar05_lookups ON db_attribute USING GIN (lookup_id_array(varchar05));
+
+-- To delete:
+-- DROP INDEX db_attribute_varchar01_lookups;
+-- DROP INDEX db_attribute_varchar02_lookups;
+-- DROP INDEX db_attribute_varchar03_lookups;
+-- DROP INDEX db_attribute_varchar04_lookups;
+-- DROP INDEX db_attribute_varchar05_lookups;
+-- DROP FUNCTION lookup_id_array(varchar);
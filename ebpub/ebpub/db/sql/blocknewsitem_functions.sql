@@ -0,0 +1,60 @@
+-- The block radii of block pages, feeds and alerts, in number of blocks and
+-- in degrees. These must match BLOCK_RADIUS_CHOICES in ebpub/db/views.py;
+-- update_block_newsitems checks that they do.
+CREATE OR REPLACE VIEW block_radii AS
+    SELECT 1 AS radius, 0.0015::float8 AS degrees
+    UNION ALL SELECT 3, 0.0035
+    UNION ALL SELECT 8, 0.007;
+
+-- A NewsItem is within a radius of a block if its bounding box overlaps the
+-- square of that radius around the block's centroid (see make_search_buffer()
+-- in ebpub/db/views.py) -- or, equivalently, if the centroid is within the
+-- NewsItem's bounding box expanded by the radius, which this index answers.
+CREATE INDEX blocks_centroid ON blocks USING GIST (ST_Centroid(geom));
+
+-- Trigger that updates db_blocknewsitem whenever the location is changed in
+-- db_newsitem. Like location_updater, it runs before the change, which is
+-- fine because the foreign key constraints are deferred.
+CREATE OR REPLACE FUNCTION update_block_newsitems() RETURNS TRIGGER AS $block_newsitem_updater$
+    BEGIN
+        -- See update_newsitem_location() for why these conditions are so
+        -- verbose and not combined.
+        IF (TG_OP = 'UPDATE') THEN
+            IF ((NEW.location IS NOT NULL AND OLD.location IS NOT NULL AND NEW.location != OLD.location) OR (NEW.location IS NULL AND OLD.location IS NOT NULL) OR (NEW.location IS NOT NULL AND OLD.location IS NULL)) THEN
+                IF (OLD.location IS NOT NULL) THEN
+                    DELETE FROM db_blocknewsitem WHERE news_item_id = OLD.id;
+                END IF;
+                IF (NEW.location IS NOT NULL) THEN
+                    INSERT INTO db_blocknewsitem (block_id, news_item_id, radius)
+                    SELECT blocks.id, NEW.id, block_radii.radius
+                    FROM blocks, block_radii
+                    WHERE ST_Centroid(blocks.geom) && ST_Expand(NEW.location, block_radii.degrees);
+                END IF;
+            END IF;
+        ELSIF (TG_OP = 'INSERT') THEN
+            IF (NEW.location IS NOT NULL) THEN
+                INSERT INTO db_blocknewsitem (block_id, news_item_id, radius)
+                SELECT blocks.id, NEW.id, block_radii.radius
+                FROM blocks, block_radii
+                WHERE ST_Centroid(blocks.geom) && ST_Expand(NEW.location, block_radii.degrees);
+            END IF;
+        ELSIF (TG_OP = 'DELETE') THEN
+            DELETE FROM db_blocknewsitem WHERE news_item_id = OLD.id;
+            RETURN OLD;
+        END IF;
+        RETURN NEW;
+    END;
+$block_newsitem_updater$ LANGUAGE plpgsql;
+
+CREATE TRIGGER block_newsitem_updater
+BEFORE INSERT OR UPDATE OR DELETE ON db_newsitem
+    FOR EACH ROW EXECUTE PROCEDURE update_block_newsitems();
+
+-- To delete:
+-- DROP TRIGGER block_newsitem_updater ON db_newsitem;
+-- DROP FUNCTION update_block_newsitems();
+-- DROP INDEX blocks_centroid;
+-- DROP VIEW block_radii;
+
+-- To populate for existing NewsItems, or after the blocks have changed, run
+-- ebpub/db/bin/update_block_newsitems.py.
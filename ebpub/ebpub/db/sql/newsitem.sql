@@ -33,3 +33,19 @@ CREATE INDEX db_attribute_int07 ON db_attribute (int07) WHERE int07 IS NOT NULL;
 
 ALTER TABLE db_newsitem ALTER COLUMN schema_id SET STATISTICS 5;
 ALTER TABLE db_newsitem ALTER COLUMN item_date SET STATISTICS 75;
+
+-- Full-text search. search_vector holds each NewsItem's title (weighted A)
+-- and description (weighted B) and is searched through its GIN index by
+-- NewsItemQuerySet.search(). The trigger that keeps it up to date is in
+-- newsitem_functions.sql, which must be run by hand.
+--
+-- On an existing database, run the rest of this file and
+-- newsitem_functions.sql by hand, then fill in search_vector for the existing
+-- NewsItems with ebpub/db/bin/backfill_search_vectors.py.
+ALTER TABLE db_newsitem ADD COLUMN search_vector tsvector;
+
+CREATE INDEX db_newsitem_search_vector ON db_newsitem USING GIN (search_vector);
+
+-- To delete:
+-- DROP INDEX db_newsitem_search_vector;
+-- ALTER TABLE db_newsitem DROP COLUMN search_vector;
@@ -0,0 +1,30 @@
+-- Trigger that keeps db_newsitem.search_vector (see newsitem.sql) up to date
+-- whenever a NewsItem is created or its title or description is changed.
+CREATE OR REPLACE FUNCTION newsitem_search_vector(title varchar, description text) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('pg_catalog.english', coalesce($1, '')), 'A') ||
+           setweight(to_tsvector('pg_catalog.english', coalesce($2, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_newsitem_search_vector() RETURNS TRIGGER AS $newsitem_search_vector_updater$
+    BEGIN
+        -- OLD isn't defined for INSERTs, so these conditions can't be combined.
+        IF (TG_OP = 'INSERT') THEN
+            NEW.search_vector := newsitem_search_vector(NEW.title, NEW.description);
+        ELSIF (NEW.title != OLD.title OR NEW.description != OLD.description OR NEW.search_vector IS NULL) THEN
+            NEW.search_vector := newsitem_search_vector(NEW.title, NEW.description);
+        END IF;
+        RETURN NEW;
+    END;
+$newsitem_search_vector_updater$ LANGUAGE plpgsql;
+
+CREATE TRIGGER newsitem_search_vector_updater
+BEFORE INSERT OR UPDATE ON db_newsitem
+    FOR EACH ROW EXECUTE PROCEDURE update_newsitem_search_vector();
+
+-- To delete:
+-- DROP TRIGGER newsitem_search_vector_updater ON db_newsitem;
+-- DROP FUNCTION update_newsitem_search_vector();
+-- DROP FUNCTION newsitem_search_vector(varchar, text);
+
+-- To fill in search_vector for existing NewsItems, run
+-- ebpub/db/bin/backfill_search_vectors.py.
@@ -0,0 +1,56 @@
+-- Triggers that log the (schema_id, item_date) of every NewsItem that's
+-- created, deleted or moved to another date, and of every NewsItem whose
+-- NewsItemLocations change, so that update_aggregates can recompute only the
+-- aggregates for those dates.
+--
+-- Run this file by hand after creating db_newsitemchange. Until both triggers
+-- are installed, update_aggregates --incremental does full updates instead.
+CREATE OR REPLACE FUNCTION log_newsitem_change() RETURNS TRIGGER AS $newsitem_change_logger$
+    BEGIN
+        -- As in update_newsitem_location(), these conditions can't be
+        -- combined, because short-circuit evaluation isn't guaranteed.
+        IF (TG_OP = 'UPDATE') THEN
+            IF (NEW.schema_id != OLD.schema_id OR NEW.item_date != OLD.item_date) THEN
+                INSERT INTO db_newsitemchange (schema_id, item_date) VALUES (OLD.schema_id, OLD.item_date);
+                INSERT INTO db_newsitemchange (schema_id, item_date) VALUES (NEW.schema_id, NEW.item_date);
+            END IF;
+        ELSIF (TG_OP = 'INSERT') THEN
+            INSERT INTO db_newsitemchange (schema_id, item_date) VALUES (NEW.schema_id, NEW.item_date);
+        ELSIF (TG_OP = 'DELETE') THEN
+            INSERT INTO db_newsitemchange (schema_id, item_date) VALUES (OLD.schema_id, OLD.item_date);
+        END IF;
+        RETURN NULL;
+    END;
+$newsitem_change_logger$ LANGUAGE plpgsql;
+
+CREATE TRIGGER newsitem_change_logger
+AFTER INSERT OR UPDATE OR DELETE ON db_newsitem
+    FOR EACH ROW EXECUTE PROCEDURE log_newsitem_change();
+
+-- NewsItemLocations are (re)created by the location_updater trigger when a
+-- NewsItem's location changes. If the NewsItem itself doesn't exist (yet or
+-- any more), nothing is logged here, because newsitem_change_logger logs it.
+CREATE OR REPLACE FUNCTION log_newsitemlocation_change() RETURNS TRIGGER AS $newsitemlocation_change_logger$
+    DECLARE
+        ni_id integer;
+    BEGIN
+        IF (TG_OP = 'DELETE') THEN
+            ni_id := OLD.news_item_id;
+        ELSE
+            ni_id := NEW.news_item_id;
+        END IF;
+        INSERT INTO db_newsitemchange (schema_id, item_date)
+        SELECT schema_id, item_date FROM db_newsitem WHERE id = ni_id;
+        RETURN NULL;
+    END;
+$newsitemlocation_change_logger$ LANGUAGE plpgsql;
+
+CREATE TRIGGER newsitemlocation_change_logger
+AFTER INSERT OR DELETE ON db_newsitemlocation
+    FOR EACH ROW EXECUTE PROCEDURE log_newsitemlocation_change();
+
+-- To delete:
+-- DROP TRIGGER newsitem_change_logger ON db_newsitem;
+-- DROP TRIGGER newsitemlocation_change_logger ON db_newsitemlocation;
+-- DROP FUNCTION log_newsitem_change();
+-- DROP FUNCTION log_newsitemlocation_change();
@@ -3,8 +3,12 @@ Unit tests for db app.
 """
 
 from django.test import TestCase
-from ebpub.db.models import NewsItem, Attribute
+from ebpub.db.models import NewsItem, NewsItemQuerySet, Attribute, AttributeDict, Lookup, Schema, SchemaField, field_mapping, field_mapping_stats
+from ebpub.db.models import _field_mapping_cache, FIELD_MAPPING_LOCAL_TIMEOUT
+from ebpub.db.utils import invalidate_homepage
+from ebpub.db.views import homepage_context, latest_newsitems_by_schema, latest_newsitems_by_day
 import datetime
+import pickle
 
 class ViewTestCase(TestCase):
     "Unit tests for views.py."
@@ -257,3 +261,391 @@ class DatabaseExtensionsTestCase(TestCase):
         ni.attributes['case_number'] = u'Hello'
         self.assertEquals(ni.attributes['case_number'], u'Hello')
         self.assertEquals(Attribute.objects.get(news_item__id=1).varchar01, u'Hello')
+
+    def testSearch(self):
+        # The trigger fills in search_vector when a NewsItem is saved.
+        install_sql('newsitem_functions.sql')
+        ni = NewsItem.objects.get(id=2)
+        ni.title = u'Burglary on Wabash'
+        ni.save()
+        self.assertEquals([ni.id for ni in NewsItem.objects.search('burglaries')], [2])
+        self.assertEquals(list(NewsItem.objects.search('burglary', schemas=[12345])), [])
+
+    def testSearchBlankQuery(self):
+        # The result is still a NewsItemQuerySet.
+        self.assertEquals(list(NewsItem.objects.search('   ').prefetch_attributes()), [])
+
+class PrefetchAttributesTestCase(TestCase):
+    "Unit tests for NewsItemQuerySet.prefetch_attributes()."
+    fixtures = ('crimes',)
+
+    def setUp(self):
+        schema = Schema.objects.get(id=1)
+        self.lookup_fields = dict([(sf.name, sf) for sf in schema.schemafield_set.filter(is_lookup=True)])
+        self.num_created = 0
+
+    def create_newsitems(self, count):
+        for i in range(self.num_created, self.num_created + count):
+            ni = NewsItem.objects.create(schema_id=1, title=u'Crime %s' % i, description=u'',
+                pub_date=datetime.datetime(2009, 1, 1), item_date=datetime.date(2009, 1, 1),
+                location_name=u'228 S. Wabash Ave.')
+            atts = {u'case_number': u'HX%s' % i, u'crime_date': datetime.date(2009, 1, 1)}
+            for name, sf in self.lookup_fields.items():
+                atts[name] = Lookup.objects.create(schema_field=sf, name=u'%s %s' % (name, i),
+                    code=str(i), slug='%s-%s' % (name.replace('_', '-'), i)).id
+            ni.attributes = atts
+        self.num_created += count
+
+    def count_queries(self):
+        """
+        Loads the prefetched NewsItems created by create_newsitems() and reads
+        all of their attributes. Returns the number of queries used.
+        """
+        from django.conf import settings
+        from django.db import connection
+        connection.queries = []
+        settings.DEBUG = True
+        try:
+            ni_list = list(NewsItem.objects.filter(title__startswith=u'Crime ').prefetch_attributes())
+            for ni in ni_list:
+                self.assertEquals(ni.attributes['case_number'], u'HX%s' % ni.title[6:])
+                self.assertEquals(ni.attribute_values['type_id'].name, u'type_id %s' % ni.title[6:])
+                for att in ni.attributes_for_template():
+                    att.value_list()
+            return len(connection.queries)
+        finally:
+            connection.queries = []
+            settings.DEBUG = False
+
+    def testQueriesDontGrowWithItems(self):
+        self.create_newsitems(2)
+        few = self.count_queries()
+        self.create_newsitems(8)
+        self.assertEquals(few, self.count_queries())
+
+    def testNumQueries(self):
+        # One for the NewsItems, plus SchemaFields, SchemaFieldInfos,
+        # Attributes and Lookups.
+        self.create_newsitems(5)
+        self.assertEquals(self.count_queries(), 5)
+
+    def testSameAsUnprefetched(self):
+        self.create_newsitems(3)
+        prefetched = NewsItem.objects.filter(title__startswith=u'Crime ').order_by('id').prefetch_attributes()
+        plain = NewsItem.objects.filter(title__startswith=u'Crime ').order_by('id')
+        for a, b in zip(prefetched, plain):
+            self.assertEquals(dict(a.attributes), dict([(k, b.attributes[k]) for k in b.attributes.mapping]))
+            self.assertEquals([x.value_list() for x in a.attributes_for_template()],
+                              [x.value_list() for x in b.attributes_for_template()])
+
+    def testPrefetchSurvivesClone(self):
+        qs = NewsItem.objects.prefetch_attributes().filter(schema__id=1).order_by('id')[:2]
+        self.assert_(qs._prefetch_attributes)
+        self.assertEquals(qs[0].attributes['case_number'], u'HM609859')
+
+class BulkCreateTestCase(TestCase):
+    "Unit tests for NewsItemManager.bulk_create()."
+    fixtures = ('crimes',)
+
+    def make_newsitems(self, prefix, count):
+        """
+        Returns a list of (unsaved NewsItem, attributes) pairs.
+        """
+        from django.contrib.gis.geos import Point
+        result = []
+        for i in range(count):
+            ni = NewsItem(schema_id=1, title=u'%s %s' % (prefix, i), description=u'Crime %s' % i, url=u'',
+                pub_date=datetime.datetime(2009, 1, 1), item_date=datetime.date(2009, 1, i + 1),
+                location_name=u'228 S. Wabash Ave.')
+            if i % 2:
+                ni.location = Point(-87.624, 41.879, srid=4326)
+            atts = {u'case_number': u'%s%s' % (prefix, i), u'crime_date': datetime.date(2009, 1, i + 1),
+                    u'arrests': bool(i % 2), u'beat_id': 214 + i}
+            result.append((ni, atts))
+        return result
+
+    def attribute_rows(self, ni_list):
+        rows = []
+        for ni in ni_list:
+            row = Attribute.objects.filter(news_item__id=ni.id).values()[0]
+            del row['news_item_id']
+            rows.append(row)
+        return rows
+
+    def testSameAsSavingOneByOne(self):
+        bulk = self.make_newsitems(u'Bulk', 3)
+        NewsItem.objects.bulk_create(bulk)
+        single = self.make_newsitems(u'Single', 3)
+        for ni, atts in single:
+            ni.save()
+            ni.attributes = atts
+
+        # Every NewsItem got a distinct, new ID.
+        ids = [ni.id for ni, atts in bulk]
+        self.assert_(None not in ids)
+        self.assertEquals(len(set(ids)), 3)
+        self.failIf(set(ids) & set([1, 2, 3]))
+
+        fields = ('schema', 'description', 'url', 'pub_date', 'item_date', 'location', 'location_name', 'location_object', 'block')
+        for (a, a_atts), (b, b_atts) in zip(bulk, single):
+            saved = NewsItem.objects.get(id=a.id)
+            self.assertEquals(saved.title, a.title)
+            for f in fields:
+                self.assertEquals(getattr(saved, f), getattr(NewsItem.objects.get(id=b.id), f))
+
+        bulk_rows = self.attribute_rows([ni for ni, atts in bulk])
+        single_rows = self.attribute_rows([ni for ni, atts in single])
+        for a, b in zip(bulk_rows, single_rows):
+            self.assertEquals(a['varchar01'][:4], u'Bulk')
+            self.assertEquals(b['varchar01'][:6], u'Single')
+            a['varchar01'] = b['varchar01'] = None
+            self.assertEquals(a, b)
+
+    def testAttributes(self):
+        bulk = self.make_newsitems(u'Bulk', 2)
+        NewsItem.objects.bulk_create(bulk)
+        for ni, atts in bulk:
+            saved = NewsItem.objects.get(id=ni.id)
+            self.assertEquals(saved.attributes['case_number'], atts['case_number'])
+            self.assertEquals(saved.attributes['beat_id'], atts['beat_id'])
+            self.assertEquals(saved.attributes['crime_time'], None)
+
+    def testEmpty(self):
+        before = NewsItem.objects.count()
+        NewsItem.objects.bulk_create([])
+        self.assertEquals(NewsItem.objects.count(), before)
+
+def install_sql(filename):
+    """
+    Runs one of the hand-run files in ebpub/db/sql, which Django doesn't
+    install in the test database.
+    """
+    import os
+    from django.db import connection
+    sql = open(os.path.join(os.path.dirname(__file__), 'sql', filename)).read()
+    connection.cursor().execute(sql)
+
+class ManyToManyLookupTestCase(TestCase):
+    "Unit tests for many-to-many lookups in by_attribute() and top_lookups()."
+    fixtures = ('crimes',)
+
+    def setUp(self):
+        install_sql('attribute_functions.sql')
+        self.sf = SchemaField.objects.create(schema_id=1, name='tags', real_name='varchar03',
+            pretty_name='Tag', pretty_name_plural='Tags', display=True, is_lookup=True,
+            is_filter=True, is_charted=False, is_searchable=False, display_order=9)
+        self.a, self.b, self.c = [Lookup.objects.create(schema_field=self.sf, name=code.upper(), code=code, slug=code)
+                                  for code in ('a', 'b', 'c')]
+        for ni_id, value in ((1, '%s,%s' % (self.a.id, self.b.id)), (2, str(self.b.id)), (3, '')):
+            ni = NewsItem.objects.get(id=ni_id)
+            ni.attributes = dict(ni.attributes, tags=value)
+
+    def assertIds(self, qs, ids):
+        self.assertEquals(sorted([ni.id for ni in qs]), ids)
+
+    def testByAttribute(self):
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, self.a.id), [1])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, self.b.id), [1, 2])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, self.c.id), [])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, [self.a.id, self.c.id]), [1])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, [str(self.a.id), str(self.b.id)]), [1, 2])
+
+    def testByAttributeLookupCode(self):
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, 'a', is_lookup=True), [1])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, ['b', 'c'], is_lookup=True), [1, 2])
+        self.assertIds(NewsItem.objects.by_attribute(self.sf, 'nonexistent', is_lookup=True), [])
+
+    def testByAttributeNonInteger(self):
+        self.assertRaises(ValueError, NewsItem.objects.by_attribute, self.sf, 'a')
+
+    def testTopLookups(self):
+        self.assertEquals(NewsItem.objects.top_lookups(self.sf, 10),
+                          [{'lookup': self.b, 'count': 2}, {'lookup': self.a, 'count': 1}])
+        self.assertEquals(NewsItem.objects.top_lookups(self.sf, 1), [{'lookup': self.b, 'count': 2}])
+        self.assertEquals(NewsItem.objects.filter(id=2).top_lookups(self.sf, 10), [{'lookup': self.b, 'count': 1}])
+
+class LatestNewsItemsTestCase(TestCase):
+    "Unit tests for latest_newsitems_by_schema() and latest_newsitems_by_day()."
+    fixtures = ('crimes',)
+
+    def setUp(self):
+        # The fixture's crimes were published on 2006-09-26 (1) and
+        # 2006-11-08 (2 and 3).
+        self.crime = Schema.objects.get(id=1)
+        self.crime.number_in_overview = 2
+        self.crime.save()
+        self.permits = Schema.objects.create(name='Permit', plural_name='Permits', indefinite_article='a',
+            slug='permits', min_date=datetime.date(2006, 1, 1), last_updated=datetime.date(2006, 11, 8),
+            date_name='Date', date_name_plural='Dates', importance=20, is_public=True, is_special_report=False,
+            can_collapse=False, has_newsitem_detail=False, allow_charting=False, uses_attributes_in_list=False,
+            number_in_overview=1)
+        self.p1 = self.create_newsitem(datetime.date(2006, 11, 1), datetime.datetime(2006, 11, 8, 12, 0))
+        self.p2 = self.create_newsitem(datetime.date(2006, 11, 5), datetime.datetime(2006, 11, 7, 12, 0))
+        self.p3 = self.create_newsitem(datetime.date(2006, 11, 4), datetime.datetime(2006, 11, 7, 13, 0))
+
+    def create_newsitem(self, item_date, pub_date):
+        return NewsItem.objects.create(schema=self.permits, title=u'Permit', description=u'',
+            pub_date=pub_date, item_date=item_date, location_name=u'228 S. Wabash Ave.')
+
+    def days(self, qs):
+        """
+        Returns a list of (pub_date_date, sorted NewsItem IDs) for the given
+        latest_newsitems_by_day() result, in its order.
+        """
+        result = []
+        for ni in qs:
+            if not result or result[-1][0] != ni.pub_date_date:
+                result.append((ni.pub_date_date, []))
+            result[-1][1].append(ni.id)
+        return [(day, sorted(ids)) for day, ids in result]
+
+    def testBySchema(self):
+        qs = latest_newsitems_by_schema(NewsItem.objects.all(), [self.crime, self.permits])
+        self.assertEquals([ni.id for ni in qs], [3, 2, self.p2.id])
+
+    def testBySchemaOnlyGivenSchemas(self):
+        qs = latest_newsitems_by_schema(NewsItem.objects.all(), [self.permits])
+        self.assertEquals([ni.id for ni in qs], [self.p2.id])
+
+    def testBySchemaFiltered(self):
+        qs = latest_newsitems_by_schema(NewsItem.objects.filter(id__in=[1, 2, self.p1.id]), [self.crime, self.permits])
+        self.assertEquals([ni.id for ni in qs], [2, self.p1.id, 1])
+
+    def testBySchemaNoSchemas(self):
+        qs = latest_newsitems_by_schema(NewsItem.objects.all(), [])
+        self.assert_(isinstance(qs, NewsItemQuerySet))
+        self.assertEquals(list(qs.prefetch_attributes()), [])
+
+    def testByDay(self):
+        qs = latest_newsitems_by_day(NewsItem.objects.all())
+        self.assertEquals(self.days(qs), [
+            (datetime.date(2006, 11, 8), [2, 3, self.p1.id]),
+            (datetime.date(2006, 11, 7), [self.p2.id, self.p3.id]),
+            (datetime.date(2006, 9, 26), [1]),
+        ])
+        # The more important schema comes first within a day.
+        self.assertEquals(list(qs)[0].id, self.p1.id)
+
+    def testByDayMaxDays(self):
+        qs = latest_newsitems_by_day(NewsItem.objects.all(), max_days=2)
+        self.assertEquals([day for day, ids in self.days(qs)], [datetime.date(2006, 11, 8), datetime.date(2006, 11, 7)])
+
+    def testByDayFullDay(self):
+        # The first day with more than max_items_per_day NewsItems is kept
+        # whole, and the days before it are dropped.
+        qs = latest_newsitems_by_day(NewsItem.objects.all(), max_items_per_day=2)
+        self.assertEquals(self.days(qs), [(datetime.date(2006, 11, 8), [2, 3, self.p1.id])])
+        qs = latest_newsitems_by_day(NewsItem.objects.filter(id__in=[1, 3, self.p2.id, self.p3.id]), max_items_per_day=1)
+        self.assertEquals(self.days(qs), [
+            (datetime.date(2006, 11, 8), [3]),
+            (datetime.date(2006, 11, 7), [self.p2.id, self.p3.id]),
+        ])
+
+    def testByDayLimit(self):
+        # Within a schema, the latest NewsItem comes first.
+        qs = latest_newsitems_by_day(NewsItem.objects.all(), day_limit=1)
+        self.assertEquals([ni.id for ni in qs], [self.p1.id, self.p3.id, 1])
+
+def count_queries(func, *args):
+    """
+    Calls func(*args). Returns its result and the number of database queries
+    it ran.
+    """
+    from django.conf import settings
+    from django.db import connection
+    connection.queries = []
+    settings.DEBUG = True
+    try:
+        result = func(*args)
+        return result, len(connection.queries)
+    finally:
+        connection.queries = []
+        settings.DEBUG = False
+
+class FieldMappingCacheTestCase(TestCase):
+    "Unit tests for the field_mapping() cache."
+    fixtures = ('crimes',)
+
+    def count_queries(self, func, *args):
+        return count_queries(func, *args)
+
+    def testCached(self):
+        mapping, num_queries = self.count_queries(field_mapping, [1])
+        self.assertEquals(mapping[1]['case_number'], 'varchar01')
+        hits = field_mapping_stats['hits']
+        mapping, num_queries = self.count_queries(field_mapping, [1])
+        self.assertEquals(num_queries, 0)
+        self.assertEquals(mapping[1]['case_number'], 'varchar01')
+        self.assertEquals(field_mapping_stats['hits'], hits + 1)
+
+    def testSaveInvalidates(self):
+        field_mapping([1])
+        sf = SchemaField.objects.get(schema__id=1, name='case_number')
+        sf.real_name = 'varchar03'
+        sf.save()
+        self.assertEquals(field_mapping([1])[1]['case_number'], 'varchar03')
+
+    def testDeleteInvalidates(self):
+        field_mapping([1])
+        SchemaField.objects.get(schema__id=1, name='status').delete()
+        self.failIf('status' in field_mapping([1])[1])
+
+    def testLocalTimeout(self):
+        field_mapping([1])
+        # update() doesn't send post_save, so only the timeout notices it.
+        SchemaField.objects.filter(schema__id=1, name='case_number').update(real_name='varchar03')
+        self.assertEquals(field_mapping([1])[1]['case_number'], 'varchar01')
+        version, loaded_at, mapping = _field_mapping_cache[1]
+        _field_mapping_cache[1] = (version, loaded_at - FIELD_MAPPING_LOCAL_TIMEOUT, mapping)
+        self.assertEquals(field_mapping([1])[1]['case_number'], 'varchar03')
+
+    def testResultIsCopied(self):
+        field_mapping([1])[1]['case_number'] = 'text01'
+        self.assertEquals(field_mapping([1])[1]['case_number'], 'varchar01')
+
+    def testSchemaWithoutFields(self):
+        self.assertEquals(field_mapping([12345]), {})
+
+class HomepageCacheTestCase(TestCase):
+    "Unit tests for the cached homepage fragments."
+    fixtures = ('crimes',)
+
+    def setUp(self):
+        # The fragments are only cached with a CACHE_BACKEND that's shared
+        # between processes. Within this process, locmem:// works the same.
+        from django.conf import settings
+        self.old_cache_backend = settings.CACHE_BACKEND
+        settings.CACHE_BACKEND = 'memcached://127.0.0.1:11211/'
+        invalidate_homepage()
+
+    def tearDown(self):
+        from django.conf import settings
+        settings.CACHE_BACKEND = self.old_cache_backend
+
+    def testCached(self):
+        context, num_queries = count_queries(homepage_context)
+        self.assert_(num_queries > 0)
+        cached_context, num_queries = count_queries(homepage_context)
+        self.assertEquals(num_queries, 0)
+        self.assertEquals(sorted(cached_context.keys()), sorted(context.keys()))
+        self.assertEquals(cached_context['street_count'], context['street_count'])
+
+    def testInvalidate(self):
+        homepage_context()
+        invalidate_homepage()
+        context, num_queries = count_queries(homepage_context)
+        self.assert_(num_queries > 0)
+
+    def testNotCachedWithoutSharedBackend(self):
+        from django.conf import settings
+        settings.CACHE_BACKEND = 'locmem://'
+        homepage_context()
+        context, num_queries = count_queries(homepage_context)
+        self.assert_(num_queries > 0)
+
+    def testPickledAttributeDict(self):
+        # Unpickling an AttributeDict mustn't write to the database.
+        atts = AttributeDict(1, 1, {'case_number': 'varchar01'}, {'case_number': u'HM609859'})
+        atts, num_queries = count_queries(pickle.loads, pickle.dumps(atts, pickle.HIGHEST_PROTOCOL))
+        self.assertEquals(num_queries, 0)
+        self.assertEquals(atts['case_number'], u'HM609859')
@@ -1,5 +1,12 @@
 from django.conf import settings
+from django.core.cache import cache
 import datetime
+import time
+
+# The version of the cached homepage components (see homepage() in
+# ebpub/db/views.py), which changes whenever the data behind them does.
+HOMEPAGE_VERSION_KEY = 'ebpub_db_homepage_version'
+HOMEPAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 2
 
 def smart_bunches(newsitem_list, max_days=5, max_items_per_day=100):
     """
@@ -40,12 +47,90 @@ def smart_bunches(newsitem_list, max_days=5, max_items_per_day=100):
             del newsitem_list[end_index:]
     return newsitem_list
 
+def lookup_ids(value):
+    """
+    Returns a list of the Lookup IDs in the given raw Attribute value of a
+    lookup SchemaField, which is either a Lookup ID or, for many-to-many
+    lookups, a comma-separated string of Lookup IDs.
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, (int, long)):
+        return [value]
+    try:
+        return [int(i) for i in value.split(',') if i]
+    except ValueError:
+        return []
+
+def populate_attributes(newsitem_list):
+    """
+    Helper function that loads the attributes of every NewsItem in
+    newsitem_list, and every Lookup they refer to, with four database queries,
+    no matter how many NewsItems there are. For each NewsItem, this sets:
+
+        * ni.attribute_values, as described in populate_attributes_if_needed().
+        * ni.attributes, so that reading it doesn't query the database.
+        * Everything ni.attributes_for_template() needs, so that it doesn't
+          query the database either.
+
+    Note that the list is edited in place; there is no return value.
+    """
+    from ebpub.db.models import Attribute, AttributeDict, Lookup, SchemaField, SchemaFieldInfo
+    if not newsitem_list:
+        return
+    schema_ids = list(set([ni.schema_id for ni in newsitem_list]))
+
+    # schema_fields = {schema_id: [SchemaField, ...]}, ordered by display_order.
+    schema_fields = {}
+    attribute_columns_to_select = set(['news_item'])
+    for sf in SchemaField.objects.filter(schema__id__in=schema_ids).select_related().order_by('display_order'):
+        schema_fields.setdefault(sf.schema_id, []).append(sf)
+        attribute_columns_to_select.add(str(sf.real_name))
+
+    # field_infos = {schema_id: {schema_field_id: help_text}}
+    field_infos = {}
+    for info in SchemaFieldInfo.objects.filter(schema__id__in=schema_ids):
+        field_infos.setdefault(info.schema_id, {})[info.schema_field_id] = info.help_text
+
+    att_dict = dict([(i['news_item'], i) for i in Attribute.objects.filter(news_item__id__in=[ni.id for ni in newsitem_list]).values(*list(attribute_columns_to_select))])
+
+    # Retrieve only the Lookups that are referenced in newsitem_list.
+    ids = set()
+    for ni in newsitem_list:
+        att = att_dict.get(ni.id)
+        if att is not None:
+            for sf in schema_fields.get(ni.schema_id, []):
+                if sf.is_lookup:
+                    ids.update(lookup_ids(att[sf.real_name]))
+    if ids:
+        lookup_objs = Lookup.objects.in_bulk(list(ids))
+    else:
+        lookup_objs = {}
+
+    for ni in newsitem_list:
+        sfs = schema_fields.get(ni.schema_id, [])
+        att = att_dict.get(ni.id)
+        att_values = {}
+        raw_values = {}
+        if att is not None:
+            for sf in sfs:
+                value = raw_values[sf.name] = att[sf.real_name]
+                if sf.is_lookup:
+                    if sf.real_name.startswith('int'):
+                        value = lookup_objs.get(value)
+                    else: # Many-to-many lookups are comma-separated strings.
+                        value = [lookup_objs[i] for i in lookup_ids(value) if i in lookup_objs]
+                att_values[sf.name] = value
+        ni.attribute_values = att_values
+        ni._attributes_cache = AttributeDict(ni.id, ni.schema_id, dict([(sf.name, sf.real_name) for sf in sfs]), raw_values)
+        ni._attributes_for_template_cache = (sfs, att, field_infos.get(ni.schema_id, {}), lookup_objs)
+
 def populate_attributes_if_needed(newsitem_list, schema_list):
     """
     Helper function that takes a list of NewsItems and sets ni.attribute_values
     to a dictionary of attributes {field_name: value} for all NewsItems whose
     schemas have uses_attributes_in_list=True. This is accomplished with a
-    minimal amount of database queries.
+    minimal amount of database queries, using populate_attributes().
 
     The values in the attribute_values dictionary are Lookup instances in the
     case of Lookup fields. Otherwise, they're the direct values from the
@@ -56,7 +141,6 @@ def populate_attributes_if_needed(newsitem_list, schema_list):
 
     Note that the list is edited in place; there is no return value.
     """
-    from ebpub.db.models import Attribute, Lookup, SchemaField
     # To accomplish this, we determine which NewsItems in ni_list require
     # attribute prepopulation, and run a single DB query that loads all of the
     # attributes. Another way to do this would be to load all of the attributes
@@ -65,50 +149,7 @@ def populate_attributes_if_needed(newsitem_list, schema_list):
     preload_schema_ids = set([s.id for s in schema_list if s.uses_attributes_in_list])
     if not preload_schema_ids:
         return
-    preloaded_nis = [ni for ni in newsitem_list if ni.schema_id in preload_schema_ids]
-    if not preloaded_nis:
-        return
-    # fmap = {schema_id: {'fields': [(name, real_name)], 'lookups': [real_name1, real_name2]}}
-    fmap = {}
-    attribute_columns_to_select = set(['news_item'])
-    for sf in SchemaField.objects.filter(schema__id__in=[s.id for s in schema_list]).values('schema', 'name', 'real_name', 'is_lookup'):
-        fmap.setdefault(sf['schema'], {'fields': [], 'lookups': []})['fields'].append((sf['name'], sf['real_name']))
-        if sf['is_lookup']:
-            fmap[sf['schema']]['lookups'].append(sf['real_name'])
-        attribute_columns_to_select.add(str(sf['real_name']))
-
-    att_dict = dict([(i['news_item'], i) for i in Attribute.objects.filter(news_item__id__in=[ni.id for ni in preloaded_nis]).values(*list(attribute_columns_to_select))])
-
-    # Determine which Lookup objects need to be retrieved.
-    lookup_ids = set()
-    for ni in preloaded_nis:
-        for real_name in fmap[ni.schema_id]['lookups']:
-            value = att_dict[ni.id][real_name]
-            if ',' in str(value):
-                lookup_ids.update(value.split(','))
-            else:
-                lookup_ids.add(value)
-
-    # Retrieve only the Lookups that are referenced in preloaded_nis.
-    lookup_ids = [i for i in lookup_ids if i]
-    if lookup_ids:
-        lookup_objs = Lookup.objects.in_bulk(lookup_ids)
-    else:
-        lookup_objs = {}
-
-    # Set 'attribute_values' for each NewsItem in preloaded_nis.
-    for ni in preloaded_nis:
-        att = att_dict[ni.id]
-        att_values = {}
-        for field_name, real_name in fmap[ni.schema_id]['fields']:
-            value = att[real_name]
-            if real_name in fmap[ni.schema_id]['lookups']:
-                if real_name.startswith('int'):
-                    value = lookup_objs[value]
-                else: # Many-to-many lookups are comma-separated strings.
-                    value = [lookup_objs[int(i)] for i in value.split(',') if i]
-            att_values[field_name] = value
-        ni.attribute_values = att_values
+    populate_attributes([ni for ni in newsitem_list if ni.schema_id in preload_schema_ids])
 
 def populate_schema(newsitem_list, schema):
     for ni in newsitem_list:
@@ -119,3 +160,23 @@ def today():
     if settings.EB_TODAY_OVERRIDE:
         return settings.EB_TODAY_OVERRIDE
     return datetime.date.today()
+
+def homepage_version():
+    """
+    Returns the current version of the cached homepage components, starting
+    a new one if the cache has lost it.
+    """
+    version = cache.get(HOMEPAGE_VERSION_KEY)
+    if version is None:
+        version = invalidate_homepage()
+    return version
+
+def invalidate_homepage():
+    """
+    Starts a new version of the cached homepage components, so that they're
+    recomputed from the current data. This is called after every scrape and
+    aggregate update. Returns the new version.
+    """
+    version = repr(time.time())
+    cache.set(HOMEPAGE_VERSION_KEY, version, HOMEPAGE_CACHE_TIMEOUT)
+    return version
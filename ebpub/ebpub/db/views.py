@@ -12,7 +12,8 @@ from ebgeo.utils.clustering.json import ClusterJSON
 from ebpub.db import constants
 from ebpub.db.models import NewsItem, Schema, SchemaInfo, SchemaField, Lookup, LocationType, Location, SearchSpecialCase
 from ebpub.db.models import AggregateDay, AggregateLocation, AggregateLocationDay, AggregateFieldLookup
-from ebpub.db.utils import smart_bunches, populate_attributes_if_needed, populate_schema, today
+from ebpub.db.utils import populate_attributes_if_needed, populate_schema, today
+from ebpub.db.utils import homepage_version, HOMEPAGE_CACHE_TIMEOUT
 from ebpub.utils.dates import daterange, parse_date
 from ebpub.geocoder import SmartGeocoder, AmbiguousResult, DoesNotExist, GeocodingException, InvalidBlockButValidStreet
 from ebpub.geocoder.parser.parsing import normalize, ParsingError
@@ -20,6 +21,7 @@ from ebpub.preferences.models import HiddenSchema
 from ebpub.savedplaces.models import SavedPlace
 from ebpub.streets.models import Street, City, Block, Intersection
 from ebpub.streets.utils import full_geocode
+from ebpub.utils.cache import cache_is_shared
 from ebpub.utils.view_utils import eb_render
 from ebpub.metros.allmetros import METRO_DICT, get_metro
 import datetime
@@ -199,6 +201,263 @@ def make_search_buffer(geom, block_radius):
     """
     return geom.buffer(BLOCK_RADIUS_CHOICES[str(block_radius)]).envelope
 
+def filter_by_block(qs, block, block_radius):
+    """
+    Filters a NewsItem QuerySet to the NewsItems within block_radius blocks
+    of the given Block.
+
+    If settings.BLOCK_PROXIMITY_ENABLED is True, this looks them up in the
+    BlockNewsItem table instead of running a spatial query against a search
+    buffer.
+    """
+    if getattr(settings, 'BLOCK_PROXIMITY_ENABLED', False):
+        return qs.filter(blocknewsitem__block__id=block.id, blocknewsitem__radius=int(block_radius))
+    return qs.filter(location__bboverlaps=make_search_buffer(block.location.centroid, block_radius))
+
+def latest_newsitems_by_schema(newsitem_qs, schemas):
+    """
+    Returns a QuerySet of the latest NewsItems in newsitem_qs for each of
+    the given Schemas -- up to Schema.number_in_overview of each -- ordered
+    by descending item_date and ID.
+
+    This takes a single query: a window function numbers each schema's
+    NewsItems within newsitem_qs, which can use the spatial index or the
+    NewsItemLocation index, and only the first number_in_overview are kept.
+    Requires PostgreSQL 8.4 or later.
+    """
+    if not schemas:
+        # Not NewsItem.objects.none(), so that the result is a
+        # NewsItemQuerySet either way (see NewsItemQuerySet.by_attribute()).
+        empty = NewsItem.objects.all()
+        empty.query.extra_where += ('1=0',)
+        return empty
+    windowed = newsitem_qs.filter(schema__id__in=[s.id for s in schemas]).extra(
+        select={'schema_position': 'row_number() OVER (PARTITION BY db_newsitem.schema_id ORDER BY db_newsitem.item_date DESC, db_newsitem.id DESC)'})
+    windowed_sql, params = windowed.values('id', 'schema_id', 'schema_position').query.as_sql()
+    return NewsItem.objects.extra(where=["""
+        db_newsitem.id IN (
+            SELECT windowed.id
+            FROM (%s) AS windowed, db_schema
+            WHERE db_schema.id = windowed.schema_id
+                AND windowed.schema_position <= db_schema.number_in_overview
+        )""" % windowed_sql], params=params).order_by('-item_date', '-id')
+
+def latest_newsitems_by_day(newsitem_qs, max_days=5, max_items_per_day=100, day_limit=constants.NUM_NEWS_ITEMS_PLACE_DETAIL):
+    """
+    Returns a QuerySet of the NewsItems in newsitem_qs, grouped by the date
+    of pub_date, that place_detail displays:
+
+        * The latest max_days days that have any NewsItems.
+        * If a day has more than max_items_per_day NewsItems, no earlier
+          days.
+        * At most day_limit NewsItems per day, the most important schemas
+          first.
+
+    Each NewsItem has a pub_date_date attribute, and they're ordered by
+    descending pub_date_date and schema importance. Unlike taking the latest
+    N NewsItems and passing them to smart_bunches(), this never drops a day
+    because it didn't fit in the list. It takes a single query, with window
+    functions (PostgreSQL 8.4 or later).
+    """
+    windowed = newsitem_qs.extra(select={
+        'day_rank': 'dense_rank() OVER (ORDER BY date(db_newsitem.pub_date) DESC)',
+        'day_count': 'count(*) OVER (PARTITION BY date(db_newsitem.pub_date))',
+        'day_position': 'row_number() OVER (PARTITION BY date(db_newsitem.pub_date) ORDER BY db_schema.importance DESC, db_newsitem.schema_id, db_newsitem.id DESC)',
+    })
+    # Selecting schema__importance joins db_schema for day_position.
+    windowed_sql, windowed_params = windowed.values('id', 'schema__importance', 'day_rank', 'day_count', 'day_position').query.as_sql()
+    params = (max_items_per_day,) + tuple(windowed_params) + (max_days, max_days, day_limit)
+    return NewsItem.objects.select_related().extra(
+        select={'pub_date_date': 'date(db_newsitem.pub_date)'},
+        where=["""
+            db_newsitem.id IN (
+                SELECT days.id
+                FROM (
+                    SELECT windowed.id, windowed.day_rank, windowed.day_position,
+                        min(CASE WHEN windowed.day_count > %%s THEN windowed.day_rank END) OVER () AS last_day_rank
+                    FROM (%s) AS windowed
+                ) AS days
+                WHERE days.day_rank <= %%s
+                    AND days.day_rank <= COALESCE(days.last_day_rank, %%s)
+                    AND days.day_position <= %%s
+            )""" % windowed_sql],
+        params=params,
+        order_by=('-pub_date_date', '-schema__importance', 'schema'),
+    )
+
+# The homepage is assembled from components that are expensive to compute, so
+# each one is cached as a fragment, keyed by the homepage version (see
+# invalidate_homepage() in ebpub/db/utils.py) and the date. The version
+# changes after every scrape and aggregate update, so the fragments are never
+# staler than the data. bin/refresh_homepage.py computes them in the
+# background; a request only computes a fragment that isn't cached.
+#
+# The version is changed by the scrapers and update_aggregates, in other
+# processes, so the fragments are only cached if CACHE_BACKEND is shared
+# between processes. Otherwise, every request computes the homepage.
+
+def homepage_locations(start_date, end_date):
+    # Order by slug to ensure case-insensitive ordering. (Kind of hackish.)
+    lt_list = LocationType.objects.filter(is_significant=True).order_by('slug').extra(select={'count': 'select count(*) from db_location where is_public=True and location_type_id=db_locationtype.id'})
+    return {
+        'location_type_list': list(lt_list),
+        'street_count': Street.objects.count(),
+        'more_schemas': list(Schema.public_objects.filter(allow_charting=False).order_by('name')),
+    }
+
+def split_date_charts(date_charts):
+    """
+    Splits the given date charts into a list of non-empty charts, biggest
+    first, and a list of empty charts, by name. Returns (non_empty, empty).
+    """
+    empty_date_charts, non_empty_date_charts = [], []
+    for chart in date_charts:
+        if chart['total_count']:
+            non_empty_date_charts.append(chart)
+        else:
+            empty_date_charts.append(chart)
+    non_empty_date_charts.sort(lambda a, b: cmp(b['total_count'], a['total_count']))
+    empty_date_charts.sort(lambda a, b: cmp(a['schema'].plural_name, b['schema'].plural_name))
+    return non_empty_date_charts, empty_date_charts
+
+def homepage_public_records(start_date, end_date):
+    sparkline_schemas = list(Schema.public_objects.filter(allow_charting=True, is_special_report=False))
+    date_charts = get_date_chart_agg_model(sparkline_schemas, start_date, end_date, AggregateDay)
+    non_empty_date_charts, empty_date_charts = split_date_charts(date_charts)
+    try:
+        num_articles = [s for s in date_charts if s['schema'].slug == 'news-articles'][0]['total_count']
+    except IndexError:
+        num_articles = 0
+    return {
+        'non_empty_date_charts': non_empty_date_charts,
+        'empty_date_charts': empty_date_charts,
+        'num_articles': num_articles,
+    }
+
+def homepage_news_articles(start_date, end_date):
+    ni_list = list(NewsItem.objects.select_related().filter(schema__slug='news-articles', item_date__gt=start_date).order_by('-item_date')[:100])
+    if ni_list:
+        populate_schema(ni_list, ni_list[0].schema)
+        populate_attributes_if_needed(ni_list, [ni_list[0].schema])
+    article_bunches = cluster_newsitems(ni_list, 26)
+    return {
+        'newsitem_list': ni_list,
+        'all_bunches': simplejson.dumps(article_bunches, cls=ClusterJSON),
+    }
+
+def homepage_featured_neighborhood(start_date, end_date):
+    # This automatically chooses a neighborhood with at least 2 recent news
+    # articles. The choice is cached along with the rest of this fragment, so
+    # it changes with every new version of the homepage.
+    neighborhoods_with_articles = AggregateLocationDay.objects.filter(
+        schema__slug='news-articles', location_type__slug='neighborhoods', total__gte=2,
+        date_part__gte=end_date - datetime.timedelta(days=7),
+        date_part__lt=end_date + datetime.timedelta(days=1))
+
+    if neighborhoods_with_articles:
+        # First try neighborhoods with 4 or more articles. Fall back to any
+        # neighborhood with at least 2 articles.
+        fn_ids = [x.location_id for x in neighborhoods_with_articles if x.total >= 4]
+        if not fn_ids:
+            fn_ids = [x.location_id for x in neighborhoods_with_articles]
+        fn = Location.objects.get(id=random.choice(fn_ids))
+    else:
+        # If no neighborhoods have articles, just pick a random neighborhood.
+        try:
+            fn = Location.objects.filter(location_type__slug='neighborhoods', is_public=True)[0]
+        except IndexError:
+            # If no neighborhoods have been added to the DB yet, that's fine.
+            fn = None
+
+    if fn is None:
+        return {
+            'featured_neighborhood': None,
+            'featured_neighborhood_articles': None,
+            'featured_neighborhood_article_count': None,
+            'fn_non_empty_date_charts': None,
+            'fn_empty_date_charts': None,
+        }
+
+    # Get the featured neighborhood news articles.
+    qs = NewsItem.objects.filter(schema__slug='news-articles', newsitemlocation__location__id=fn.id, item_date__gte=start_date, item_date__lte=end_date)
+    fn_article_count = qs.count()
+    fn_all_articles = list(qs.select_related().order_by('-item_date')[:10])
+    fn_articles = []
+    if fn_all_articles:
+        populate_attributes_if_needed(fn_all_articles, [fn_all_articles[0].schema])
+        # Remove any articles whose headlines, excerpts or sources are duplicate.
+        headlines, excerpts, sources = set(), set(), set()
+        for a in fn_all_articles:
+            # Calculate a hash of the excerpt by removing spaces. We use this
+            # for duplicate comparison.
+            excerpt_hash = re.sub(r'\s', '', a.attribute_values['excerpt'])
+            if a.title not in headlines and excerpt_hash not in excerpts and a.attribute_values['source'].name not in sources:
+                headlines.add(a.title)
+                excerpts.add(excerpt_hash)
+                sources.add(a.attribute_values['source'].name)
+                fn_articles.append(a)
+                if len(fn_articles) == 3:
+                    break
+
+    # Get the featured neighborhood public records.
+    sparkline_schemas = list(Schema.public_objects.filter(allow_charting=True, is_special_report=False))
+    fn_date_charts = get_date_chart_agg_model(sparkline_schemas, start_date, end_date, AggregateLocationDay, kwargs={'location__id': fn.id})
+    fn_non_empty_date_charts, fn_empty_date_charts = split_date_charts(fn_date_charts)
+    return {
+        'featured_neighborhood': fn,
+        'featured_neighborhood_articles': fn_articles,
+        'featured_neighborhood_article_count': fn_article_count,
+        'fn_non_empty_date_charts': fn_non_empty_date_charts,
+        'fn_empty_date_charts': fn_empty_date_charts,
+    }
+
+HOMEPAGE_COMPONENTS = (
+    ('locations', homepage_locations),
+    ('public_records', homepage_public_records),
+    ('news_articles', homepage_news_articles),
+    ('featured_neighborhood', homepage_featured_neighborhood),
+)
+
+def homepage_fragment_key(name, version, date):
+    return 'ebpub_db_homepage_%s_%s_%s' % (name, version, date.isoformat())
+
+def homepage_context(refresh=False):
+    """
+    Returns the template context for the homepage, using the cached fragments
+    for the current version and computing (and caching) the ones that are
+    missing. If refresh is True, all fragments are recomputed.
+
+    If CACHE_BACKEND isn't shared between processes, nothing is cached.
+    """
+    end_date = today()
+    start_date = end_date - datetime.timedelta(days=30)
+    if not cache_is_shared():
+        context = {}
+        for name, func in HOMEPAGE_COMPONENTS:
+            context.update(func(start_date, end_date))
+        return context
+    version = homepage_version()
+    keys = [homepage_fragment_key(name, version, end_date) for name, func in HOMEPAGE_COMPONENTS]
+    fragments = {}
+    if not refresh:
+        fragments = cache.get_many(keys)
+    context = {}
+    for key, (name, func) in zip(keys, HOMEPAGE_COMPONENTS):
+        try:
+            fragment = fragments[key]
+        except KeyError:
+            fragment = func(start_date, end_date)
+            cache.set(key, fragment, HOMEPAGE_CACHE_TIMEOUT)
+        context.update(fragment)
+    return context
+
+def refresh_homepage():
+    """
+    Recomputes and caches all of the homepage fragments. Does nothing useful
+    unless CACHE_BACKEND is shared between processes.
+    """
+    homepage_context(refresh=True)
+
 ##############
 # AJAX VIEWS #
 ##############
@@ -289,8 +548,7 @@ def ajax_place_newsitems(request):
         raise Http404('Invalid Schema')
     place, block_radius, xy_radius = parse_pid(request.GET.get('pid', ''))
     if isinstance(place, Block):
-        search_buffer = make_search_buffer(place.location.centroid, block_radius)
-        newsitem_qs = NewsItem.objects.filter(location__bboverlaps=search_buffer)
+        newsitem_qs = filter_by_block(NewsItem.objects.all(), place, block_radius)
     else:
         newsitem_qs = NewsItem.objects.filter(newsitemlocation__location__id=place.id)
 
@@ -313,8 +571,7 @@ def ajax_place_lookup_chart(request):
     qs = NewsItem.objects.filter(schema__id=sf.schema.id)
     filter_url = place.url()[1:]
     if isinstance(place, Block):
-        search_buffer = make_search_buffer(place.location.centroid, block_radius)
-        qs = qs.filter(location__bboverlaps=search_buffer)
+        qs = filter_by_block(qs, place, block_radius)
         filter_url += radius_url(block_radius) + '/'
     else:
         qs = qs.filter(newsitemlocation__location__id=place.id)
@@ -339,8 +596,7 @@ def ajax_place_date_chart(request):
     qs = NewsItem.objects.filter(schema__id=s.id)
     filter_url = place.url()[1:]
     if isinstance(place, Block):
-        search_buffer = make_search_buffer(place.location.centroid, block_radius)
-        qs = qs.filter(location__bboverlaps=search_buffer)
+        qs = filter_by_block(qs, place, block_radius)
         filter_url += radius_url(block_radius) + '/'
     else:
         qs = qs.filter(newsitemlocation__location__id=place.id)
@@ -386,111 +642,7 @@ def ajax_location(request, loc_id):
 #########
 
 def homepage(request):
-    end_date = today()
-    start_date = end_date - datetime.timedelta(days=30)
-
-    sparkline_schemas = list(Schema.public_objects.filter(allow_charting=True, is_special_report=False))
-
-    # Order by slug to ensure case-insensitive ordering. (Kind of hackish.)
-    lt_list = LocationType.objects.filter(is_significant=True).order_by('slug').extra(select={'count': 'select count(*) from db_location where is_public=True and location_type_id=db_locationtype.id'})
-    street_count = Street.objects.count()
-    more_schemas = Schema.public_objects.filter(allow_charting=False).order_by('name')
-
-    # Get the public records.
-    date_charts = get_date_chart_agg_model(sparkline_schemas, start_date, end_date, AggregateDay)
-    empty_date_charts, non_empty_date_charts = [], []
-    for chart in date_charts:
-        if chart['total_count']:
-            non_empty_date_charts.append(chart)
-        else:
-            empty_date_charts.append(chart)
-    non_empty_date_charts.sort(lambda a, b: cmp(b['total_count'], a['total_count']))
-    empty_date_charts.sort(lambda a, b: cmp(a['schema'].plural_name, b['schema'].plural_name))
-
-    # Get the news articles.
-    ni_list = NewsItem.objects.select_related().filter(schema__slug='news-articles', item_date__gt=start_date).order_by('-item_date')[:100]
-    if ni_list:
-        populate_schema(ni_list, ni_list[0].schema)
-        populate_attributes_if_needed(ni_list, [ni_list[0].schema])
-
-    article_bunches = cluster_newsitems(ni_list, 26)
-    try:
-        num_articles = [s for s in date_charts if s['schema'].slug == 'news-articles'][0]['total_count']
-    except IndexError:
-        num_articles = 0
-
-    # Get the featured neighborhood.
-    # This automatically chooses a neighborhood with at least 2 recent news articles.
-    neighborhoods_with_articles = AggregateLocationDay.objects.filter(
-        schema__slug='news-articles', location_type__slug='neighborhoods', total__gte=2,
-        date_part__gte=end_date - datetime.timedelta(days=7),
-        date_part__lt=end_date + datetime.timedelta(days=1))
-
-    if neighborhoods_with_articles:
-        # First try neighborhoods with 4 or more articles. Fall back to any
-        # neighborhood with at least 2 articles.
-        fn_ids = [x.location_id for x in neighborhoods_with_articles if x.total >= 4]
-        if not fn_ids:
-            fn_ids = [x.location_id for x in neighborhoods_with_articles]
-        fn = Location.objects.get(id=random.choice(fn_ids))
-    else:
-        # If no neighborhoods have articles, just pick a random neighborhood.
-        try:
-            fn = Location.objects.filter(location_type__slug='neighborhoods', is_public=True)[0]
-        except IndexError:
-            # If no neighborhoods have been added to the DB yet, that's fine.
-            fn = None
-
-    if fn is not None:
-        # Get the featured neighborhood news articles.
-        qs = NewsItem.objects.filter(schema__slug='news-articles', newsitemlocation__location__id=fn.id, item_date__gte=start_date, item_date__lte=end_date)
-        fn_article_count = qs.count()
-        fn_all_articles = list(qs.select_related().order_by('-item_date')[:10])
-        fn_articles = []
-        if fn_all_articles:
-            populate_attributes_if_needed(fn_all_articles, [fn_all_articles[0].schema])
-            # Remove any articles whose headlines, excerpts or sources are duplicate.
-            headlines, excerpts, sources = set(), set(), set()
-            for a in fn_all_articles:
-                # Calculate a hash of the excerpt by removing spaces. We use this
-                # for duplicate comparison.
-                excerpt_hash = re.sub(r'\s', '', a.attribute_values['excerpt'])
-                if a.title not in headlines and excerpt_hash not in excerpts and a.attribute_values['source'].name not in sources:
-                    headlines.add(a.title)
-                    excerpts.add(excerpt_hash)
-                    sources.add(a.attribute_values['source'].name)
-                    fn_articles.append(a)
-                    if len(fn_articles) == 3:
-                        break
-
-        # Get the featured neighborhood public records.
-        fn_date_charts = get_date_chart_agg_model(sparkline_schemas, start_date, end_date, AggregateLocationDay, kwargs={'location__id': fn.id})
-        fn_empty_date_charts, fn_non_empty_date_charts = [], []
-        for chart in fn_date_charts:
-            if chart['total_count']:
-                fn_non_empty_date_charts.append(chart)
-            else:
-                fn_empty_date_charts.append(chart)
-        fn_non_empty_date_charts.sort(lambda a, b: cmp(b['total_count'], a['total_count']))
-        fn_empty_date_charts.sort(lambda a, b: cmp(a['schema'].plural_name, b['schema'].plural_name))
-    else:
-        fn_articles = fn_article_count = fn_non_empty_date_charts = fn_empty_date_charts = None
-
-    return eb_render(request, 'homepage.html', {
-        'location_type_list': lt_list,
-        'street_count': street_count,
-        'all_bunches': simplejson.dumps(article_bunches, cls=ClusterJSON),
-        'newsitem_list': ni_list,
-        'more_schemas': more_schemas,
-        'featured_neighborhood': fn,
-        'featured_neighborhood_articles': fn_articles,
-        'featured_neighborhood_article_count': fn_article_count,
-        'num_articles': num_articles,
-        'non_empty_date_charts': non_empty_date_charts,
-        'empty_date_charts': empty_date_charts,
-        'fn_non_empty_date_charts': fn_non_empty_date_charts,
-        'fn_empty_date_charts': fn_empty_date_charts,
-    })
+    return eb_render(request, 'homepage.html', homepage_context())
 
 def search(request, schema_slug=''):
     "Performs a location search and redirects to the address/xy page."
@@ -929,8 +1081,7 @@ def schema_filter(request, slug, urlbits):
             block_radius = m.group(1)
             if block_radius not in BLOCK_RADIUS_CHOICES:
                 raise Http404('Invalid block radius')
-            search_buffer = make_search_buffer(block.location.centroid, block_radius)
-            qs = qs.filter(location__bboverlaps=search_buffer)
+            qs = filter_by_block(qs, block, block_radius)
             value = '%s block%s around %s' % (block_radius, (block_radius != '1' and 's' or ''), block.pretty_name)
             filters['location'] = {
                 'name': 'location',
@@ -1126,7 +1277,7 @@ def place_detail(request, *args, **kwargs):
     elif isinstance(place, Block):
         xy_radius, block_radius, cookies_to_set = block_radius_value(request)
         search_buf = make_search_buffer(place.location.centroid, block_radius)
-        newsitem_qs = NewsItem.objects.filter(location__bboverlaps=search_buf)
+        newsitem_qs = filter_by_block(NewsItem.objects.all(), place, block_radius)
         nearby_locations = list(Location.objects.filter(location_type__is_significant=True, location__bboverlaps=search_buf).select_related())
         bbox = search_buf.extent
         saved_place_lookup = {'block__id': place.id}
@@ -1159,14 +1310,10 @@ def place_detail(request, *args, **kwargs):
         # As an optimization, limit the NewsItems to those published in the
         # last few days.
         start_date = end_date - datetime.timedelta(days=constants.LOCATION_DAY_OPTIMIZATION)
-        ni_list = newsitem_qs.filter(pub_date__gt=start_date-datetime.timedelta(days=1), pub_date__lt=end_date+datetime.timedelta(days=1)).select_related()
+        ni_list = newsitem_qs.filter(pub_date__gt=start_date-datetime.timedelta(days=1), pub_date__lt=end_date+datetime.timedelta(days=1))
         if not has_staff_cookie(request):
             ni_list = ni_list.filter(schema__is_public=True)
-        ni_list = ni_list.extra(
-            select={'pub_date_date': 'date(db_newsitem.pub_date)'},
-            order_by=('-pub_date_date', '-schema__importance', 'schema')
-        )[:constants.NUM_NEWS_ITEMS_PLACE_DETAIL]
-        ni_list = smart_bunches(list(ni_list), max_days=5, max_items_per_day=100)
+        ni_list = list(latest_newsitems_by_day(ni_list, max_days=5, max_items_per_day=100))
         schemas_used = list(set([ni.schema for ni in ni_list]))
         s_list = schema_manager.filter(is_special_report=False, allow_charting=True).order_by('plural_name')
         populate_attributes_if_needed(ni_list, schemas_used)
@@ -1191,30 +1338,16 @@ def place_detail(request, *args, **kwargs):
         template_name = 'db/place_detail.html'
     else:
         # Here, the goal is to get the latest nearby NewsItems for each
-        # schema. A naive way to do this would be to run the query once for
-        # each schema, but we improve on that by grabbing the latest 300
-        # items of ANY schema and hoping that several of the schemas include
-        # all of their recent items in that list. Then, for any remaining
-        # schemas, we do individual queries as a last resort.
-        # Note that we iterate over the 300 NewsItems as the outer loop rather
-        # than iterating over the schemas as the outer loop, because there are
-        # many more NewsItems than schemas.
-        s_list = SortedDict([(s.id, [s, [], 0]) for s in schema_manager.filter(is_special_report=False).order_by('plural_name')])
-        needed = set(s_list.keys())
-        for ni in newsitem_qs.order_by('-item_date', '-id')[:300]: # Ordering by ID ensures consistency across page views.
-            s_id = ni.schema_id
-            if s_id in needed:
-                s_list[s_id][1].append(ni)
-                s_list[s_id][2] += 1
-                if s_list[s_id][2] == s_list[s_id][0].number_in_overview:
-                    needed.remove(s_id)
+        # schema, which latest_newsitems_by_schema() does in a single query.
+        # Ordering by ID ensures consistency across page views.
+        s_list = SortedDict([(s.id, [s, []]) for s in schema_manager.filter(is_special_report=False).order_by('plural_name')])
+        for ni in latest_newsitems_by_schema(newsitem_qs, [s[0] for s in s_list.values()]):
+            s_list[ni.schema_id][1].append(ni)
         sf_dict = {}
         for sf in SchemaField.objects.filter(is_lookup=True, is_charted=True, schema__is_public=True, schema__is_special_report=False).values('id', 'schema_id', 'pretty_name').order_by('schema__id', 'display_order'):
             sf_dict.setdefault(sf['schema_id'], []).append(sf)
         schema_blocks, all_newsitems = [], []
-        for s, newsitems, _ in s_list.values():
-            if s.id in needed:
-                newsitems = list(newsitem_qs.filter(schema__id=s.id).order_by('-item_date', '-id')[:s.number_in_overview])
+        for s, newsitems in s_list.values():
             populate_schema(newsitems, s)
             schema_blocks.append({
                 'schema': s,
@@ -9,6 +9,9 @@ block_re = re.compile(r'^(\d+)[-\s]+(?:blk|block)\s+(?:of\s+)?(.*)$', re.IGNOREC
 intersection_re = re.compile(r'(?<=.) (?:and|\&|at|near|@|around|towards?|off|/|(?:just )?(?:north|south|east|west) of|(?:just )?past) (?=.)', re.IGNORECASE)
 # segment_re = re.compile(r'^.{1,40}?\b(?:between .{1,40}? and|from .{1,40}? to) .{1,40}?$', re.IGNORECASE) # TODO
 
+# The number of locations per query in Geocoder.geocode_many().
+CACHE_CHUNK_SIZE = 1000
+
 class GeocodingException(Exception):
     pass
 
@@ -116,22 +119,7 @@ class Geocoder(object):
                 cache_hit = True
 
         if result is None:
-            try:
-                result = self._do_geocode(location)
-            except AmbiguousResult, e:
-                # If multiple results were found, check whether they have the
-                # same point. If they all have the same point, don't raise the
-                # AmbiguousResult exception -- just return the first one.
-                # 
-                # An edge case is if result['point'] is None. This could happen
-                # if the geocoder found locations, not points. In that case,
-                # just raise the AmbiguousResult.
-                result = e.choices[0]
-                if result['point'] is None:
-                    raise
-                for i in e.choices[1:]:
-                    if i['point'] != result['point']:
-                        raise
+            result = self._geocode_uncached(location)
 
         # Save the result to the cache if it wasn't in there already.
         if not cache_hit and self.use_cache:
@@ -139,6 +127,74 @@ class Geocoder(object):
 
         return result
 
+    def geocode_many(self, locations):
+        """
+        Geocodes the given list of locations, handling caching behind the
+        scenes. Returns a list in the same order, with either an Address or
+        the GeocodingException/ParsingError instance for each location.
+
+        Each distinct location is normalized and geocoded only once. Cached
+        results are fetched with one query per CACHE_CHUNK_SIZE locations,
+        and the new results are added to the cache with one INSERT per
+        CACHE_CHUNK_SIZE results.
+        """
+        normalized = [normalize(location) for location in locations]
+        results = {}
+        if self.use_cache:
+            results = self._cache_lookup_many(list(set(normalized)))
+
+        new_results = []
+        for location in normalized:
+            if location in results:
+                continue
+            try:
+                results[location] = self._geocode_uncached(location)
+            except (GeocodingException, ParsingError), e:
+                results[location] = e
+            else:
+                new_results.append((location, results[location]))
+
+        if new_results and self.use_cache:
+            GeocoderCache.populate_many(new_results)
+
+        return [results[location] for location in normalized]
+
+    def _cache_lookup_many(self, locations):
+        """
+        Returns a dictionary mapping each of the given normalized locations
+        that's in the cache to an Address.
+        """
+        result = {}
+        for i in xrange(0, len(locations), CACHE_CHUNK_SIZE):
+            chunk = locations[i:i+CACHE_CHUNK_SIZE]
+            qs = GeocoderCache.objects.filter(normalized_location__in=chunk).select_related('block', 'intersection')
+            for cached in qs:
+                if cached.normalized_location not in result:
+                    result[cached.normalized_location] = Address.from_cache(cached)
+        return result
+
+    def _geocode_uncached(self, location):
+        """
+        Geocodes the given normalized location by calling _do_geocode().
+        """
+        try:
+            return self._do_geocode(location)
+        except AmbiguousResult, e:
+            # If multiple results were found, check whether they have the
+            # same point. If they all have the same point, don't raise the
+            # AmbiguousResult exception -- just return the first one.
+            # 
+            # An edge case is if result['point'] is None. This could happen
+            # if the geocoder found locations, not points. In that case,
+            # just raise the AmbiguousResult.
+            result = e.choices[0]
+            if result['point'] is None:
+                raise
+            for i in e.choices[1:]:
+                if i['point'] != result['point']:
+                    raise
+            return result
+
 class AddressGeocoder(Geocoder):
     def _do_geocode(self, location_string):
         # Parse the address.
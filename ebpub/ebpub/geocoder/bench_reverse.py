@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmarks reverse_geocode_many() and its in-memory SegmentIndex against
+reverse_geocode(), which runs a query per point, on the blocks table of this
+database, and checks that both find the same blocks.
+
+    python bench_reverse.py [options]
+
+Most of the points are near a random block, like the locations of NewsItems;
+the rest are random points in the metro extent, some of which aren't near
+any block. reverse_geocode() is slow, so it's only run for a sample of the
+points.
+
+Like reverse_geocode_many(), this requires a CACHE_BACKEND that is shared
+between processes, such as memcached.
+"""
+
+from django.contrib.gis.geos import Point
+from ebpub.geocoder.reverse import reverse_geocode, reverse_geocode_many, get_segment_index, ReverseGeocodeError
+from ebpub.metros.allmetros import get_metro
+from ebpub.streets.models import line_interpolate_point
+from optparse import OptionParser
+import random
+import sys
+import time
+
+def gen_points(n, blocks, rand_seed=0):
+    "Returns n random Points, 90% of them within 0.002 degrees of a block."
+    rand = random.Random(rand_seed)
+    x1, y1, x2, y2 = get_metro()['extent']
+    points = []
+    for i in xrange(n):
+        if i % 10:
+            block = rand.choice(blocks)
+            pt = line_interpolate_point(block.geom, rand.random())
+            points.append(Point(pt.x + rand.uniform(-0.002, 0.002), pt.y + rand.uniform(-0.002, 0.002), srid=4326))
+        else:
+            points.append(Point(rand.uniform(x1, x2), rand.uniform(y1, y2), srid=4326))
+    return points
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog [options]')
+    p.add_option('-n', '--points', dest='num_points', type='int', default=100000,
+                 help='number of points for reverse_geocode_many()')
+    p.add_option('-s', '--sample', dest='num_sample', type='int', default=1000,
+                 help='number of those points for reverse_geocode()')
+    opts, args = p.parse_args(argv)
+    start = time.time()
+    index = get_segment_index()
+    if not index.blocks:
+        p.error('there are no blocks')
+    print 'Indexed %s blocks in %.1f seconds' % (len(index.blocks), time.time() - start)
+    points = gen_points(opts.num_points, index.blocks)
+    sample = points[:opts.num_sample]
+
+    start = time.time()
+    new = reverse_geocode_many(points)
+    new_time = max(time.time() - start, 0.001)
+    old = []
+    start = time.time()
+    for point in sample:
+        try:
+            old.append(reverse_geocode(point))
+        except ReverseGeocodeError, e:
+            old.append(e)
+    old_time = max(time.time() - start, 0.001)
+    print 'reverse_geocode():      %8.0f points/second (%s points)' % (len(sample) / old_time, len(sample))
+    print 'reverse_geocode_many(): %8.0f points/second (%s points)' % (len(points) / new_time, len(points))
+
+    # The blocks may differ for ties -- points equally near two blocks, such
+    # as at the corner where they meet -- but the distances mustn't.
+    mismatches = not_found = 0
+    for old_result, new_result in zip(old, new):
+        if isinstance(old_result, ReverseGeocodeError) or isinstance(new_result, ReverseGeocodeError):
+            if type(old_result) is not type(new_result):
+                mismatches += 1
+            else:
+                not_found += 1
+        elif old_result[0].id != new_result[0].id and abs(old_result[1] - new_result[1]) > 1e-9:
+            mismatches += 1
+    print '%s of %s sampled points matched (%s of them near no block), %s mismatches' % (len(sample) - mismatches, len(sample), not_found, mismatches)
+    return mismatches and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Exports the geocoder cache to a file, or imports such a file, so that a new
+deployment can start with a warm cache instead of geocoding every location
+from scratch.
+
+    geocoder_cache.py export filename
+    geocoder_cache.py import filename
+
+The file is in PostgreSQL's COPY text format, with the columns
+normalized_location, address, city, state, zip, WKT point, block pretty_name
+and intersection pretty_name. Blocks and intersections are stored by name
+rather than by ID, because their IDs differ between databases; on import,
+each name is resolved to the block (nearest to the point, among blocks with
+that name) or intersection in this database, and to NULL if there isn't one.
+
+Imported locations that are already in the cache are skipped, so it's safe
+to import a file more than once.
+"""
+
+from django.db import connection, transaction
+from optparse import OptionParser
+import sys
+
+COLUMNS = ('normalized_location', 'address', 'city', 'state', 'zip', 'wkt', 'block', 'intersection')
+
+def export_cache(f):
+    """
+    Writes the geocoder cache to the file-like object f. Returns the number
+    of rows written.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TEMPORARY TABLE geocoder_export AS
+        SELECT c.normalized_location, c.address, c.city, c.state, c.zip, AsText(c.location) AS wkt,
+            b.pretty_name AS block, i.pretty_name AS intersection
+        FROM geocoder_geocodercache c
+        LEFT JOIN blocks b ON b.id = c.block_id
+        LEFT JOIN intersections i ON i.id = c.intersection_id
+        ORDER BY c.normalized_location""")
+    total = cursor.rowcount
+    cursor.copy_to(f, 'geocoder_export', columns=COLUMNS)
+    cursor.execute("DROP TABLE geocoder_export")
+    return total
+
+def import_cache(f):
+    """
+    Adds the rows in the file-like object f, as written by export_cache(), to
+    the geocoder cache. Returns (number of rows read, number of rows added).
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TEMPORARY TABLE geocoder_import (
+            normalized_location varchar(255) NOT NULL,
+            address varchar(255) NOT NULL,
+            city varchar(255) NOT NULL,
+            state varchar(2) NOT NULL,
+            zip varchar(10) NOT NULL,
+            wkt text NOT NULL,
+            block varchar(255),
+            intersection varchar(255)
+        )""")
+    cursor.copy_from(f, 'geocoder_import', columns=COLUMNS)
+    cursor.execute("SELECT COUNT(*) FROM geocoder_import")
+    num_read = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO geocoder_geocodercache
+            (normalized_location, address, city, state, zip, location, block_id, intersection_id, generated_at)
+        SELECT DISTINCT ON (s.normalized_location) s.normalized_location, s.address, s.city, s.state, s.zip,
+            GeomFromText(s.wkt, 4326), b.id, i.id, NOW()
+        FROM geocoder_import s
+        LEFT JOIN blocks b ON b.pretty_name = s.block
+        LEFT JOIN intersections i ON i.pretty_name = s.intersection
+        WHERE NOT EXISTS (
+            SELECT 1 FROM geocoder_geocodercache c
+            WHERE c.normalized_location = s.normalized_location
+        )
+        ORDER BY s.normalized_location, ST_Distance(b.geom, GeomFromText(s.wkt, 4326))""")
+    num_added = cursor.rowcount
+    cursor.execute("DROP TABLE geocoder_import")
+    transaction.commit_unless_managed()
+    return num_read, num_added
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = OptionParser(usage='usage: %prog export|import filename')
+    opts, args = p.parse_args(argv)
+    if len(args) != 2 or args[0] not in ('export', 'import'):
+        p.error('required arguments `export` or `import`, `filename`')
+    command, filename = args
+    if command == 'export':
+        f = open(filename, 'w')
+        try:
+            total = export_cache(f)
+        finally:
+            f.close()
+        print 'Exported %s cached locations to %s' % (total, filename)
+    else:
+        f = open(filename)
+        try:
+            num_read, num_added = import_cache(f)
+        finally:
+            f.close()
+        print 'Read %s cached locations from %s; added %s new ones' % (num_read, filename, num_added)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
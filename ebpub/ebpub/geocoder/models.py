@@ -1,4 +1,5 @@
 from django.contrib.gis.db import models
+from django.db import connection, transaction
 from ebpub.streets.models import Block
 from ebpub.streets.models import Intersection
 
@@ -33,3 +34,46 @@ class GeocoderCache(models.Model):
                 setattr(obj, relation, address[relation])
         obj.location = address['point']
         obj.save()
+
+    @classmethod
+    def populate_many(cls, results):
+        """
+        Populates the cache from a list of (normalized location, Address
+        object) tuples. See insert_many().
+        """
+        rows = []
+        for normalized_location, address in results:
+            if address['point'] is None:
+                continue
+            block_id = address.get('block') and address['block'].id or None
+            rows.append((normalized_location, address['address'], address['city'],
+                address['state'], address['zip'], address['point'].wkt, block_id,
+                address.get('intersection_id')))
+        return cls.insert_many(rows)
+
+    @classmethod
+    def insert_many(cls, rows, chunk_size=1000):
+        """
+        Adds rows to the cache, given a list of (normalized location, address,
+        city, state, zip, WKT point, block ID, intersection ID) tuples, with
+        one INSERT per chunk_size rows. Rows for normalized locations that are
+        already in the cache are skipped. Returns the number of rows added.
+        """
+        cursor = connection.cursor()
+        total = 0
+        for i in xrange(0, len(rows), chunk_size):
+            chunk = rows[i:i+chunk_size]
+            cursor.execute("""
+                INSERT INTO geocoder_geocodercache
+                    (normalized_location, address, city, state, zip, location, block_id, intersection_id, generated_at)
+                SELECT DISTINCT ON (v.normalized_location) v.normalized_location, v.address, v.city, v.state, v.zip,
+                    GeomFromText(v.wkt, 4326), v.block_id::integer, v.intersection_id::integer, NOW()
+                FROM (VALUES %s) AS v(normalized_location, address, city, state, zip, wkt, block_id, intersection_id)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM geocoder_geocodercache c
+                    WHERE c.normalized_location = v.normalized_location
+                )""" % ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s)' for _ in chunk]),
+                [value for row in chunk for value in row])
+            total += cursor.rowcount
+            transaction.commit_unless_managed()
+        return total
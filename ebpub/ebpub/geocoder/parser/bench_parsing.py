@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Benchmarks parse() against brute_force_parse(), the reference implementation
+that tries every layout from address_combinations(), and verifies that both
+return the same results for every address in the corpus.
+
+Usage:
+
+    python bench_parsing.py [corpus_file] [repetitions]
+
+The corpus file has one address per line. It defaults to
+sample_addresses.txt, next to this script. Feeding it the output of
+"SELECT normalized_location FROM geocoder_geocodercache" is a good way to
+benchmark against a city's real addresses.
+"""
+
+from ebpub.geocoder.parser.parsing import parse, brute_force_parse, ParsingError
+import os.path
+import sys
+import time
+
+def parse_or_error(parse_func, location):
+    try:
+        return [dict(result) for result in parse_func(location)]
+    except ParsingError:
+        return ParsingError
+
+def time_parser(parse_func, corpus, repetitions):
+    start = time.time()
+    for i in xrange(repetitions):
+        for location in corpus:
+            parse_or_error(parse_func, location)
+    return (time.time() - start) / (repetitions * len(corpus))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        corpus_file = argv[0]
+    else:
+        corpus_file = os.path.join(os.path.dirname(__file__), 'sample_addresses.txt')
+    repetitions = len(argv) > 1 and int(argv[1]) or 3
+    corpus = [line.strip() for line in open(corpus_file) if line.strip()]
+
+    mismatches = 0
+    for location in corpus:
+        if parse_or_error(parse, location) != parse_or_error(brute_force_parse, location):
+            print 'MISMATCH: %r' % location
+            mismatches += 1
+    print '%s addresses, %s mismatches' % (len(corpus), mismatches)
+
+    old = time_parser(brute_force_parse, corpus, repetitions)
+    new = time_parser(parse, corpus, repetitions)
+    print 'brute_force_parse: %.3f ms per address' % (old * 1000)
+    print 'parse:             %.3f ms per address' % (new * 1000)
+    print 'speedup:           %.1fx' % (old / new)
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(main() and 1 or 0)
@@ -155,6 +155,21 @@ def abbrev_regex(d, case_insensitive=True, matches_entirely=True):
         pattern = "(?i)" + pattern
     return pattern
 
+def abbrev_words(d):
+    """
+    Returns the set of uppercase words that abbrev_regex(d) matches.
+
+    >>> sorted(abbrev_words({'av': ['ave', 'avenue'], 'rd': 'road'}))
+    ['AV', 'AVE', 'AVENUE', 'RD', 'ROAD']
+    """
+    words = set()
+    for k, v in d.items():
+        if isinstance(v, basestring):
+            v = [v]
+        words.add(k.upper())
+        words.update([w.upper() for w in v])
+    return words
+
 directional_re = re.compile(abbrev_regex(DIRECTIONALS))
 
 TOKEN_REGEXES = {
@@ -212,9 +227,119 @@ def address_combinations():
                                 for zip_times in (0, 1):
                                     yield ['number'] * number_times + ['pre_dir'] * pre_dir_times + ['street'] * street_times + ['suffix'] * suffix_times + ['post_dir'] * post_dir_times + ['city'] * city_times + ['state'] * state_times + ['zip'] * zip_times
 
+class AddressParser(object):
+    """
+    Finds every layout from address_combinations() that fits a list of
+    tokens, without trying the layouts one by one.
+
+    At construction time, the layouts are compiled into one prefix tree per
+    layout length, whose edges are token types. At parse time, each token is
+    classified exactly once (into the set of token types whose regex it
+    matches), and the tree is walked following only the types of each token,
+    so that every layout sharing an impossible prefix is pruned at once.
+
+    The layouts are returned in the same order as address_combinations()
+    yields them.
+    """
+    def __init__(self, combinations=address_combinations, token_regexes=TOKEN_REGEXES):
+        # Tokens that are a known suffix or directional are matched by a set
+        # lookup rather than by the (huge) alternation regex.
+        # (Tokens are always uppercase, thanks to normalize().)
+        directionals = abbrev_words(DIRECTIONALS)
+        word_sets = {
+            'suffix': abbrev_words(suffixes),
+            'pre_dir': directionals,
+            'post_dir': directionals,
+        }
+
+        # Token types that share a regex (e.g., pre_dir and post_dir) share a
+        # single match.
+        self.word_tests = []
+        self.regex_tests = {}
+        for token_type, regex in token_regexes.items():
+            if token_type in word_sets:
+                self.word_tests.append((token_type, word_sets[token_type]))
+            else:
+                self.regex_tests.setdefault(regex, []).append(token_type)
+        self.regex_tests = self.regex_tests.items()
+
+        # Each tree node is a 2-tuple of (dictionary mapping token types to
+        # child nodes, list of (index, layout) for layouts ending there).
+        self.trees = {}
+        for i, layout in enumerate(combinations()):
+            node = self.trees.setdefault(len(layout), ({}, []))
+            for token_type in layout:
+                node = node[0].setdefault(token_type, ({}, []))
+            node[1].append((i, layout))
+
+    def classify(self, token):
+        """
+        Returns the list of token types that the given token could be.
+        """
+        types = []
+        for token_type, words in self.word_tests:
+            if token in words:
+                types.append(token_type)
+        for regex, token_types in self.regex_tests:
+            if regex.match(token):
+                types.extend(token_types)
+        return types
+
+    def layouts(self, tokens):
+        """
+        Returns the list of layouts (lists of token types) that fit the given
+        tokens.
+        """
+        try:
+            root = self.trees[len(tokens)]
+        except KeyError:
+            return []
+        token_types = [self.classify(token) for token in tokens]
+        matches = []
+        stack = [(root, 0)]
+        while stack:
+            (children, ends), i = stack.pop()
+            if i == len(tokens):
+                matches.extend(ends)
+                continue
+            for token_type in token_types[i]:
+                if token_type in children:
+                    stack.append((children[token_type], i + 1))
+        matches.sort()
+        return [layout for i, layout in matches]
+
+address_parser = AddressParser()
+
 punc_split = re.compile(r"\S+").findall
 
+def _build_location(tokens, token_types):
+    result = Location()
+    for token, token_type in izip(tokens, token_types):
+        if result[token_type]:
+            result[token_type] += ' ' + token
+        else:
+            result[token_type] = token
+
+    # Standardize all values.
+    for key, value in result.items():
+        if value and key in STANDARDIZERS:
+            result[key] = STANDARDIZERS[key](value)
+    return result
+
 def parse(location):
+    s = strip_unit(normalize(location))
+    tokens = punc_split(s)
+    result_list = [_build_location(tokens, token_types) for token_types in address_parser.layouts(tokens)]
+    if not result_list:
+        raise ParsingError("Failed to parse location %r" % location)
+    return result_list
+
+def brute_force_parse(location):
+    """
+    Reference implementation of parse(), which tries to match every layout
+    from address_combinations() against the tokens. It's much slower than
+    parse() and is only kept for verifying and benchmarking it.
+    """
     s = strip_unit(normalize(location))
     tokens = punc_split(s)
     len_tokens = len(tokens)
@@ -230,20 +355,7 @@ def parse(location):
                 continue
 
             # If we made it this far, then all of the tokens are valid.
-            # Create the Location object.
-            result = Location()
-            for token, token_type in izip(tokens, token_types):
-                if result[token_type]:
-                    result[token_type] += ' ' + token
-                else:
-                    result[token_type] = token
-
-            # Standardize all values.
-            for key, value in result.items():
-                if value and key in STANDARDIZERS:
-                    result[key] = STANDARDIZERS[key](value)
-
-            result_list.append(result)
+            result_list.append(_build_location(tokens, token_types))
 
     if not result_list:
         raise ParsingError("Failed to parse location %r" % location)
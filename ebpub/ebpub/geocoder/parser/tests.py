@@ -5,7 +5,8 @@ The LocationTestCase class contains both hand-written tests and a metaclass
 that auto-generates tests based on some sample data.
 """
 
-from ebpub.geocoder.parser.parsing import parse, address_combinations, ParsingError, Location
+from ebpub.geocoder.parser.parsing import parse, brute_force_parse, address_combinations, ParsingError, Location
+import os.path
 import unittest
 
 class AutoLocationMetaclass(type):
@@ -356,5 +357,23 @@ class LocationTestCase(unittest.TestCase):
             {'number': '1110', 'pre_dir': None, 'street': 'BRONX RIVER', 'suffix': 'AVE', 'post_dir': None, 'city': 'THE BRONX', 'state': None, 'zip': None},
         )
 
+class BruteForceEquivalenceTestCase(unittest.TestCase):
+    """
+    Makes sure parse() returns exactly what brute_force_parse() does, in the
+    same order, for every address in sample_addresses.txt.
+    """
+    def parse_or_error(self, parse_func, location):
+        try:
+            return [dict(result) for result in parse_func(location)]
+        except ParsingError:
+            return ParsingError
+
+    def test_sample_addresses(self):
+        for line in open(os.path.join(os.path.dirname(__file__), 'sample_addresses.txt')):
+            location = line.strip()
+            self.assertEqual(self.parse_or_error(parse, location),
+                             self.parse_or_error(brute_force_parse, location),
+                             location)
+
 if __name__ == "__main__":
     unittest.main()
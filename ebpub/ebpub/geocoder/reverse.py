@@ -1,8 +1,14 @@
 import unittest
 from psycopg2 import Binary
 from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.db import connection
+from ebpub.streets.blockindex import VERSION_CACHE_KEY
 from ebpub.streets.models import Block
+from ebpub.utils.cache import cache_is_shared
+import math
+import threading
 
 class ReverseGeocodeError(Exception):
     pass
@@ -32,7 +38,7 @@ def reverse_geocode(point):
         LIMIT 1;
     """ % {'field_list': ', '.join([f.column for f in Block._meta.fields]),
            'pt_wkb': Binary(point.wkb),
-           'geom_fieldname': 'location',
+           'geom_fieldname': 'geom',
            'tablename': Block._meta.db_table,
            'min_distance': min_distance})
     num_fields = len(Block._meta.fields)
@@ -41,3 +47,158 @@ def reverse_geocode(point):
     except IndexError:
         raise ReverseGeocodeError()
     return block, distance
+
+# Blocks farther than this from a point, in degrees, are never its nearest
+# block. This is the same cutoff reverse_geocode() uses.
+MAX_DISTANCE = 0.007
+
+# Grid cells are made a tiny bit bigger than MAX_DISTANCE, so that floating
+# point error in computing a point's cell can never put a segment that's
+# within MAX_DISTANCE of it more than one cell away.
+GRID_CELL_MARGIN = 1.000001
+
+class SegmentIndex(object):
+    """
+    An in-memory grid index of the segments of every Block's line, for
+    reverse geocoding many points without a query per point.
+
+    Each segment is bucketed in every grid cell its bounding box touches,
+    with cells the size of MAX_DISTANCE, so only the segments in the 3x3
+    cells around a point can be within MAX_DISTANCE of it. Distances are
+    measured in degrees, like ST_Distance() on the lng/lat geometries.
+    """
+    def __init__(self, blocks=None):
+        self.cell_size = MAX_DISTANCE * GRID_CELL_MARGIN
+        # self.blocks and self.lengths are the blocks and the lengths of
+        # their lines. self.grid maps a cell to a list of (block index, x1,
+        # y1, x2, y2, distance along the line to (x1, y1)) tuples.
+        self.blocks = []
+        self.lengths = []
+        self.grid = {}
+        if blocks is None:
+            blocks = Block.objects.order_by('id')
+        for block in blocks:
+            self.add(block)
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def add(self, block):
+        index = len(self.blocks)
+        offset = 0.0
+        coords = [c[:2] for c in block.geom.coords]
+        for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+            segment = (index, x1, y1, x2, y2, offset)
+            min_i, min_j = self.cell(min(x1, x2), min(y1, y2))
+            max_i, max_j = self.cell(max(x1, x2), max(y1, y2))
+            for i in xrange(min_i, max_i + 1):
+                for j in xrange(min_j, max_j + 1):
+                    self.grid.setdefault((i, j), []).append(segment)
+            offset += math.hypot(x2 - x1, y2 - y1)
+        self.blocks.append(block)
+        self.lengths.append(offset)
+
+    def nearest(self, x, y):
+        """
+        Returns (block, distance, fraction, left) for the block nearest to
+        the point (x, y), or None if no block is within MAX_DISTANCE of it.
+
+        fraction is how far (between 0 and 1) along the block's line the
+        point nearest to (x, y) is, and left is True if (x, y) is on the left
+        side of the line. Ties are won by the block added first.
+        """
+        best = None
+        cell_x, cell_y = self.cell(x, y)
+        for i in (cell_x - 1, cell_x, cell_x + 1):
+            for j in (cell_y - 1, cell_y, cell_y + 1):
+                for index, x1, y1, x2, y2, offset in self.grid.get((i, j), ()):
+                    dx, dy = x2 - x1, y2 - y1
+                    length_squared = dx * dx + dy * dy
+                    if length_squared:
+                        t = min(max(((x - x1) * dx + (y - y1) * dy) / length_squared, 0.0), 1.0)
+                    else:
+                        t = 0.0
+                    distance = math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+                    if distance > MAX_DISTANCE:
+                        continue
+                    if best is None or distance < best[0] or (distance == best[0] and index < best[1]):
+                        left = dx * (y - y1) - dy * (x - x1) > 0
+                        best = (distance, index, offset + t * math.sqrt(length_squared), left)
+        if best is None:
+            return None
+        distance, index, along, left = best
+        fraction = self.lengths[index] and along / self.lengths[index] or 0.5
+        return self.blocks[index], distance, fraction, left
+
+def house_number(block, fraction, left):
+    """
+    Returns the house number that is the given fraction of the way along the
+    block, on the given side of the street -- the inverse of the
+    interpolation in BlockManager.search() -- or None if the block has no
+    number range. The number has the same parity as the side's range.
+    """
+    if left:
+        from_num, to_num = block.left_from_num, block.left_to_num
+    else:
+        from_num, to_num = block.right_from_num, block.right_to_num
+    if from_num is None or to_num is None:
+        from_num, to_num = block.from_num, block.to_num
+    if from_num is None or to_num is None:
+        return None
+    number = int(round(from_num + (to_num - from_num) * fraction))
+    if (number - from_num) % 2:
+        step = to_num >= from_num and 1 or -1
+        if number == to_num:
+            number -= step
+        else:
+            number += step
+    return number
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+def get_segment_index():
+    """
+    Returns the SegmentIndex for this process, (re)building it if it doesn't
+    exist yet or if the blocks have changed since it was built. Changes are
+    detected through the version number of ebpub.streets.blockindex.
+
+    Raises ImproperlyConfigured if settings.CACHE_BACKEND isn't shared
+    between processes, because a block import in another process couldn't
+    change the version that this process sees.
+    """
+    global _index, _index_version
+    if not cache_is_shared():
+        raise ImproperlyConfigured('reverse_geocode_many() requires a CACHE_BACKEND that is shared between processes, such as memcached')
+    version = cache.get(VERSION_CACHE_KEY)
+    index = _index
+    if index is None or version != _index_version:
+        _lock.acquire()
+        try:
+            if _index is None or version != _index_version:
+                _index = SegmentIndex()
+                _index_version = version
+            index = _index
+        finally:
+            _lock.release()
+    return index
+
+def reverse_geocode_many(points):
+    """
+    Looks up the nearest block to each of the given Points, using the
+    in-memory SegmentIndex. Returns a list in the same order, with either a
+    (block, distance, house number) tuple or a ReverseGeocodeError instance
+    for each point. The house number is None if the block has no number
+    range.
+    """
+    index = get_segment_index()
+    result = []
+    for point in points:
+        found = index.nearest(point.x, point.y)
+        if found is None:
+            result.append(ReverseGeocodeError())
+        else:
+            block, distance, fraction, left = found
+            result.append((block, distance, house_number(block, fraction, left)))
+    return result
@@ -1,4 +1,7 @@
+from django.contrib.gis.geos import LineString
 from ebpub.geocoder import SmartGeocoder, AmbiguousResult, InvalidBlockButValidStreet
+from ebpub.geocoder.reverse import SegmentIndex, house_number
+from ebpub.streets.models import Block
 import os.path
 import unittest
 import yaml
@@ -55,5 +58,42 @@ class BaseGeocoderTestCase(unittest.TestCase):
         address = self.geocoder.geocode('Wabash and Jackson')
         self.assertEqual(address['city'], 'CHICAGO')
 
+    def test_geocode_many(self):
+        results = self.geocoder.geocode_many(['200 S Wabash', '200 Wabash', 'Wabash and Jackson', '200 s wabash'])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]['city'], 'Chicago')
+        self.assert_(isinstance(results[1], AmbiguousResult))
+        self.assertEqual(results[2]['city'], 'CHICAGO')
+        self.assert_(results[3] is results[0])
+
+class SegmentIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.west = Block(id=1, left_from_num=201, left_to_num=299, right_from_num=200, right_to_num=298,
+                          from_num=200, to_num=299, geom=LineString((0, 0), (0.001, 0), (0.002, 0)))
+        self.east = Block(id=2, left_from_num=301, left_to_num=399, right_from_num=300, right_to_num=398,
+                          from_num=300, to_num=399, geom=LineString((0.002, 0), (0.004, 0)))
+        self.index = SegmentIndex([self.west, self.east])
+
+    def test_nearest(self):
+        block, distance, fraction, left = self.index.nearest(0.0015, 0.0001)
+        self.assert_(block is self.west)
+        self.assertAlmostEqual(distance, 0.0001)
+        self.assertAlmostEqual(fraction, 0.75)
+        self.assertEqual(left, True)
+
+    def test_nearest_tie(self):
+        block, distance, fraction, left = self.index.nearest(0.002, -0.001)
+        self.assert_(block is self.west)
+        self.assertEqual(left, False)
+
+    def test_nearest_too_far(self):
+        self.assertEqual(self.index.nearest(0.002, 0.008), None)
+
+    def test_house_number(self):
+        self.assertEqual(house_number(self.west, 0.75, True), 275)
+        self.assertEqual(house_number(self.west, 0.75, False), 274)
+        self.assertEqual(house_number(self.east, 1.0, True), 399)
+        self.assertEqual(house_number(self.east, 0.0, False), 300)
+
 if __name__ == '__main__':
     pass
@@ -41,6 +41,15 @@ MIDDLEWARE_CLASSES = (
     'ebpub.accounts.middleware.UserMiddleware',
 )
 
+# The homepage fragments (see ebpub/db/views.py), BLOCK_INDEX_ENABLED,
+# ebpub.geocoder.reverse.reverse_geocode_many() and
+# FIELD_MAPPING_SHARED_CACHE rely on the scrapers and cron jobs telling the
+# web processes through the cache that the data has changed, so they need a
+# backend that all processes share, such as 'memcached://127.0.0.1:11211/'.
+# With Django's default, per-process locmem:// backend, the homepage isn't
+# cached at all.
+CACHE_BACKEND = 'locmem://'
+
 #########################
 # CUSTOM EBPUB SETTINGS #
 #########################
@@ -144,6 +153,32 @@ MAPS_POSTGIS_DB = ''
 # This is used as a "From:" in e-mails sent to users.
 GENERIC_EMAIL_SENDER = 'example@example.com'
 
+# Set this to True to answer block searches (and thus address geocoding) from
+# an in-memory index of the blocks table instead of querying the database.
+# This costs memory in every process that geocodes, but makes geocoding much
+# faster. See ebpub.streets.blockindex.
+#
+# The index requires a CACHE_BACKEND that is shared by all processes, such as
+# memcached, because that's how a block import in one process tells the
+# others to rebuild their indexes. With the default, per-process locmem://
+# backend, block searches raise ImproperlyConfigured.
+BLOCK_INDEX_ENABLED = False
+
+# Set this to True to share ebpub.db.models.field_mapping()'s cache of each
+# schema's SchemaFields between processes, through the Django cache, and to
+# keep it until the SchemaFields change. This requires a CACHE_BACKEND that is
+# shared by all processes, such as memcached; otherwise, processes wouldn't
+# learn that a SchemaField had been changed in another one. When this is
+# False, each process caches the SchemaFields for a minute.
+FIELD_MAPPING_SHARED_CACHE = False
+
+# Set this to True to find the NewsItems near a block (on block pages, feeds
+# and alerts) in the db_blocknewsitem table instead of with a spatial query.
+# The table must be maintained by the trigger in
+# ebpub/db/sql/blocknewsitem_functions.sql and populated with
+# ebpub/db/bin/update_block_newsitems.py.
+BLOCK_PROXIMITY_ENABLED = False
+
 # Map stuff.
 MAP_SCALES = [614400, 307200, 153600, 76800, 38400, 19200, 9600, 4800, 2400, 1200]
 SPATIAL_REF_SYS = '900913' # Spherical Mercator
@@ -152,6 +187,13 @@ MAP_UNITS = 'm' # see ebgeo.maps.utils for allowed unit types
 # Filesystem location of tilecache config (e.g., '/etc/tilecache/tilecache.cfg').
 TILECACHE_CONFIG = ''
 
+# The number of threads per process that render map tiles that aren't in the
+# tile cache, and the number of metatiles that can wait for them. With 0
+# threads, each request renders its own tile's metatile. See
+# ebgeo.maps.tilerender.
+TILE_RENDER_WORKERS = 0
+TILE_RENDER_QUEUE_SIZE = 100
+
 # Filesystem location of scraper log.
 SCRAPER_LOGFILE_NAME = '/tmp/scraperlog'
 
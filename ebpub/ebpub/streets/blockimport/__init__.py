@@ -1 +1 @@
-from base import BlockImporter # relative import
+from base import BlockImporter, StagingMismatch # relative import
@@ -1,33 +1,75 @@
+from cStringIO import StringIO
 from django.contrib.gis.gdal import DataSource
+from django.db import connection, transaction
+from ebpub.streets import blockindex
 from ebpub.streets.models import Block
 from ebpub.streets.name_utils import make_pretty_name
 from ebpub.utils.text import slugify
+import os.path
+import time
+
+# The staging table of BlockImporter.bulk_save(). It has the columns of the
+# blocks table, plus the number of the feature each block came from and its
+# sequence number within the feature.
+STAGING_TABLE = 'blocks_import'
+
+# A one-row table that records what the staged blocks were imported from (see
+# BlockImporter.source()), so that bulk_save() only resumes an import of the
+# same blocks.
+SOURCE_TABLE = 'blocks_import_source'
+
+# Staged blocks that match a block already in the blocks table on these
+# columns, and on geometry, aren't added again.
+MATCH_COLUMNS = ('predir', 'street', 'suffix', 'postdir', 'left_from_num', 'left_to_num',
+                 'right_from_num', 'right_to_num', 'left_city', 'right_city')
+
+def copy_value(value):
+    """
+    Returns the given value formatted for PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class StagingMismatch(Exception):
+    "The staging table holds an interrupted import from another source."
+    pass
 
 class BlockImporter(object):
     def __init__(self, shapefile, layer_id=0):
+        self.shapefile = shapefile
+        self.layer_id = layer_id
         self.layer = DataSource(shapefile)[layer_id]
 
+    def source(self):
+        """
+        Returns a string that identifies the blocks this importer imports:
+        the shapefile, layer and number of features. Subclasses with other
+        inputs or options that change the blocks should add them.
+        """
+        return '%s layer %s (%s features)' % (os.path.abspath(self.shapefile), self.layer_id, len(self.layer))
+
     def save(self, verbose=True):
+        # Invalidate the in-memory block index once, after the import, rather
+        # than once per saved block.
+        blockindex.suspend_invalidation()
+        try:
+            return self._save(verbose)
+        finally:
+            blockindex.resume_invalidation()
+
+    def _save(self, verbose):
         num_created = 0
         for feature in self.layer:
             parent_id = None
             if not self.skip_feature(feature):
                 for block_fields in self.gen_blocks(feature):
-                    block = Block(**block_fields)
+                    block = self.make_block(block_fields)
                     block.geom = feature.geom.geos
-                    street_name, block_name = make_pretty_name(
-                        block_fields['left_from_num'],
-                        block_fields['left_to_num'],
-                        block_fields['right_from_num'],
-                        block_fields['right_to_num'],
-                        block_fields['predir'],
-                        block_fields['street'],
-                        block_fields['suffix'],
-                        block_fields['postdir']
-                    )
-                    block.pretty_name = block_name
-                    block.street_pretty_name = street_name
-                    block.street_slug = slugify(' '.join((block_fields['street'], block_fields['suffix'])))
                     block.save()
                     if parent_id is None:
                         parent_id = block.id
@@ -39,6 +81,167 @@ class BlockImporter(object):
                         print 'Created block %s' % block
         return num_created
 
+    def make_block(self, block_fields):
+        """
+        Returns an unsaved Block, without a geom, for the given fields as
+        yielded by gen_blocks().
+        """
+        block = Block(**block_fields)
+        street_name, block_name = make_pretty_name(
+            block_fields['left_from_num'],
+            block_fields['left_to_num'],
+            block_fields['right_from_num'],
+            block_fields['right_to_num'],
+            block_fields['predir'],
+            block_fields['street'],
+            block_fields['suffix'],
+            block_fields['postdir']
+        )
+        block.pretty_name = block_name
+        block.street_pretty_name = street_name
+        block.street_slug = slugify(' '.join((block_fields['street'], block_fields['suffix'])))
+        return block
+
+    def bulk_save(self, verbose=True, resume=True, chunk_size=10000):
+        """
+        Imports the same blocks as save(), without holding a transaction on
+        the blocks table for the length of the import.
+
+        The features are streamed into the staging table with COPY, about
+        chunk_size blocks per COPY, and each chunk's geometries are then
+        transformed to 4326 with one UPDATE, in the chunk's transaction. If
+        resume is True, the features already staged by an interrupted bulk
+        import are skipped; StagingMismatch is raised if that import had
+        another source(), and resume must be False to discard it. Finally, the staged blocks are added to the
+        blocks table in one short transaction, so the geocoder sees either
+        none or all of them. Staged blocks identical to blocks already in the
+        table (such as when a county's streets are imported again) are
+        skipped.
+
+        Returns the number of blocks added.
+        """
+        cursor = connection.cursor()
+        columns = [f.column for f in Block._meta.fields if f.name not in ('id', 'parent_id', 'geom')]
+        last_feature = self._prepare_staging(cursor, resume)
+        if verbose and last_feature >= 0:
+            print 'Resuming after feature %s' % last_feature
+
+        buf = StringIO()
+        buffered = staged = 0
+        first_feature = None
+        start = time.time()
+        for feature_num, feature in enumerate(self.layer):
+            if feature_num <= last_feature or self.skip_feature(feature):
+                continue
+            geom = feature.geom
+            ewkt = 'SRID=%s;%s' % (geom.srid or 4326, geom.wkt)
+            for seq, block_fields in enumerate(self.gen_blocks(feature)):
+                block = self.make_block(block_fields)
+                values = [feature_num, seq] + [getattr(block, c) for c in columns] + [ewkt]
+                buf.write('\t'.join([copy_value(v) for v in values]) + '\n')
+                buffered += 1
+                if first_feature is None:
+                    first_feature = feature_num
+            # Chunks end on feature boundaries, so that a feature's blocks
+            # are staged (and resumed) together.
+            if buffered >= chunk_size:
+                self._stage(cursor, buf, columns, first_feature)
+                staged += buffered
+                if verbose:
+                    print 'Staged %s blocks, up to feature %s (%.0f rows/second)' % (staged, feature_num, staged / max(time.time() - start, 0.001))
+                buf = StringIO()
+                buffered = 0
+                first_feature = None
+        if buffered:
+            self._stage(cursor, buf, columns, first_feature)
+            staged += buffered
+        if verbose:
+            print 'Staged %s blocks in %.1f seconds (%.0f rows/second)' % (staged, time.time() - start, staged / max(time.time() - start, 0.001))
+
+        num_created = self._publish(cursor, columns)
+        blockindex.invalidate()
+        return num_created
+
+    def _prepare_staging(self, cursor, resume):
+        """
+        Creates the staging table, unless resume is True and it exists.
+        Returns the number of the last feature that's already staged, or -1.
+        """
+        source = self.source()
+        tables = connection.introspection.get_table_list(cursor)
+        if STAGING_TABLE in tables:
+            if resume:
+                staged_source = None
+                if SOURCE_TABLE in tables:
+                    cursor.execute("SELECT source FROM %s" % SOURCE_TABLE)
+                    row = cursor.fetchone()
+                    staged_source = row and row[0]
+                if staged_source != source:
+                    raise StagingMismatch('%s holds an interrupted import of %s, not of %s. Finish that import, or start over without resuming.' % (STAGING_TABLE, staged_source, source))
+                cursor.execute("SELECT MAX(feature_num) FROM %s" % STAGING_TABLE)
+                last_feature = cursor.fetchone()[0]
+                return last_feature is None and -1 or last_feature
+            cursor.execute("DROP TABLE %s" % STAGING_TABLE)
+        cursor.execute("DROP TABLE IF EXISTS %s" % SOURCE_TABLE)
+        cursor.execute("CREATE TABLE %s (source text NOT NULL)" % SOURCE_TABLE)
+        cursor.execute("INSERT INTO %s (source) VALUES (%%s)" % SOURCE_TABLE, (source,))
+        # Unlike CREATE TABLE ... (LIKE blocks), this doesn't copy the NOT
+        # NULL and geometry constraints, so staged blocks can have their
+        # source SRID until they're transformed, and no ID until published.
+        cursor.execute("CREATE TABLE %s AS SELECT * FROM blocks LIMIT 0" % STAGING_TABLE)
+        cursor.execute("""
+            ALTER TABLE %s
+                ADD COLUMN feature_num integer NOT NULL,
+                ADD COLUMN seq integer NOT NULL,
+                ADD COLUMN is_new boolean NOT NULL DEFAULT true""" % STAGING_TABLE)
+        transaction.commit_unless_managed()
+        return -1
+
+    def _stage(self, cursor, buf, columns, first_feature):
+        buf.seek(0)
+        cursor.copy_from(buf, STAGING_TABLE, columns=['feature_num', 'seq'] + columns + ['geom'])
+        cursor.execute("""
+            UPDATE %s SET geom = ST_Transform(geom, 4326)
+            WHERE feature_num >= %%s AND ST_SRID(geom) <> 4326""" % STAGING_TABLE, (first_feature,))
+        transaction.commit_unless_managed()
+
+    def _publish(self, cursor, columns):
+        """
+        Adds the staged blocks to the blocks table and drops the staging
+        table. Returns the number of blocks added.
+        """
+        cursor.execute("DROP INDEX IF EXISTS %s_feature" % STAGING_TABLE)
+        cursor.execute("DROP INDEX IF EXISTS %s_geom" % STAGING_TABLE)
+        cursor.execute("CREATE INDEX %s_feature ON %s (feature_num, seq)" % (STAGING_TABLE, STAGING_TABLE))
+        cursor.execute("CREATE INDEX %s_geom ON %s USING GIST (geom)" % (STAGING_TABLE, STAGING_TABLE))
+        cursor.execute("ANALYZE %s" % STAGING_TABLE)
+        transaction.commit_unless_managed()
+
+        # Everything from here on is one transaction.
+        cursor.execute("""
+            UPDATE %s s SET id = b.id, is_new = false
+            FROM blocks b
+            WHERE b.geom && s.geom AND ST_Equals(b.geom, s.geom) AND %s""" % (STAGING_TABLE,
+            ' AND '.join(['b.%s IS NOT DISTINCT FROM s.%s' % (c, c) for c in MATCH_COLUMNS])))
+        cursor.execute("UPDATE %s SET id = nextval(pg_get_serial_sequence('blocks', 'id')) WHERE is_new" % STAGING_TABLE)
+        # As in save(), the first block of a feature is the parent of the
+        # feature's other blocks.
+        cursor.execute("""
+            UPDATE %s s SET parent_id = p.id
+            FROM %s p
+            WHERE p.feature_num = s.feature_num AND p.seq = 0 AND s.seq > 0""" % (STAGING_TABLE, STAGING_TABLE))
+        cursor.execute("""
+            INSERT INTO blocks (id, %s, parent_id, geom)
+            SELECT id, %s, parent_id, geom
+            FROM %s
+            WHERE is_new
+            ORDER BY feature_num, seq""" % (', '.join(columns), ', '.join(columns), STAGING_TABLE))
+        num_created = cursor.rowcount
+        cursor.execute("DROP TABLE %s" % STAGING_TABLE)
+        cursor.execute("DROP TABLE %s" % SOURCE_TABLE)
+        transaction.commit_unless_managed()
+        return num_created
+
     def skip_feature(self, feature):
         """
         Subclasses can override this method to determine whether to
@@ -2,6 +2,7 @@ import re
 import sys
 from django.contrib.gis.gdal import DataSource
 from ebpub.metros.models import Metro
+from ebpub.streets import blockindex
 from ebpub.streets.models import Block
 from ebpub.streets.name_utils import make_pretty_name
 from ebpub.utils.text import slugify
@@ -43,6 +44,15 @@ class EsriImporter(object):
         self.fcc_pat = re.compile('^(' + '|'.join(VALID_FCC_PREFIXES) + ')\d$')
 
     def save(self, verbose=False):
+        # Invalidate the in-memory block index once, after the import, rather
+        # than once per saved block.
+        blockindex.suspend_invalidation()
+        try:
+            return self._save(verbose)
+        finally:
+            blockindex.resume_invalidation()
+
+    def _save(self, verbose):
         alt_names_suff = ('', '1', '2', '3', '4', '5')
         num_created = 0
         for i, feature in enumerate(self.layer):
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 import sys
 import optparse
+import os.path
+import time
 from django.contrib.gis.gdal import DataSource
 from ebdata.parsing import dbf
-from ebpub.streets.blockimport import BlockImporter
+from ebpub.streets.blockimport import BlockImporter, StagingMismatch
 
 STATE_FIPS = {
     '02': ('AK', 'ALASKA'),
@@ -71,8 +73,9 @@ class TigerImporter(BlockImporter):
     """
     Imports blocks using TIGER/Line data from the US Census.
 
-    Note this importer requires a lot of memory, because it loads the
-    necessary .DBF files into memory for various lookups.
+    Note this importer loads the fields it needs from the .DBF files into
+    memory for various lookups, so it needs memory in proportion to the
+    number of features.
 
     Please refer to Census TIGER/Line shapefile documentation
     regarding the relationships between shapefiles and support DBF
@@ -81,15 +84,19 @@ class TigerImporter(BlockImporter):
     http://www.census.gov/geo/www/tiger/tgrshp2008/rel_file_desc_2008.txt
     """
     def __init__(self, edges_shp, featnames_dbf, faces_dbf, place_shp, filter_city=None):
+        self.shapefile = edges_shp
+        self.layer_id = 0
+        self.rel_files = (featnames_dbf, faces_dbf, place_shp)
         self.layer = DataSource(edges_shp)[0]
         self.featnames_db = featnames_db = {}
-        for row in self._load_rel_db(featnames_dbf, 'LINEARID').itervalues():
-            if row['MTFCC'] not in VALID_MTFCC:
+        featnames_fields = ['TLID', 'MTFCC', 'NAME', 'PREDIRABRV', 'SUFTYPABRV', 'SUFDIRABRV']
+        for row in self._load_rel_db(featnames_dbf, 'LINEARID', featnames_fields).itervalues():
+            tlid, mtfcc, name_fields = row[0], row[1], row[2:]
+            if mtfcc not in VALID_MTFCC:
                 continue
-            tlid = row['TLID']
             featnames_db.setdefault(tlid, [])
-            featnames_db[tlid].append(row)
-        self.faces_db = self._load_rel_db(faces_dbf, 'TFID')
+            featnames_db[tlid].append(name_fields)
+        self.faces_db = self._load_rel_db(faces_dbf, 'TFID', ['PLACEFP', 'STATEFP'])
         # Load places keyed by FIPS code
         places_layer = DataSource(place_shp)[0]
         fields = places_layer.fields
@@ -100,12 +107,24 @@ class TigerImporter(BlockImporter):
             places[fips] = values
         self.filter_city = filter_city and filter_city.upper() or None
 
-    def _load_rel_db(self, dbf_file, rel_key):
+    def source(self):
+        return '%s with %s, filter_city=%s' % (BlockImporter.source(self),
+            ', '.join([os.path.abspath(f) for f in self.rel_files]), self.filter_city)
+
+    def _load_rel_db(self, dbf_file, rel_key, fields):
+        """
+        Returns a dictionary mapping each record's rel_key to a tuple of the
+        given fields of that record. Only those fields are decoded and kept.
+        """
         f = open(dbf_file, 'rb')
         db = {}
         try:
-            for row in dbf.dict_reader(f, strip_values=True):
-                db[row[rel_key]] = row
+            table = dbf.DBFFile(f, strip_values=True)
+            try:
+                for row in table.records([rel_key] + fields):
+                    db[row[0]] = tuple(row[1:])
+            finally:
+                table.close()
         finally:
             f.close()
         return db
@@ -114,8 +133,7 @@ class TigerImporter(BlockImporter):
         fid = feature.get('TFID' + side)
         city = ''
         if fid in self.faces_db:
-            face = self.faces_db[fid]
-            pid = face['PLACEFP']
+            pid, statefp = self.faces_db[fid]
             if pid in self.places:
                 place = self.places[pid]
                 city = place['NAME']
@@ -124,8 +142,8 @@ class TigerImporter(BlockImporter):
     def _get_state(self, feature, side):
         fid = feature.get('TFID' + side)
         if fid in self.faces_db:
-            face = self.faces_db[fid]
-            return STATE_FIPS[face['STATEFP']][0]
+            pid, statefp = self.faces_db[fid]
+            return STATE_FIPS[statefp][0]
         else:
             return ''
 
@@ -158,12 +176,12 @@ class TigerImporter(BlockImporter):
             block_fields[side + '_city'] = self._get_city(feature, side[0].upper()).upper()
             block_fields[side + '_state'] = self._get_state(feature, side[0].upper()).upper()
         if tlid in self.featnames_db:
-            for featname in self.featnames_db[tlid]:
+            for name, predir, suffix, postdir in self.featnames_db[tlid]:
                 name_fields = {}
-                name_fields['street'] = featname['NAME'].upper()
-                name_fields['predir'] = featname['PREDIRABRV'].upper()
-                name_fields['suffix'] = featname['SUFTYPABRV'].upper()
-                name_fields['postdir'] = featname['SUFDIRABRV'].upper()
+                name_fields['street'] = name.upper()
+                name_fields['predir'] = predir.upper()
+                name_fields['suffix'] = suffix.upper()
+                name_fields['postdir'] = postdir.upper()
                 block_fields.update(name_fields)
                 yield block_fields
 
@@ -173,11 +191,24 @@ def main(argv=None):
     parser = optparse.OptionParser(usage='%prog edges.shp featnames.dbf faces.dbf place.shp')
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False)
     parser.add_option('-c', '--city', dest='city', help='A city name to filter against')
+    parser.add_option('-b', '--bulk', action='store_true', dest='bulk', default=False,
+                      help='load the blocks through a staging table with COPY')
+    parser.add_option('--restart', action='store_false', dest='resume', default=True,
+                      help="with --bulk, don't resume an interrupted bulk import")
     (options, args) = parser.parse_args(argv)
     if len(args) != 4:
         return parser.error('must provide 4 arguments, see usage')
     tiger = TigerImporter(*args, filter_city=options.city)
-    tiger.save(options.verbose)
+    if options.bulk:
+        start = time.time()
+        try:
+            num_created = tiger.bulk_save(options.verbose, options.resume)
+        except StagingMismatch, e:
+            return parser.error('%s (use --restart to discard it)' % e)
+        elapsed = max(time.time() - start, 0.001)
+        print 'Added %s blocks in %.1f seconds (%.0f rows/second)' % (num_created, elapsed, num_created / elapsed)
+    else:
+        tiger.save(options.verbose)
 
 if __name__ == '__main__':
     sys.exit(main())
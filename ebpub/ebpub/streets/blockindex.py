@@ -0,0 +1,160 @@
+"""
+A process-local, in-memory index of Blocks for address lookups.
+
+BlockManager.search() uses this index when settings.BLOCK_INDEX_ENABLED is
+True. The index maps each street name to its blocks, sorted by number range,
+so that an address lookup is answered without touching the database at all.
+
+The index is rebuilt lazily the first time it's needed after it has been
+invalidated. Saving or deleting a Block invalidates it, both in this process
+and -- via a version number kept in the Django cache -- in every other process
+that shares the cache backend. That's why the index requires a
+CACHE_BACKEND that is shared between processes, such as memcached; with the
+default, per-process locmem:// backend, other processes would never learn
+that the blocks had changed. BlockImporter suspends invalidation for the
+duration of an import and invalidates once at the end, so that geocoding
+processes don't rebuild the index for every imported block.
+"""
+
+from bisect import bisect_right
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from ebpub.utils.cache import cache_is_shared
+from ebpub.streets.models import Block, line_interpolate_point
+import re
+import threading
+import time
+
+VERSION_CACHE_KEY = 'ebpub_streets_block_index_version'
+VERSION_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+class BlockIndex(object):
+    def __init__(self, blocks=None):
+        # self.streets maps a street name to a list of all of its blocks.
+        # self.ranges maps a street name to a 2-tuple of
+        # (list of from_nums, list of blocks), both sorted by from_num, for
+        # the street's blocks that have a number range.
+        self.streets = {}
+        self.ranges = {}
+        if blocks is None:
+            blocks = Block.objects.all()
+        for block in blocks:
+            self.add(block)
+        for street, blocks in self.ranges.items():
+            blocks.sort(key=lambda b: b.from_num)
+            self.ranges[street] = ([b.from_num for b in blocks], blocks)
+
+    def add(self, block):
+        self.streets.setdefault(block.street, []).append(block)
+        if block.from_num is not None and block.to_num is not None:
+            self.ranges.setdefault(block.street, []).append(block)
+
+    def search(self, street, number=None, predir=None, suffix=None, postdir=None, city=None, state=None, zipcode=None):
+        """
+        Returns a list of (block, geocoded_pt) 2-tuples, exactly like
+        BlockManager.search().
+        """
+        street = street.upper()
+        if number:
+            number = int(re.sub(r'\D', '', number))
+            try:
+                from_nums, blocks = self.ranges[street]
+            except KeyError:
+                return []
+            # Only blocks whose from_num is <= number can contain it.
+            candidates = blocks[:bisect_right(from_nums, number)]
+        else:
+            candidates = self.streets.get(street, [])
+
+        predir = predir and predir.upper()
+        suffix = suffix and suffix.upper()
+        postdir = postdir and postdir.upper()
+        city = city and city.upper()
+        state = state and state.upper()
+
+        result = []
+        for block in candidates:
+            if predir and block.predir != predir:
+                continue
+            if suffix and block.suffix != suffix:
+                continue
+            if postdir and block.postdir != postdir:
+                continue
+            if city and city not in (block.left_city, block.right_city):
+                continue
+            if state and state not in (block.left_state, block.right_state):
+                continue
+            if zipcode and zipcode not in (block.left_zip, block.right_zip):
+                continue
+            if number:
+                if block.to_num < number:
+                    continue
+                contains, from_num, to_num = block.contains_number(number)
+                if not contains:
+                    continue
+                try:
+                    fraction = (float(number) - from_num) / (to_num - from_num)
+                except ZeroDivisionError:
+                    fraction = 0.5
+                result.append((block, line_interpolate_point(block.geom, fraction)))
+            else:
+                result.append((block, None))
+        return result
+
+_index = None
+_index_version = None
+_suspended = 0
+_lock = threading.Lock()
+
+def get_block_index():
+    """
+    Returns the BlockIndex for this process, (re)building it if it doesn't
+    exist yet or if it has been invalidated by any process.
+
+    Raises ImproperlyConfigured if settings.CACHE_BACKEND isn't shared
+    between processes.
+    """
+    global _index, _index_version
+    if not cache_is_shared():
+        raise ImproperlyConfigured('BLOCK_INDEX_ENABLED requires a CACHE_BACKEND that is shared between processes, such as memcached')
+    version = cache.get(VERSION_CACHE_KEY)
+    index = _index
+    if index is None or version != _index_version:
+        _lock.acquire()
+        try:
+            if _index is None or version != _index_version:
+                _index = BlockIndex()
+                _index_version = version
+            index = _index
+        finally:
+            _lock.release()
+    return index
+
+def invalidate():
+    """
+    Throws away the index in this process and tells other processes to throw
+    away theirs. This is a no-op while invalidation is suspended.
+    """
+    global _index
+    if _suspended:
+        return
+    _index = None
+    cache.set(VERSION_CACHE_KEY, time.time(), VERSION_CACHE_TIMEOUT)
+
+def suspend_invalidation():
+    """
+    Stops Block saves and deletes from invalidating the index until the
+    matching resume_invalidation() call. Use this around bulk changes such as
+    a block import.
+    """
+    global _suspended
+    _suspended += 1
+
+def resume_invalidation():
+    """
+    Undoes a suspend_invalidation() call, invalidating the index once the
+    outermost suspension is over.
+    """
+    global _suspended
+    _suspended -= 1
+    invalidate()
@@ -1,7 +1,7 @@
 from django.contrib.localflavor.us.models import USStateField
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import fromstr
-from django.db.models import Q
+from django.contrib.gis.geos import Point
+from django.db.models import Q, signals
 from ebpub.metros.allmetros import get_metro
 import operator
 import re
@@ -48,6 +48,28 @@ def proper_city(block):
         raise ImproperCity("Error: Unknown city '%s' from block %s (%s)" % (block.left_city, block.id, block))
     return block_city
 
+def line_interpolate_point(line, fraction):
+    """
+    Returns the Point that is the given fraction (between 0 and 1) of the way
+    along the given LineString.
+
+    This is a pure-Python equivalent of PostGIS' line_interpolate_point(),
+    which saves a database round-trip per geocoded address.
+    """
+    coords = [c[:2] for c in line.coords]
+    lengths = []
+    for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+        lengths.append(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
+    remaining = sum(lengths) * min(max(fraction, 0.0), 1.0)
+    for i, length in enumerate(lengths):
+        if remaining <= length and length > 0:
+            (x1, y1), (x2, y2) = coords[i], coords[i+1]
+            ratio = remaining / length
+            return Point(x1 + (x2 - x1) * ratio, y1 + (y2 - y1) * ratio, srid=line.srid)
+        remaining -= length
+    x, y = coords[-1]
+    return Point(x, y, srid=line.srid)
+
 class BlockManager(models.GeoManager):
     def search(self, street, number=None, predir=None, suffix=None, postdir=None, city=None, state=None, zipcode=None, strict_number=False):
         """
@@ -71,7 +93,16 @@ class BlockManager(models.GeoManager):
         is within a number range, we don't enforce the parity
         matching. This is friendlier to the user. For example, 3181
         would match the block 3180-3188.
+
+        If settings.BLOCK_INDEX_ENABLED is True, the search is answered by
+        the in-memory index in ebpub.streets.blockindex instead of the
+        database.
         """
+        from django.conf import settings
+        if getattr(settings, 'BLOCK_INDEX_ENABLED', False):
+            from ebpub.streets.blockindex import get_block_index
+            return get_block_index().search(street, number, predir, suffix, postdir, city, state, zipcode)
+
         filters = {'street': street.upper()}
         sided_filters = []
         if predir:
@@ -102,19 +133,12 @@ class BlockManager(models.GeoManager):
                 if contains:
                     block_tuples.append((block, from_num, to_num))
             blocks = []
-            if block_tuples:
-                from django.db import connection
-                cursor = connection.cursor()
-                for block, from_num, to_num in block_tuples:
-                    try:
-                        fraction = (float(number) - from_num) / (to_num - from_num)
-                    except ZeroDivisionError:
-                        fraction = 0.5
-                    # We rely on PostGIS line_interpolate_point() because there
-                    # isn't a matching GeoDjango/Python API.
-                    cursor.execute('SELECT line_interpolate_point(%s, %s)', [block.geom.wkt, fraction])
-                    wkb_hex = cursor.fetchone()[0]
-                    blocks.append((block, fromstr(wkb_hex)))
+            for block, from_num, to_num in block_tuples:
+                try:
+                    fraction = (float(number) - from_num) / (to_num - from_num)
+                except ZeroDivisionError:
+                    fraction = 0.5
+                blocks.append((block, line_interpolate_point(block.geom, fraction)))
         else:
             blocks = list([(b, None) for b in qs])
         return blocks
@@ -257,6 +281,12 @@ class Block(models.Model):
         return self.left_zip
     zip = property(_get_zip)
 
+def invalidate_block_index(sender, **kwargs):
+    from ebpub.streets.blockindex import invalidate
+    invalidate()
+signals.post_save.connect(invalidate_block_index, sender=Block)
+signals.post_delete.connect(invalidate_block_index, sender=Block)
+
 class Street(models.Model):
     street = models.CharField(max_length=255, db_index=True) # Always uppercase
     pretty_name = models.CharField(max_length=255)
@@ -16,14 +16,15 @@ not described here: there should be a ZIP Code importer script
 available for each city.
 
 This is the part that takes the longest: populate the
-db_blockintersection table. This goes through each block (and
+db_blockintersection table. This calculates, for every block (and
 remember, there are on the order of tens of thousands of blocks in
-each city) and calculates all the other blocks which intersect with
-it. This is inherently slow, even with the heavy-lifting offloaded
-to pgsql/postgis. (If we were particularly clever, we'd probably
-write our own custom ultra-optimized C module to burn through this
-operation. But we're clever enough to recognize that this is a
-one-time cost so it's better not to be too cleverer.)
+each city), all the other blocks which intersect with it. It's done
+as a spatial self-join of the blocks table in pgsql/postgis, one
+chunk of blocks at a time, so the running time grows roughly linearly
+with the number of blocks and progress is logged after each chunk.
+Each chunk is committed separately, and pairs of blocks that are
+already in the table are skipped, so an interrupted run can simply be
+started again.
 
 In this module, execute the populate_block_intersections() function.
 
@@ -31,12 +32,15 @@ When that completes, execute the populate_intersections()
 function. This is a comparatively fast operation which just looks
 up the pre-calculated intersections for each block and creates
 a new object representing a particular intersection, eliminating
-potential duplicates.
+potential duplicates. The new intersections are inserted, and
+linked to their block intersections, with a few statements per
+chunk of block intersections.
 """
 
 import logging
 import sys
 import optparse
+import time
 from django.contrib.gis.geos import fromstr
 from django.db import connection, transaction
 from ebpub.db.models import Location
@@ -44,6 +48,10 @@ from ebpub.metros.allmetros import get_metro
 from ebpub.streets.models import Block, Street, BlockIntersection, Intersection
 from ebpub.streets.name_utils import make_dir_street_name, pretty_name_from_blocks, slug_from_blocks
 
+# The number of blocks, or block intersections, handled per statement by
+# populate_block_intersections() and populate_intersections().
+CHUNK_SIZE = 10000
+
 def intersecting_blocks(block):
     """
     Returns a list of blocks that intersect the given one.
@@ -116,75 +124,173 @@ def populate_streets(*args, **kwargs):
     cities = [l.name.upper() for l in Location.objects.filter(location_type__slug=metro['city_location_type']).exclude(location_type__name__startswith='Unknown')]
     Street.objects.exclude(city__in=cities).delete()
 
-@transaction.commit_on_success
 def populate_block_intersections(*args, **kwargs):
-    for block in Block.objects.all():
-        logging.info('Calculating the blocks that intersect %s' % block)
-        for iblock, intersection_pt in intersecting_blocks(block):
-            BlockIntersection.objects.create(
-                block=block,
-                intersecting_block=iblock,
-                location=intersection_pt
-            )
+    """
+    Populates the db_blockintersection table with a spatial self-join of
+    the blocks table, CHUNK_SIZE blocks (by ID) per statement and
+    transaction. This finds the same block intersections as
+    intersecting_blocks() does for each block.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM blocks")
+    min_id, max_id, num_blocks = cursor.fetchone()
+    logging.info("Calculating the block intersections of %s blocks" % num_blocks)
+    if not num_blocks:
+        return
+    done = total = 0
+    start = time.time()
+    for first_id in xrange(min_id, max_id + 1, CHUNK_SIZE):
+        last_id = first_id + CHUNK_SIZE - 1
+        cursor.execute("""
+            INSERT INTO streets_blockintersection (block_id, intersecting_block_id, location)
+            SELECT i.block_id, i.intersecting_block_id, i.location
+            FROM (
+                SELECT a.id AS block_id, b.id AS intersecting_block_id, ST_Intersection(a.geom, b.geom) AS location,
+                    b.predir, b.street, b.suffix, b.left_from_num, b.right_from_num
+                FROM blocks a, blocks b
+                WHERE a.id BETWEEN %s AND %s
+                    AND a.geom && b.geom
+                    AND ST_Intersects(a.geom, b.geom)
+                    AND NOT (b.street = a.street AND b.suffix = a.suffix)
+            ) AS i
+            WHERE GeometryType(i.location) = 'POINT'
+                AND NOT EXISTS (
+                    SELECT 1 FROM streets_blockintersection bi
+                    WHERE bi.block_id = i.block_id AND bi.intersecting_block_id = i.intersecting_block_id
+                )
+            ORDER BY i.block_id, i.predir, i.street, i.suffix, i.left_from_num, i.right_from_num""",
+            (first_id, last_id))
+        total += cursor.rowcount
+        transaction.commit_unless_managed()
+        cursor.execute("SELECT COUNT(*) FROM blocks WHERE id BETWEEN %s AND %s", (first_id, last_id))
+        done += cursor.fetchone()[0]
+        elapsed = max(time.time() - start, 0.001)
+        logging.info("%s of %s blocks done, %s block intersections created (%.0f blocks/second)" % (done, num_blocks, total, done / elapsed))
+
+def lookup_zipcodes(cursor, block_intersection_ids):
+    """
+    Returns a dictionary mapping each of the given BlockIntersection IDs to
+    the name of the ZIP Code that contains its location, for those that are
+    in one. This is a spatial join, which uses the index on
+    db_location.location.
+    """
+    if not block_intersection_ids:
+        return {}
+    cursor.execute("""
+        SELECT DISTINCT ON (bi.id) bi.id, loc.name
+        FROM streets_blockintersection bi, db_location loc, db_locationtype lt
+        WHERE bi.id = ANY(%s)
+            AND loc.location_type_id = lt.id
+            AND lt.name ILIKE %s
+            AND loc.name NOT LIKE %s
+            AND loc.location && bi.location
+            AND ST_Contains(loc.location, bi.location)
+        ORDER BY bi.id, loc.id""", (block_intersection_ids, 'zip%', 'Unknown%'))
+    return dict(cursor.fetchall())
+
+def insert_intersections(cursor, intersections):
+    """
+    Inserts the given unsaved Intersection objects with one statement, and
+    sets their IDs.
+    """
+    if not intersections:
+        return
+    columns = ('pretty_name', 'slug', 'predir_a', 'street_a', 'suffix_a', 'postdir_a',
+               'predir_b', 'street_b', 'suffix_b', 'postdir_b', 'zip', 'city', 'state')
+    placeholder = '(%s, GeomFromText(%%s, 4326))' % ', '.join(['%s' for c in columns])
+    params = []
+    for i in intersections:
+        params.extend([getattr(i, c) for c in columns] + [i.location.wkt])
+    cursor.execute("""
+        INSERT INTO intersections (%s, location)
+        VALUES %s
+        RETURNING id, pretty_name""" % (', '.join(columns), ', '.join([placeholder for i in intersections])),
+        params)
+    ids = dict([(pretty_name, intersection_id) for intersection_id, pretty_name in cursor.fetchall()])
+    for i in intersections:
+        i.id = ids[i.pretty_name]
 
-@transaction.commit_on_success
 def populate_intersections(*args, **kwargs):
     # On average, there are 2.3 blocks per intersection. So for
     # example in the case of Chicago, where there are 788,496 blocks,
     # we'd expect to see approximately 340,000 intersections
     logging.info("Starting to populate intersections")
     metro = get_metro()
-    zipcodes = Location.objects.filter(location_type__name__istartswith="zip").exclude(name__startswith='Unknown')
-    def lookup_zipcode(pt):
-        for zipcode in zipcodes:
-            if zipcode.location.contains(pt):
-                return zipcode
+    cursor = connection.cursor()
     intersections_seen = {}
-    for i in Intersection.objects.all():
-        intersections_seen[i.pretty_name] = i.id
-        intersections_seen[i.reverse_pretty_name()] = i.id
-    for bi in BlockIntersection.objects.iterator():
-        street_name = make_dir_street_name(bi.block)
-        i_street_name = make_dir_street_name(bi.intersecting_block)
-        # This tuple enables us to skip over intersections
-        # we've already seen. Since intersections are
-        # symmetrical---eg., "N. Kimball Ave. & W. Diversey
-        # Ave." == "W. Diversey Ave. & N. Kimball Ave."---we
-        # use both orderings.
-        seen_intersection = (u"%s & %s" % (street_name, i_street_name),
-                             u"%s & %s" % (i_street_name, street_name))
-        if seen_intersection[0] not in intersections_seen and \
-           seen_intersection[1] not in intersections_seen:
-            if bi.block.left_city != bi.block.right_city:
-                city = metro['city_name'].upper()
-            else:
-                city = bi.block.left_city
-            if bi.block.left_state != bi.block.right_state:
-                state = metro['state'].upper()
-            else:
-                state = bi.block.left_state
-            if (bi.block.left_zip != bi.block.right_zip or \
-                bi.intersecting_block.left_zip != bi.intersecting_block.right_zip) or \
-               (bi.block.left_zip != bi.intersecting_block.left_zip):
-                zipcode_obj = lookup_zipcode(bi.location)
-                if zipcode_obj:
-                    zipcode = zipcode_obj.name
+    for intersection_id, pretty_name in Intersection.objects.values_list('id', 'pretty_name'):
+        intersections_seen[pretty_name] = intersection_id
+        intersections_seen[u" & ".join(pretty_name.split(" & ")[::-1])] = intersection_id
+    cursor.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM streets_blockintersection")
+    min_id, max_id, num_bis = cursor.fetchone()
+    if not num_bis:
+        logging.info("Finished populating intersections")
+        return
+    done = created = 0
+    start = time.time()
+    for first_id in xrange(min_id, max_id + 1, CHUNK_SIZE):
+        bi_list = list(BlockIntersection.objects.select_related('block', 'intersecting_block').filter(
+            id__range=(first_id, first_id + CHUNK_SIZE - 1)).order_by('id'))
+        new = [] # (block intersection, seen_intersection, city, state) for each new intersection.
+        links = [] # (block intersection ID, intersection name) to set.
+        for bi in bi_list:
+            street_name = make_dir_street_name(bi.block)
+            i_street_name = make_dir_street_name(bi.intersecting_block)
+            # This tuple enables us to skip over intersections
+            # we've already seen. Since intersections are
+            # symmetrical---eg., "N. Kimball Ave. & W. Diversey
+            # Ave." == "W. Diversey Ave. & N. Kimball Ave."---we
+            # use both orderings.
+            seen_intersection = (u"%s & %s" % (street_name, i_street_name),
+                                 u"%s & %s" % (i_street_name, street_name))
+            if seen_intersection[0] not in intersections_seen and \
+               seen_intersection[1] not in intersections_seen:
+                if bi.block.left_city != bi.block.right_city:
+                    city = metro['city_name'].upper()
                 else:
-                    zipcode = bi.block.left_zip
+                    city = bi.block.left_city
+                if bi.block.left_state != bi.block.right_state:
+                    state = metro['state'].upper()
+                else:
+                    state = bi.block.left_state
+                new.append((bi, seen_intersection, city, state))
+                links.append((bi.id, seen_intersection[0]))
+                # The ID is filled in once the intersection is inserted.
+                intersections_seen[seen_intersection[0]] = None
+                intersections_seen[seen_intersection[1]] = None
             else:
-                zipcode = bi.block.left_zip
-            intersection = intersection_from_blocks(bi.block, bi.intersecting_block, bi.location, city, state, zipcode)
-            intersection.save()
-            logging.debug("Created intersection %s" % intersection)
-            bi.intersection = intersection
-            bi.save()
+                if not bi.intersection_id:
+                    links.append((bi.id, seen_intersection[0]))
+                logging.debug("Already seen intersection %s" % " / ".join(seen_intersection))
+
+        # Resolve the ZIP Code 'disputes' with one spatial join.
+        disputed = [bi.id for bi, seen_intersection, city, state in new if
+                    (bi.block.left_zip != bi.block.right_zip or \
+                     bi.intersecting_block.left_zip != bi.intersecting_block.right_zip) or \
+                    (bi.block.left_zip != bi.intersecting_block.left_zip)]
+        zipcodes = lookup_zipcodes(cursor, disputed)
+        intersections = []
+        for bi, seen_intersection, city, state in new:
+            zipcode = zipcodes.get(bi.id, bi.block.left_zip)
+            intersections.append(intersection_from_blocks(bi.block, bi.intersecting_block, bi.location, city, state, zipcode))
+        insert_intersections(cursor, intersections)
+        for (bi, seen_intersection, city, state), intersection in zip(new, intersections):
             intersections_seen[seen_intersection[0]] = intersection.id
             intersections_seen[seen_intersection[1]] = intersection.id
-        else:
-            if not bi.intersection:
-                bi.intersection_id = intersections_seen[seen_intersection[0]]
-                bi.save()
-            logging.debug("Already seen intersection %s" % " / ".join(seen_intersection))
+            logging.debug("Created intersection %s" % intersection)
+
+        if links:
+            cursor.execute("""
+                UPDATE streets_blockintersection
+                SET intersection_id = v.intersection_id
+                FROM (VALUES %s) AS v(id, intersection_id)
+                WHERE streets_blockintersection.id = v.id""" % ', '.join(['(%s, %s)' for link in links]),
+                [value for bi_id, name in links for value in (bi_id, intersections_seen[name])])
+        transaction.commit_unless_managed()
+        done += len(bi_list)
+        created += len(intersections)
+        elapsed = max(time.time() - start, 0.001)
+        logging.info("%s of %s block intersections done, %s intersections created (%.0f block intersections/second)" % (done, num_bis, created, done / elapsed))
     logging.info("Finished populating intersections")
 
 LOG_VERBOSITY = {0: logging.NOTSET,
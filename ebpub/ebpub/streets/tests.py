@@ -0,0 +1,103 @@
+from django.contrib.gis.geos import LineString
+from ebpub.streets.blockindex import BlockIndex
+from ebpub.streets.models import Block
+import unittest
+
+def make_block(id, predir='', street='WABASH', suffix='AVE', postdir='', left=None, right=None,
+               city='CHICAGO', right_city=None, state='IL', left_zip='60604', right_zip=None):
+    """
+    Returns an unsaved Block. left and right are (from_num, to_num) tuples,
+    or None for a side without addresses.
+    """
+    left_from_num, left_to_num = left or (None, None)
+    right_from_num, right_to_num = right or (None, None)
+    nums = [n for n in (left_from_num, left_to_num, right_from_num, right_to_num) if n is not None]
+    return Block(id=id, predir=predir, street=street, suffix=suffix, postdir=postdir,
+                 left_from_num=left_from_num, left_to_num=left_to_num,
+                 right_from_num=right_from_num, right_to_num=right_to_num,
+                 from_num=nums and min(nums) or None, to_num=nums and max(nums) or None,
+                 left_city=city, right_city=right_city or city, left_state=state, right_state=state,
+                 left_zip=left_zip, right_zip=right_zip or left_zip,
+                 geom=LineString((0, id), (0.001, id)))
+
+class BlockIndexTestCase(unittest.TestCase):
+    """
+    BlockIndex.search() must return the same blocks as BlockManager.search()
+    does from the database, for the same arguments.
+    """
+    def setUp(self):
+        self.s_200 = make_block(1, predir='S', left=(201, 299), right=(200, 298), right_zip='60605')
+        self.n_200 = make_block(2, predir='N', left=(201, 299), right=(200, 298), left_zip='60601')
+        self.s_300 = make_block(3, predir='S', left=(301, 399), right=(300, 398))
+        self.evanston = make_block(4, left=(201, 299), right=(200, 298), city='EVANSTON', left_zip='60201')
+        self.border = make_block(5, postdir='E', right=(400, 498), right_city='OAK PARK', left_zip='60302')
+        self.unnumbered = make_block(6, predir='S')
+        self.state = make_block(7, street='STATE', suffix='ST', left=(201, 299), right=(200, 298))
+        self.index = BlockIndex([self.s_200, self.n_200, self.s_300, self.evanston, self.border,
+                                 self.unnumbered, self.state])
+
+    def assertSearch(self, expected, *args, **kwargs):
+        result = self.index.search(*args, **kwargs)
+        self.assertEqual(sorted([block.id for block, pt in result]), sorted([block.id for block in expected]))
+        return result
+
+    def test_street(self):
+        result = self.assertSearch([self.s_200, self.n_200, self.s_300, self.evanston, self.border, self.unnumbered], 'wabash')
+        self.assertEqual([pt for block, pt in result], [None] * 6)
+
+    def test_unknown_street(self):
+        self.assertSearch([], 'MICHIGAN')
+        self.assertSearch([], 'MICHIGAN', '200')
+
+    def test_number(self):
+        self.assertSearch([self.s_200, self.n_200, self.evanston], 'WABASH', '250')
+        self.assertSearch([self.s_200, self.n_200, self.evanston], 'WABASH', '200')
+        self.assertSearch([self.s_200, self.n_200, self.evanston], 'WABASH', '299')
+        self.assertSearch([self.s_300], 'WABASH', '300')
+        self.assertSearch([], 'WABASH', '100')
+        self.assertSearch([], 'WABASH', '1000')
+
+    def test_number_with_letters(self):
+        self.assertSearch([self.s_300], 'WABASH', '350A')
+
+    def test_number_parity(self):
+        # The border block only has even numbers, on its right side.
+        self.assertSearch([self.border], 'WABASH', '402')
+        self.assertSearch([], 'WABASH', '401')
+
+    def test_geocoded_point(self):
+        [(block, pt)] = self.assertSearch([self.s_200], 'WABASH', '250', predir='S')
+        # 250 is on the even, right side: 200-298.
+        self.assertAlmostEqual(pt.x, 0.001 * 50 / 98)
+        self.assertAlmostEqual(pt.y, 1)
+
+    def test_directionals(self):
+        self.assertSearch([self.s_200], 'WABASH', '250', predir='s')
+        self.assertSearch([self.n_200], 'WABASH', '250', predir='N')
+        self.assertSearch([self.s_200, self.s_300, self.unnumbered], 'WABASH', predir='S')
+        self.assertSearch([self.border], 'WABASH', postdir='e')
+        self.assertSearch([], 'WABASH', '250', postdir='E')
+
+    def test_suffix(self):
+        self.assertSearch([self.state], 'STATE', '250', suffix='st')
+        self.assertSearch([], 'STATE', '250', suffix='AVE')
+
+    def test_city(self):
+        self.assertSearch([self.evanston], 'WABASH', '250', city='evanston')
+        self.assertSearch([self.s_200, self.n_200], 'WABASH', '250', city='CHICAGO')
+        # Either side of the street may match.
+        self.assertSearch([self.border], 'WABASH', '402', city='OAK PARK')
+        self.assertSearch([self.border], 'WABASH', '402', city='CHICAGO')
+
+    def test_state(self):
+        self.assertSearch([self.s_200, self.n_200, self.evanston], 'WABASH', '250', state='il')
+        self.assertSearch([], 'WABASH', '250', state='IN')
+
+    def test_zipcode(self):
+        self.assertSearch([self.s_200], 'WABASH', '250', zipcode='60605')
+        # Either side of the street may match.
+        self.assertSearch([self.s_200, self.s_300, self.unnumbered], 'WABASH', zipcode='60604')
+        self.assertSearch([self.n_200], 'WABASH', '250', zipcode='60601')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+from django.conf import settings
+
+# Cache backends whose contents are seen by every process that uses them.
+# locmem:// is private to each process, and dummy:// doesn't cache at all.
+SHARED_CACHE_SCHEMES = ('memcached', 'db', 'file')
+
+def cache_is_shared():
+    """
+    Returns True if settings.CACHE_BACKEND is shared between processes, so
+    that a value set in the cache by one process (e.g., a version number that
+    invalidates something cached in memory) is seen by all the others.
+
+    Custom backends, given as a module path, are assumed to be shared.
+
+    >>> from django.conf import settings
+    >>> old_backend = settings.CACHE_BACKEND
+    >>> for backend in ('locmem://', 'dummy:///', 'memcached://127.0.0.1:11211/', 'db://cache_table', 'myproject.cache://'):
+    ...     settings.CACHE_BACKEND = backend
+    ...     print backend, cache_is_shared()
+    locmem:// False
+    dummy:/// False
+    memcached://127.0.0.1:11211/ True
+    db://cache_table True
+    myproject.cache:// True
+    >>> settings.CACHE_BACKEND = old_backend
+    """
+    scheme = settings.CACHE_BACKEND.split(':', 1)[0]
+    return scheme in SHARED_CACHE_SCHEMES or '.' in scheme